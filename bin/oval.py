@@ -24,6 +24,9 @@ One can use wildcards: 'oval r <pattern1> <pattern2>...'
 The only wildcard character is '%'.
 One can check how a given pattern expands : 'oval l <pattern>'.
 
+Typing 'oval r -j <n> <pattern>' will run the targets with n parallel workers,
+shared by all the directories. This also applies to 'b', 'd', 'rd' and 'prod'.
+
 On top of the targets, the configuration ovalfile.py can include a list of filters.
 
 The ones in run_filters_out describe some lines to be erased from the output.
@@ -35,15 +38,158 @@ ref dictionaries.
 
 """
 
-import argparse
+# ==========================================
+# Thin client. When an oval server listens on the socket of the user
+# ('oval serve'), the command is executed by the server, in a forked copy
+# of its warm process, with the directory, the environment, the umask, the
+# resource limits and the standard streams of the client. Else, or when
+# OVAL_NO_SERVER is set, or when the server cannot take on the limits or
+# the batch job of the client, it is executed here. The socket must be
+# owned by the user, in a directory which only the user can access, and
+# the server must run as the user.
+
 import os
+import stat
+import struct
+import socket
+import json
+import array
+import signal
+import resource
+
+
+def server_socket_name():
+    'The socket of the oval server of the user, which OVAL_SOCKET can change'
+    directory = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or '/tmp', 'oval-{}'.format(os.getuid()))
+    return os.environ.get('OVAL_SOCKET') or os.path.join(directory, 'server.sock')
+
+
+def is_private(path, kind):
+    'Tell if path is of the given kind, owned by the user, and closed to the others'
+    try:
+        status = os.lstat(path)
+    except OSError:
+        return False
+    return kind(status.st_mode) and (status.st_uid == os.getuid()) and not (status.st_mode & 0o077)
+
+
+def peer_uid(connection):
+    'The user of the process at the other end of connection, or None where unknown'
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    pid, uid, gid = struct.unpack('3i', credentials)
+    return uid
+
+
+# the variables which tell the batch job of a process, whose
+# control group and accounting the commands must stay in
+batch_job_variables = ( 'SLURM_JOB_ID', 'PBS_JOBID', 'LSB_JOBID', 'JOB_ID' )
+
+
+def process_context():
+    '''The umask, the resource limits and the batch job of this process,
+    which the commands it runs inherit.'''
+    umask = os.umask(0)
+    os.umask(umask)
+    rlimits = { name: resource.getrlimit(getattr(resource, name)) for name in dir(resource)
+                if name.startswith('RLIMIT_') }
+    job = [ os.environ.get(name) for name in batch_job_variables ]
+    return { 'umask': umask, 'rlimits': rlimits, 'job': job }
+
+
+def apply_context(context):
+    '''Give this process the umask and the resource limits of context, and
+    tell if it succeeded, in the same batch job.'''
+    current = process_context()
+    if not context or context.get('job') != current['job']:
+        return False
+    try:
+        for name, limits in context['rlimits'].items():
+            if tuple(limits) != current['rlimits'].get(name):
+                resource.setrlimit(getattr(resource, name), tuple(limits))
+    except (AttributeError, TypeError, ValueError, OSError):
+        return False
+    os.umask(context['umask'])
+    return True
+
+
+def run_client(socket_name):
+    '''Have the server execute the command, and return its exit status, or
+    None if no trusted server listens on socket_name.'''
+    if not (is_private(os.path.dirname(os.path.abspath(socket_name)), stat.S_ISDIR)
+            and is_private(socket_name, stat.S_ISSOCK)):
+        print('warning: ignoring the socket {}, which is not private to the user'.format(socket_name),
+              file=sys.stderr)
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_name)
+    except OSError:
+        client.close()
+        return None
+    if peer_uid(client) not in ( None, os.getuid() ):
+        client.close()
+        print('warning: ignoring the server on {}, which runs as another user'.format(socket_name),
+              file=sys.stderr)
+        return None
+    # the standard streams are passed along the first byte
+    client.sendmsg([ b'\0' ], [ (socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [ 0, 1, 2 ])) ])
+    request = { 'argv': sys.argv[1:], 'cwd': os.getcwd(), 'env': dict(os.environ), 'context': process_context() }
+    client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+    replies = client.makefile('rb')
+    pid = None
+    while True:
+        try:
+            line = replies.readline()
+            if not line:
+                return 1
+            reply = json.loads(line)
+            if reply.get('fallback'):
+                return None
+            pid = reply.get('pid', pid)
+            if 'status' in reply:
+                return reply['status']
+        except KeyboardInterrupt:
+            # the child of the server is not in the process group of the terminal
+            if pid:
+                os.kill(pid, signal.SIGINT)
+
+
+if ('serve' not in sys.argv[1:]) and not os.environ.get('OVAL_NO_SERVER') and os.path.exists(server_socket_name()):
+    status = run_client(server_socket_name())
+    if status is not None:
+        sys.exit(status)
+
+
+import argparse
+import builtins
 import os.path
 import re
+import mmap
+import time
+import shutil
 import subprocess
 import hashlib
 import logging
-import concurrent.futures
+import functools
+import inspect
+import importlib.util
+import fnmatch
+import contextvars
 import difflib
+import glob
+import heapq
+import itertools
+import math
+import threading
+import shlex
+import errno
+import zlib
+import lzma
+import select
+import tempfile
+import pickle
 
 
 # ==========================================
@@ -87,11 +233,34 @@ script_name = os.path.basename(sys.argv[0])
 if script_name.endswith('.py'):
     script_name = script_name[:-3]
 
+class BlockFileHandler(logging.FileHandler):
+
+    '''Log file written by large blocks, rather than flushed after each line,
+    yet flushed at least every flush_delay seconds, and before a fork, which
+    would copy the pending lines.'''
+
+    flush_delay = 1.
+    buffer_size = 1 << 16
+
+    def __init__(self, file_name):
+        self.flushed = time.monotonic()
+        super(BlockFileHandler, self).__init__(file_name, mode="w", encoding="utf-8")
+        self.setFormatter(logging.Formatter("%(asctime)s :: %(name)s :: %(levelname)-8s :: %(message)s"))
+        self.setLevel(logging.DEBUG)
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=self.buffer_size, encoding=self.encoding)
+
+    def flush(self, force=False):
+        # called by emit after each record
+        now = time.monotonic()
+        if force or now - self.flushed >= self.flush_delay:
+            self.flushed = now
+            super(BlockFileHandler, self).flush()
+
+
 log_file_name = "."+script_name+".log"
-log_file_handler = logging.FileHandler(log_file_name, mode="w", encoding="utf-8")
-log_file_handler.setFormatter( \
-    logging.Formatter("%(asctime)s :: %(name)s :: %(levelname)-8s :: %(message)s"))
-log_file_handler.setLevel(logging.DEBUG)
+log_file_handler = BlockFileHandler(log_file_name)
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
@@ -99,57 +268,1506 @@ logger.addHandler(console_handler)
 logger.addHandler(log_file_handler)
 
 
+def flush_log_file():
+    log_file_handler.flush(force=True)
+
+
+os.register_at_fork(before=flush_log_file)
+
+
+# ==========================================
+# Log capture, so to keep together the output of a target
+# which is processed concurrently with others
+
+log_capture = contextvars.ContextVar('log_capture', default=None)
+
+
+class CaptureFilter(logging.Filter):
+
+    'Divert the records into the current capture list, if any'
+
+    def filter(self, record):
+        records = log_capture.get()
+        if records is None:
+            return True
+        # format now, so that the record can be pickled back to the main process
+        record.msg = record.getMessage()
+        record.args = None
+        records.append(record)
+        return False
+
+
+logger.addFilter(CaptureFilter())
+
+
+class LogSpool:
+
+    '''Capture list which pickles the records into a temporary file, so that
+    the output of a long target stays neither in memory, nor in the pipe
+    of the pool, until it is displayed.'''
+
+    def __init__(self):
+        fd, self.file_name = tempfile.mkstemp(prefix='oval-', suffix='.spool')
+        self.content = os.fdopen(fd, 'wb', buffering=1<<20)
+        self.pickler = pickle.Pickler(self.content, pickle.HIGHEST_PROTOCOL)
+        # no memo, which would keep all the records
+        self.pickler.fast = True
+
+    def append(self, record):
+        self.pickler.dump(( record.levelno, record.msg, record.created, getattr(record, 'report', None) ))
+
+    def close(self):
+        self.content.close()
+        return self.file_name
+
+
+def replay_spool(file_name):
+    'Display the records of a spool file, in order, and remove it'
+    try:
+        with open(file_name, 'rb', buffering=1<<20) as content:
+            unpickler = pickle.Unpickler(content)
+            while True:
+                try:
+                    levelno, msg, created, report = unpickler.load()
+                except EOFError:
+                    break
+                record = logger.makeRecord(logger.name, levelno, '', 0, msg, None, None,
+                                           extra=None if report is None else { 'report': report })
+                record.created = created
+                record.msecs = (created - int(created)) * 1000
+                logger.handle(record)
+    finally:
+        os.remove(file_name)
+
+
+# ==========================================
+# Tracing. When enabled, the calls of the main functions are recorded as
+# the complete events of a Chrome trace, one for each phase of a target,
+# together with counters. The events of a worker process are sent back
+# with its log records.
+
+trace_events = contextvars.ContextVar('trace_events', default=None)
+trace_counters = contextvars.ContextVar('trace_counters', default=None)
+
+
+def traced(phase):
+    'Decorate a function, so that each call is traced as a span of phase'
+    def decorator(function):
+        def span(fargs):
+            # the name of the target, or of the workdir
+            counters = {}
+            if fargs and isinstance(fargs[0], dict) and 'name' in fargs[0]:
+                counters['target'] = fargs[0]['name']
+            elif fargs and isinstance(fargs[0], str):
+                counters['path'] = fargs[0]
+            return counters, trace_counters.set(counters), time.perf_counter()
+        def record(events, counters, token, start):
+            trace_counters.reset(token)
+            events.append({ 'name': phase, 'cat': 'oval', 'ph': 'X', 'pid': os.getpid(),
+                            'tid': threading.get_ident(), 'ts': round(start * 1e6),
+                            'dur': round((time.perf_counter() - start) * 1e6), 'args': counters })
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*fargs, **kwargs):
+                events = trace_events.get()
+                if events is None:
+                    return await function(*fargs, **kwargs)
+                counters, token, start = span(fargs)
+                try:
+                    return await function(*fargs, **kwargs)
+                finally:
+                    record(events, counters, token, start)
+            return async_wrapper
+        @functools.wraps(function)
+        def wrapper(*fargs, **kwargs):
+            events = trace_events.get()
+            if events is None:
+                return function(*fargs, **kwargs)
+            counters, token, start = span(fargs)
+            try:
+                return function(*fargs, **kwargs)
+            finally:
+                record(events, counters, token, start)
+        return wrapper
+    return decorator
+
+
+def trace_count(**increments):
+    'Add increments to the counters of the current span, if traced'
+    counters = trace_counters.get()
+    if counters is not None:
+        for name, value in increments.items():
+            counters[name] = counters.get(name, 0) + value
+
+
+def write_trace(file_name, events):
+    'Write events as a Chrome trace, and log a summary of each phase'
+    with open(file_name, 'w') as content:
+        json.dump({ 'traceEvents': events, 'displayTimeUnit': 'ms' }, content)
+    phases = {}
+    for event in events:
+        phase = phases.setdefault(event['name'], { 'count': 0, 'total': 0, 'max': 0, 'counters': {} })
+        phase['count'] += 1
+        phase['total'] += event['dur']
+        phase['max'] = max(phase['max'], event['dur'])
+        for name, value in event['args'].items():
+            if isinstance(value, int):
+                phase['counters'][name] = phase['counters'].get(name, 0) + value
+    logging.info('{:10} {:>6} {:>10} {:>10}  {}'.format('phase', 'count', 'total(s)', 'max(s)', 'counters'))
+    for name, phase in sorted(phases.items(), key=lambda item: -item[1]['total']):
+        logging.info('{:10} {:6} {:10.3f} {:10.3f}  {}'.format(
+            name, phase['count'], phase['total'] / 1e6, phase['max'] / 1e6,
+            ' '.join('{}={}'.format(k, v) for k, v in sorted(phase['counters'].items()))))
+
+
+# ==========================================
+# Reports. When asked, each processed target is summarized by a record,
+# which is logged at the end of the target, so that it goes from the
+# workers to the main process along with the other log records. There,
+# the reports are written as JSON lines, and into a JUnit XML file.
+
+target_report = contextvars.ContextVar('target_report', default=None)
+
+
+class ReportHandler(logging.Handler):
+
+    'Collect the reports of the targets, and write them as JSON lines'
+
+    def __init__(self, file_name):
+        super(ReportHandler, self).__init__(logging.DEBUG)
+        self.reports = []
+        self.content = open(file_name, 'w') if file_name else None
+
+    def emit(self, record):
+        current = getattr(record, 'report', None)
+        if current is None:
+            return
+        self.reports.append(current)
+        if self.content:
+            self.content.write(json.dumps(current) + '\n')
+
+    def close(self):
+        if self.content:
+            self.content.close()
+            self.content = None
+        super(ReportHandler, self).close()
+
+
+# the handler of the reports, when asked
+report_handler = None
+
+
+def report(**fields):
+    'Add fields to the report of the current target, if any'
+    current = target_report.get()
+    if current is not None:
+        current.update(fields)
+
+
+def begin_report(target, subcommand):
+    'Start the report of target, and return it with the token of its context'
+    if report_handler is None:
+        return None, None
+    current = { 'workdir': os.path.relpath(target['workdir'], CWD), 'target': target['name'],
+                'subcommand': subcommand, 'status': None, 'returncode': None, 'duration': time.perf_counter() }
+    return current, target_report.set(current)
+
+
+def end_report(current, token, returncode):
+    'End the report of a target, and log it'
+    if current is None:
+        return
+    target_report.reset(token)
+    current['duration'] = round(time.perf_counter() - current['duration'], 3)
+    current['returncode'] = returncode
+    current['status'] = 'passed' if returncode == 0 else 'failed'
+    logging.debug('report of {}'.format(current['target']), extra={ 'report': current })
+
+
+def write_junit(file_name, reports):
+    'Write the reports as a JUnit XML file, with a test suite per workdir'
+    import xml.etree.ElementTree
+    suites = {}
+    for current in reports:
+        suites.setdefault(current['workdir'], []).append(current)
+    root = xml.etree.ElementTree.Element('testsuites', name='oval', tests=str(len(reports)),
+        failures=str(sum(1 for current in reports if current['status'] != 'passed')))
+    for workdir, cases in suites.items():
+        suite = xml.etree.ElementTree.SubElement(root, 'testsuite', name=workdir, tests=str(len(cases)),
+            failures=str(sum(1 for current in cases if current['status'] != 'passed')),
+            time=str(round(sum(current['duration'] for current in cases), 3)))
+        for current in cases:
+            case = xml.etree.ElementTree.SubElement(suite, 'testcase', classname=workdir,
+                                                    name=current['target'], time=str(current['duration']))
+            if current['status'] != 'passed':
+                message = current.get('error') or '{} differences'.format(current.get('diffs', 0))
+                failure = xml.etree.ElementTree.SubElement(case, 'failure', message=message)
+                failure.text = '\n'.join(current.get('differences', []))
+    xml.etree.ElementTree.ElementTree(root).write(file_name, encoding='utf-8', xml_declaration=True)
+
+
+# ==========================================
+# Filters
+
+@functools.lru_cache(maxsize=None)
+def wildcard_exp(pattern):
+    'Compile a pattern where % is the wildcard'
+    return re.compile('^' + pattern.replace('%', '.*') + '$')
+
+
+# the filters which cannot be merged into a single alternation,
+# because they refer to their own groups by number or name
+unmergeable_exp = re.compile(r'\\[0-9]|\(\?P=|\(\?P<|\(\?\(|\(\?[aiLmsux]')
+
+
+class FilterSet:
+
+    'A list of filters, merged into one regular expression'
+
+    def __init__(self, patterns):
+        self.exps = [wildcard_exp(p) for p in patterns]
+        # each filter is wrapped into a group of the merged expression ;
+        # indexes maps such a group to the filter, and spans to its own groups
+        self.indexes = {}
+        self.spans = []
+        alternatives = []
+        first = 1
+        for i, exp in enumerate(self.exps):
+            self.indexes[first] = i
+            self.spans.append((first, first + exp.groups))
+            alternatives.append('({})'.format(exp.pattern))
+            first += exp.groups + 1
+        self.merged = None
+        if alternatives and not [p for p in patterns if unmergeable_exp.search(p)]:
+            self.merged = re.compile('|'.join(alternatives))
+
+    def __bool__(self):
+        return len(self.exps) > 0
+
+    def search(self, line):
+        'Tell if any filter matches the line'
+        if self.merged:
+            return self.merged.match(line) is not None
+        for exp in self.exps:
+            if exp.match(line):
+                return True
+        return False
+
+    def matches(self, line):
+        'Return the groups of each filter which matches the line'
+        return [groups for i, groups in self.indexed_matches(line)]
+
+    def indexed_matches(self, line):
+        'Return the index and the groups of each filter which matches the line'
+        if not self.merged:
+            return [(i, fmatch.groups()) for i, fmatch in enumerate([fexp.match(line) for fexp in self.exps]) if fmatch]
+        fmatch = self.merged.match(line)
+        if not fmatch:
+            return []
+        # the alternation gives the first matching filter,
+        # the following ones must still be checked one by one
+        i = self.indexes[fmatch.lastindex]
+        first, last = self.spans[i]
+        result = [(i, fmatch.groups()[first:last])]
+        for j, fexp in enumerate(self.exps[i+1:], i+1):
+            other = fexp.match(line)
+            if other:
+                result.append((j, other.groups()))
+        return result
+
+
+@functools.lru_cache(maxsize=None)
+def compile_filters(patterns):
+    'Return the FilterSet for the given tuple of patterns, shared by all targets'
+    return FilterSet(patterns)
+
+
+# ==========================================
+# Optional modules. numpy and zstandard are only imported the first time
+# that a comparison with tolerances, or a .zst log, needs them, so that
+# they do not slow down the start of the other commands.
+
+@functools.lru_cache(maxsize=None)
+def optional_module(name):
+    'Return the module name, imported on its first use, or None if it is not installed'
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+# ==========================================
+# Compressed logs. The .out and .ref files can be compressed, as
+# '<name>.out.gz', '<name>.out.xz' or '<name>.out.zst' (when the module
+# zstandard is installed). They are found whatever their compression, and
+# the runs compress their output on the fly according to the 'compress'
+# setting of the target, of the ovalfile, or '--compress'.
+
+# the modules of the compressions, imported by compression_module()
+compressions = { '.gz': 'gzip', '.xz': 'lzma', '.zst': 'zstandard' }
+
+# the options of the compressors, when they are not the ones of the command line tools
+compress_options = { '.gz': { 'compresslevel': 6 } }
+
+
+def compression_module(suffix):
+    'Return the module of the compression suffix, or None if it is not installed'
+    return optional_module(compressions[suffix])
+
+
+def decompress_errors():
+    'The exceptions raised by a corrupted log, which include the ones of zstandard once it is imported'
+    zstandard = sys.modules.get('zstandard')
+    return (OSError, EOFError, zlib.error, lzma.LZMAError) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+def is_compressed(file_name):
+    return os.path.splitext(file_name)[1] in compressions
+
+
+def open_log(file_name, mode='r'):
+    'Open a log, compressed according to its suffix, in text mode unless mode has a b'
+    suffix = os.path.splitext(file_name)[1]
+    if suffix not in compressions:
+        return open(file_name, mode)
+    module = compression_module(suffix)
+    if module is None:
+        raise OSError(errno.ENOTSUP, 'module {} not installed'.format(compressions[suffix]))
+    options = compress_options.get(suffix, {}) if 'w' in mode else {}
+    if 'b' not in mode:
+        mode += 't'
+    return module.open(file_name, mode, **options)
+
+
+def written_size(content):
+    'Return the number of uncompressed bytes written into the log content'
+    content.flush()
+    return content.buffer.tell()
+
+
+@functools.lru_cache(maxsize=None)
+def compression_suffix(compress):
+    'Return the suffix of the compression compress, or an empty string, once told why, if it is unavailable'
+    if ('.' + compress) not in compressions or not compression_module('.' + compress):
+        logging.warning('cannot compress with {}, the outputs are not compressed'.format(compress))
+        return ''
+    return '.' + compress
+
+
+def log_compression(target):
+    'Return the suffix of the compression of the logs written for target, or an empty string'
+    compress = target_setting(target, 'compress')
+    if not compress:
+        return ''
+    return compression_suffix(compress)
+
+
+def out_file(target):
+    'The log which a run of target writes'
+    return target_file(target, '.out' + log_compression(target))
+
+
+def find_log(target, suffix):
+    'Return the existing log of target with suffix .out or .ref, compressed or not, else None'
+    for compression in ( '', ) + tuple(compressions):
+        file_name = target_file(target, suffix + compression)
+        if os.path.isfile(file_name):
+            return file_name
+    return None
+
+
+def remove_other_logs(target, suffix, file_name):
+    'Remove the logs of target with suffix, other than file_name, whose compression differs'
+    for compression in ( '', ) + tuple(compressions):
+        other = target_file(target, suffix + compression)
+        if other != file_name and os.path.isfile(other):
+            os.remove(other)
+
+
+# ==========================================
+# Reading of log files
+
+def read_data(file_name):
+    'Return the content of file_name, mapped in memory'
+    with open(file_name, 'rb') as content:
+        if os.fstat(content.fileno()).st_size > 0:
+            return mmap.mmap(content.fileno(), 0, access=mmap.ACCESS_READ)
+        return b''
+
+
+def read_error(file_name, err):
+    'The line which replaces the content of a file which cannot be read'
+    message = getattr(err, 'strerror', None) or str(err)
+    logging.debug('cannot read {}: {}'.format(file_name, message))
+    return '{}: {}: {}'.format(script_name, file_name, message)
+
+
+def read_lines(file_name, nb_tail=0, strip=True):
+    """Return a lazy iterator on the lines of file_name, and the list of its
+    nb_tail last lines, which are excluded from the iterator. If strip is True,
+    the trailing whitespace of the file is ignored. A file which cannot be read
+    gives a single line with the error message, as 'cat file 2>&1' did. For a
+    compressed file, the tail is only filled once the iterator is exhausted."""
+    try:
+        if is_compressed(file_name):
+            tail = []
+            return stream_lines(file_name, open_log(file_name, 'rb'), nb_tail, strip, tail), tail
+        data = read_data(file_name)
+    except decompress_errors() as err:
+        return iter([ read_error(file_name, err) ]), []
+    end = len(data)
+    if strip:
+        while end > 0 and data[end-1:end].isspace():
+            end -= 1
+    # reverse scan for the last lines
+    tail = []
+    for i in range(nb_tail):
+        if end == 0:
+            break
+        start = data.rfind(b'\n', 0, end) + 1
+        tail.insert(0, decode_lines(data[start:end])[0])
+        end = max(start - 1, 0)
+        if data[end-1:end] == b'\r':
+            end -= 1
+    if strip and tail:
+        while end > 0 and data[end-1:end].isspace():
+            end -= 1
+    return iter_lines(data, end), tail
+
+
+def decode_lines(chunk):
+    return chunk.replace(b'\r\n', b'\n').decode('utf-8', 'replace').split('\n')
+
+
+def stream_lines(file_name, content, nb_tail, strip, tail, chunk_size=1<<20):
+    '''Yield the lines of the binary stream content, decompressing and decoding
+    about chunk_size bytes at a time, as read_lines does for a mapped file,
+    and put the nb_tail last lines into tail when the stream ends. Only the
+    lines which may belong to the tail or to the trailing whitespace are
+    held back meanwhile.'''
+    pending = []
+    nb_yielded = 0
+    rest = b''
+    try:
+        with content:
+            while True:
+                chunk = content.read(chunk_size)
+                if not chunk:
+                    break
+                chunk = rest + chunk
+                stop = chunk.rfind(b'\n')
+                if stop < 0:
+                    rest = chunk
+                    continue
+                rest = chunk[stop+1:]
+                # with its last end of line, which may be a \r\n
+                pending.extend(decode_lines(chunk[:stop+1])[:-1])
+                # a line is yielded once enough lines follow it to fill the tail,
+                # and, if strip, one more line which is not blank
+                if not strip:
+                    held = max(len(pending) - nb_tail, 0)
+                else:
+                    held = len(pending)
+                    nb_filled = 0
+                    while held > 0 and nb_filled <= nb_tail:
+                        held -= 1
+                        if pending[held].strip():
+                            nb_filled += 1
+                    if nb_filled <= nb_tail:
+                        held = 0
+                if held:
+                    yield from pending[:held]
+                    del pending[:held]
+                    nb_yielded += held
+    except decompress_errors() as err:
+        yield from pending
+        yield read_error(file_name, err)
+        return
+    lines = pending + decode_lines(rest)
+    def strip_end():
+        while lines and not lines[-1].strip():
+            lines.pop()
+        if lines:
+            lines[-1] = lines[-1].rstrip()
+    if strip:
+        strip_end()
+    for i in range(nb_tail):
+        # as for a mapped file, which ends with an empty remainder
+        if lines in ( [], [ '' ] ):
+            break
+        tail.insert(0, lines.pop())
+    if strip and tail:
+        strip_end()
+    # as for a mapped file, whose empty remainder still gives a line
+    yield from lines if (lines or nb_yielded) else [ '' ]
+
+
+def iter_lines(data, end, chunk_size=1<<20):
+    'Yield the lines of data[:end], decoding about chunk_size bytes at a time'
+    pos = 0
+    while True:
+        stop = data.find(b'\n', min(pos + chunk_size, end), end)
+        if stop < 0:
+            yield from decode_lines(data[pos:end])
+            return
+        # with its end of line, so that a \r\n is never cut
+        yield from decode_lines(data[pos:stop+1])[:-1]
+        pos = stop + 1
+
+
+# ==========================================
+# Persistent cache of the diff verdicts,
+# one file per target, in the .oval subdirectory of the workdir
+
+cache_dir = '.oval'
+cache_version = 7
+
+# the verdicts with more messages are not worth keeping
+max_cached_messages = 1000
+
+
+def file_signature(file_name):
+    'Size and modification time of file_name, or None if it does not exist'
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def file_digest(file_name):
+    with open(file_name, 'rb') as content:
+        if os.fstat(content.fileno()).st_size == 0:
+            return hashlib.blake2b(b'').hexdigest()
+        with mmap.mmap(content.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return hashlib.blake2b(data).hexdigest()
+
+
+# the contents of the diff caches loaded by the server, with the signature
+# of their file, which its children inherit
+served_caches = {}
+
+
+def load_served_cache(file_name):
+    signature = file_signature(file_name)
+    if not signature or (file_name in served_caches and served_caches[file_name][0] == signature):
+        return
+    try:
+        with open(file_name) as content:
+            served_caches[file_name] = ( signature, json.load(content) )
+    except (OSError, ValueError):
+        pass
+
+
+class DiffCache:
+
+    '''The digests of the files of a target, keyed on their size and modification
+    time, and the result of their last comparison, or filtering, keyed on the
+    digests of the files and on the options of the subcommand.'''
+
+    def __init__(self, target):
+        self.file_name = os.path.join(target['workdir'], cache_dir, target['name']+'.cache.json')
+        self.enabled = not args.no_cache
+        self.modified = False
+        self.content = None
+        served = served_caches.get(self.file_name)
+        if self.enabled and served and served[0] == file_signature(self.file_name):
+            self.content = served[1]
+        elif self.enabled:
+            try:
+                with open(self.file_name) as content:
+                    self.content = json.load(content)
+            except (OSError, ValueError):
+                pass
+        if not self.content or self.content.get('version') != cache_version:
+            self.content = { 'version': cache_version, 'files': {}, 'diff': None,
+                             'filter-out': None, 'filter-ref': None }
+
+    def digest(self, file_name):
+        '''Digest of file_name, only computed when its size or modification time
+        has changed since it was last cached, or None if it does not exist.'''
+        signature = file_signature(file_name)
+        if not self.enabled or not signature:
+            return None
+        key = os.path.basename(file_name)
+        entry = self.content['files'].get(key)
+        if entry and entry['signature'] == signature:
+            return entry['digest']
+        digest = file_digest(file_name)
+        self.content['files'][key] = { 'signature': signature, 'digest': digest }
+        self.modified = True
+        return digest
+
+    def diff_key(self, out_file_name, ref_file_name, *options):
+        out_digest = self.digest(out_file_name)
+        ref_digest = self.digest(ref_file_name)
+        if (out_digest is None) or (ref_digest is None):
+            return None
+        # as read back from the cache file, with lists for the tuples
+        return json.loads(json.dumps([ out_digest, ref_digest, options ]))
+
+    def filter_key(self, file_name, *options):
+        digest = self.digest(file_name)
+        if digest is None:
+            return None
+        return json.loads(json.dumps([ digest, options ]))
+
+    def verdict(self, key, subcommand='diff'):
+        last = self.content[subcommand]
+        if key and last and last['key'] == key:
+            logging.debug('cached {} for {}'.format(subcommand, self.file_name))
+            return last['verdict']
+        return None
+
+    def set_verdict(self, key, verdict, subcommand='diff'):
+        if key:
+            self.content[subcommand] = { 'key': key, 'verdict': verdict }
+            self.modified = True
+
+    def save(self):
+        if not self.enabled or not self.modified:
+            return
+        tmp_file_name = '{}.{}'.format(self.file_name, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+            with open(tmp_file_name, 'w') as content:
+                json.dump(self.content, content)
+            os.replace(tmp_file_name, self.file_name)
+        except OSError as err:
+            # a read-only workdir goes on without cache
+            logging.debug('cannot write the diff cache {}: {}'.format(self.file_name, err))
+            self.enabled = False
+            if os.path.exists(tmp_file_name):
+                os.remove(tmp_file_name)
+        self.modified = False
+
+
+def filtered_groups(target, file_name, subcommand):
+    '''Return the groups matched by the filters of target in the lines of
+    file_name, unless the cache already knows them for the same file.'''
+    cache = DiffCache(target)
+    patterns = tuple(target['diff_filters_in'])
+    key = cache.filter_key(file_name, patterns)
+    groups = cache.verdict(key, subcommand)
+    if groups is None:
+        matches, tail = extract_matches(file_name, patterns, strip=False)
+        groups = [ grp for grps in matches for grp in grps ]
+        if len(groups) <= max_cached_messages:
+            cache.set_verdict(key, groups, subcommand)
+    cache.save()
+    return groups
+
+
+@traced('filter')
+def extract_matches(file_name, patterns, nb_tail=0, strip=True, indexed=False):
+    fexps = compile_filters(patterns)
+    # when indexed, each match is paired with the index of its filter
+    collect = fexps.indexed_matches if indexed else fexps.matches
+    lines, tail = read_lines(file_name, nb_tail, strip)
+    matches = []
+    nb_lines = 0
+    for line in lines:
+        nb_lines += 1
+        matches.extend(collect(line))
+    trace_count(lines=nb_lines, matches=len(matches))
+    return matches, tail
+
+
 # ==========================================
 # SUBCOMMAND: Build
 
-def apply_build(target,multi,expanded):
-    command = 'make {}.exe'.format(target['name'])
+# The executables of all the selected targets of a directory are built
+# by a single command. If it fails, a check command tells which
+# executables are still out of date. Both can be set by the variables
+# build_command and build_check of the ovalfile, or from the command line.
+# When the directories are built concurrently, by the pool of -j, the
+# {jobs} of their commands share the -j budget, rather than each one
+# starting up to -j processes.
+
+default_build_command = 'make -k -j{jobs} {exes}'
+default_build_check = 'make -q {exe}'
+
+
+def build_settings(workdir):
+    'Return the build and check commands of workdir'
+    config = load_ovalfile(workdir)
+    command = args.build_command or getattr(config, 'build_command', None)
+    check = args.build_check or getattr(config, 'build_check', None)
+    if command is None:
+        command = default_build_command
+        check = check or default_build_check
+    return command, check
+
+
+def report_builds(targets, failed, error='build failed'):
+    'Report the targets whose build failed, and the others when only building'
+    for target in targets:
+        if target['name'] in failed or subcommand == 'build':
+            current, token = begin_report(target, subcommand)
+            if target['name'] in failed:
+                report(error=error)
+            end_report(current, token, 1 if target['name'] in failed else 0)
+
+
+def is_built(workdir, targets, check):
+    'Tell if the executables of the targets of workdir are all built, with a single check command'
+    command = check.format(exe=' '.join(target['name']+'.exe' for target in targets),
+                           name=' '.join(target['name'] for target in targets))
+    trace_count(processes=1)
+    proc = subprocess.run(command, shell=True, executable='bash', cwd=workdir,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return proc.returncode == 0
+
+
+@traced('build')
+def apply_builds(workdir,targets,multi,expanded,jobs=None):
+    """Build the executables of the targets with a single command, with jobs
+    parallel processes, by default the ones of -j, and return the return
+    code together with the names of the targets which failed."""
+    if not targets:
+        return 0, []
+    command, check = build_settings(workdir)
+    command = command.format(jobs=jobs or args.jobs or 1,
+                             exes=' '.join(target['name']+'.exe' for target in targets),
+                             targets=' '.join(target['name'] for target in targets))
     logging.info(command)
-    proc = subprocess.run(command, shell=True, executable='bash', check=True)
-    return proc.returncode
+    trace_count(processes=1)
+    proc = subprocess.Popen(command, shell=True, executable='bash', cwd=workdir,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True, errors='replace')
+    with proc.stdout:
+        for line in proc.stdout:
+            logging.info(line.rstrip('\n'))
+    if proc.wait() == 0:
+        report_builds(targets, [])
+        return 0, []
+    if check is None:
+        # nothing tells which targets failed, so the whole directory does
+        failed = [ target['name'] for target in targets ]
+        logging.error('build failed, and no build check tells for which targets')
+        report_builds(targets, failed, 'build of the directory failed')
+        return 1, failed
+    failed = [ target['name'] for target in targets if not is_built(workdir, [ target ], check) ]
+    for target_name in failed:
+        if multi or expanded:
+            logging.error(target_name + ': build failed')
+        else:
+            logging.error('build failed')
+    report_builds(targets, failed)
+    return 1, failed
+
+
+time_exp = re.compile('^(\w+)\s+([0-9]+)m([.0-9]+)s$')
+
+
+# ==========================================
+# Resources used by the targets, measured when running
+# and saved into <name>.stats.json, then copied into
+# <name>.ref.stats.json when validating
+
+def stats_file(target, suffix):
+    return target_file(target, ('' if suffix == '.out' else suffix) + '.stats.json')
+
+
+def read_stats(target, suffix):
+    try:
+        with open(stats_file(target, suffix)) as content:
+            return json.load(content)
+    except (OSError, ValueError):
+        return None
+
+
+def write_stats(target, suffix, stats):
+    with open(stats_file(target, suffix), 'w') as content:
+        json.dump(stats, content, indent=2)
+
+
+def wait_child(proc):
+    'Wait for the end of proc, and return its exit code and resource usage'
+    pid, status, rusage = os.wait4(proc.pid, 0)
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return proc.returncode, rusage
+
+
+def resource_stats(real, rusage, returncode):
+    return {
+        'real': round(real, 3),
+        'user': round(rusage.ru_utime, 3),
+        'sys': round(rusage.ru_stime, 3),
+        'max_rss_kb': rusage.ru_maxrss,
+        'inblock': rusage.ru_inblock,
+        'oublock': rusage.ru_oublock,
+        'returncode': returncode,
+    }
+
+
+# ==========================================
+# Limits of the runs. Each one is taken from the target, else from the
+# ovalfile, else from the command line. The command runs in its own
+# process group, so that the whole tree is killed when the timeout expires.
+# The cpu time and the virtual memory are limited by the shell, with
+# ulimit, rather than by a preexec_fn, which is not safe in the processes
+# which have threads, such as the workers of the pool or the event loop.
+
+def target_setting(target, name):
+    'Return the setting name of target, else of its ovalfile, else of the command line'
+    value = target.get(name)
+    if value is None:
+        value = getattr(load_ovalfile(target['workdir']), name, None)
+    if value is None:
+        value = getattr(args, name)
+    return value
+
+
+def limit_commands(cpu_time, max_vm):
+    'Return the bash commands which set the limits of a run, or an empty string'
+    commands = []
+    if cpu_time:
+        # SIGXCPU at the soft limit, then SIGKILL one second later
+        seconds = math.ceil(cpu_time)
+        commands.append('ulimit -S -t {} && ulimit -H -t {}'.format(seconds, seconds + 1))
+    if max_vm:
+        commands.append('ulimit -v {}'.format(int(max_vm * 1024)))
+    return ' && '.join(commands)
+
+
+def expire(proc, expired):
+    'Kill the process group of proc, when its timeout expired'
+    expired.set()
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+# the messages of a failed allocation, in python, C++, C and Fortran
+memory_exp = re.compile(r'MemoryError|std::bad_alloc|Cannot allocate memory|[Oo]ut of memory|ENOMEM')
+
+
+def exceeded_limit(expired, returncode, rusage, cpu_time, max_vm, out_of_memory):
+    'Return the name of the limit the run exceeded, if any'
+    if expired.is_set():
+        return 'timeout'
+    # the cpu time is limited for each process, not for their sum, and
+    # bash exits with 128 plus the signal which killed its last command
+    if cpu_time and returncode in ( -signal.SIGXCPU, 128 + signal.SIGXCPU ):
+        return 'cpu_time'
+    # a failed allocation exits as any other error, so that the memory
+    # limit is only blamed when the output tells a failed allocation,
+    # or when the resident memory came close to the limit
+    if max_vm and returncode != 0 and (out_of_memory or rusage.ru_maxrss >= .9 * max_vm * 1024):
+        return 'max_vm'
+    return None
+
+
+def target_time(stats, tail, time_option):
+    """Return the time_option duration from the stats of the target, or, for
+    the logs produced by former versions, from the output of bash 'time'
+    at their end."""
+    if stats is not None:
+        return stats.get(time_option, 0.)
+    result = 0.
+    for line in tail:
+        time_match = time_exp.match(line)
+        if time_match:
+            ( time_name, time_m, time_s ) = time_match.groups()
+            if time_name==time_option:
+                result = float(time_m)*60+float(time_s)
+    return result
+
+
+# ==========================================
+# Dependencies between targets, and up-to-date checks.
+#
+# A target may declare the files it reads as "inputs", the files it
+# writes besides its log as "outputs", and the targets it comes after as
+# "depends". A target also depends on the targets whose outputs or log
+# are among its inputs. A target with inputs is not run again while its log
+# and outputs are newer than its inputs, its executable and the logs of
+# its dependencies, and its command is unchanged.
+
+def command_hash(target):
+    key = json.dumps([ target['command'], target.get('run_filters_out', []) ])
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def target_products(target):
+    'The log of the target, and its declared outputs'
+    return ( [ out_file(target) ] +
+             [ os.path.join(target['workdir'], f) for f in target.get('outputs', []) ] )
+
+
+def target_inputs(target):
+    '''The declared inputs of the target, with the shell wildcards expanded,
+    its executable if any, and the products of its dependencies.'''
+    files = []
+    for pattern in target.get('inputs', []):
+        path = os.path.join(target['workdir'], pattern)
+        files.extend(sorted(glob.glob(path)) or [ path ])
+    exe_file_name = target_file(target, '.exe')
+    if os.path.isfile(exe_file_name):
+        files.append(exe_file_name)
+    files.extend(target.get('dependency_files', []))
+    return files
+
+
+def target_dependencies(targets):
+    '''Return, for each target of the list, the set of the indexes of the targets
+    it depends on, either declared or deduced from the inputs and outputs.'''
+    indexes = { target['name'] : i for i, target in enumerate(targets) }
+    producers = []
+    for i, target in enumerate(targets):
+        for path in target_products(target):
+            producers.append((os.path.normpath(path), i))
+    result = []
+    for i, target in enumerate(targets):
+        deps = set(indexes[name] for name in target.get('depends', []) if name in indexes)
+        for pattern in target.get('inputs', []):
+            path = os.path.normpath(os.path.join(target['workdir'], pattern))
+            deps.update(j for (product, j) in producers if fnmatch.fnmatch(product, path))
+        deps.discard(i)
+        result.append(deps)
+    return result
+
+
+def dependency_order(targets):
+    '''Return the list of the indexes of the targets, so that each one comes after
+    its dependencies, and otherwise in the given order. The dependencies which
+    are part of a cycle are ignored.'''
+    deps = target_dependencies(targets)
+    dependents = [ [] for target in targets ]
+    remaining = [ len(d) for d in deps ]
+    for i, d in enumerate(deps):
+        for j in d:
+            dependents[j].append(i)
+    ready = [ i for i, n in enumerate(remaining) if n == 0 ]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        i = heapq.heappop(ready)
+        order.append(i)
+        for j in dependents[i]:
+            remaining[j] -= 1
+            if remaining[j] == 0:
+                heapq.heappush(ready, j)
+    if len(order) < len(targets):
+        cycle = [ targets[i]['name'] for i in range(len(targets)) if i not in order ]
+        logging.error('dependency cycle between {}'.format(', '.join(cycle)))
+        order.extend(i for i in range(len(targets)) if i not in order)
+    return order
+
+
+def is_up_to_date(target):
+    if args.force or ('inputs' not in target):
+        return False
+    stats = read_stats(target, '.out')
+    if (not stats) or stats.get('returncode') or (stats.get('command_hash') != command_hash(target)):
+        return False
+    try:
+        oldest_product = min(os.stat(path).st_mtime_ns for path in target_products(target))
+        newest_input = max([ os.stat(path).st_mtime_ns for path in target_inputs(target) ], default=0)
+    except OSError:
+        return False
+    return newest_input <= oldest_product
+
+
+def skip_up_to_date(target,multi,expanded):
+    'Return True, and tell it, when target does not need to run'
+    if not is_up_to_date(target):
+        return False
+    report(up_to_date=True)
+    if multi or expanded:
+        logging.info(target['name'] + ': up to date')
+    else:
+        logging.info('up to date')
+    return True
+
+
+def apply_run_if_needed(target,multi,expanded):
+    if skip_up_to_date(target,multi,expanded):
+        return 0
+    return apply_run(target,multi,expanded)
+
+
+# ==========================================
+# Changed targets. Each run records the fingerprints of the inputs of its
+# target, so that '--changed' selects the targets whose command or inputs
+# changed since, and '--since <rev>' the ones whose inputs or ovalfile
+# changed since a git revision. The targets which depend on a selected
+# one are selected too.
+
+def input_fingerprints(target):
+    'Return the size, modification time and digest of each input of target'
+    files = target_inputs(target)
+    if not files:
+        return {}
+    # the digests of the unchanged files are not computed again
+    stats = read_stats(target, '.out') or {}
+    previous = stats.get('inputs', {})
+    result = {}
+    for file_name in files:
+        signature = file_signature(file_name)
+        if signature is None:
+            continue
+        path = os.path.relpath(file_name, target['workdir'])
+        if previous.get(path, [])[:2] == signature:
+            result[path] = previous[path]
+        else:
+            result[path] = signature + [ file_digest(file_name) ]
+    return result
+
+
+def has_changed(target):
+    'Tell if target did not run successfully with its current command and inputs'
+    stats = read_stats(target, '.out')
+    if ((not stats) or stats.get('returncode') or ('inputs' not in stats) or
+        (stats.get('command_hash') != command_hash(target))):
+        return True
+    recorded = stats['inputs']
+    for file_name in target_inputs(target):
+        if os.path.relpath(file_name, target['workdir']) not in recorded:
+            return True
+    for path, fingerprint in recorded.items():
+        file_name = os.path.join(target['workdir'], path)
+        signature = file_signature(file_name)
+        if signature is None:
+            return True
+        if signature != fingerprint[:2] and file_digest(file_name) != fingerprint[2]:
+            return True
+    return False
+
+
+@functools.lru_cache(maxsize=None)
+def git_changed_files(rev):
+    '''Return the real paths of the files which changed since the git revision
+    rev, including the untracked ones, or None if git cannot tell.'''
+    try:
+        top = subprocess.run([ 'git', 'rev-parse', '--show-toplevel' ], cwd=CWD, check=True,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True).stdout.strip()
+        names = subprocess.run([ 'git', 'diff', '--name-only', rev, '--' ], cwd=top, check=True,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True).stdout.split('\n')
+        names += subprocess.run([ 'git', 'ls-files', '--others', '--exclude-standard' ], cwd=top, check=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True).stdout.split('\n')
+    except (OSError, subprocess.CalledProcessError) as err:
+        logging.error('cannot list the files changed since {}: {}'.format(rev, (getattr(err, 'stderr', None) or str(err)).strip()))
+        return None
+    return frozenset(os.path.join(top, name) for name in names if name)
+
+
+def touched_since(target, rev):
+    'Tell if the inputs, the executable or the ovalfile of target changed since rev'
+    files = git_changed_files(rev)
+    if files is None:
+        return True
+    workdir = os.path.realpath(target['workdir'])
+    patterns = [ os.path.join(workdir, 'ovalfile.py'), os.path.join(workdir, target['name'] + '.exe') ]
+    patterns.extend(os.path.normpath(os.path.join(workdir, pattern)) for pattern in target.get('inputs', []))
+    return any(fnmatch.fnmatch(file_name, pattern) for pattern in patterns for file_name in files)
+
+
+def changed_targets(all_targets, target_names, explicit):
+    '''Return the targets of target_names which changed, or depend on changed
+    ones, or were given explicitly.'''
+    targets = [ all_targets[target_name] for target_name in target_names ]
+    changed = [ (target['name'] in explicit) or
+                bool(args.changed and has_changed(target)) or
+                bool(args.since and touched_since(target, args.since)) for target in targets ]
+    deps = target_dependencies(targets)
+    propagated = True
+    while propagated:
+        propagated = False
+        for i, d in enumerate(deps):
+            if not changed[i] and any(changed[j] for j in d):
+                changed[i] = True
+                propagated = True
+    for target, selected in zip(targets, changed):
+        if not selected:
+            logging.debug('unchanged {}'.format(target['name']))
+    return [ target['name'] for target, selected in zip(targets, changed) if selected ]
 
 
 # ==========================================
 # SUBCOMMAND: Run
 
+@traced('run')
 def apply_run(target,multi,expanded):
-    time_option = target.get("time","off")
-    if ((time_option=="real") or (time_option=="user")):
-      sh_command = "(time ({})) 2>&1 | tee {}.out ; test ${{PIPESTATUS[0]}} -eq 0".format(target["command"], target['name'])
-    else:
-      sh_command = "({}) 2>&1 | tee {}.out ; test ${{PIPESTATUS[0]}} -eq 0".format(target["command"], target['name'])
-    out_file_name = "{}.out".format(target['name'])
-    # version originale :  stderr=subprocess.STDOUT
-    proc = subprocess.run(sh_command, shell=True, executable='bash', stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-    with open(out_file_name, 'w') as out_content:
-        runexps = [re.compile('^' + f.replace('%', '.*') + '$') for f in target['run_filters_out']]
-        diffexps = [re.compile('^' + f.replace('%', '.*') + '$') for f in target['diff_filters_in']]
-        for line in proc.stdout.splitlines():
-            fmatches = [fexp.match(line) for fexp in runexps]
-            if [fmatch for fmatch in fmatches if fmatch]:
-                continue
-            out_content.write(line + '\n')
-            if multi:
-                fmatches = [fexp.match(line) for fexp in diffexps]
-                if [fmatch for fmatch in fmatches if fmatch]:
-                    logging.info(target['name'] + ": " + line)
+    sh_command = "({})".format(target["command"])
+    max_vm = target_setting(target, 'max_vm')
+    limits = limit_commands(target_setting(target, 'cpu_time'), max_vm)
+    if limits:
+        sh_command = limits + ' && ' + sh_command
+    out_file_name = out_file(target)
+    runexps = compile_filters(tuple(target['run_filters_out']))
+    diffexps = compile_filters(tuple(target['diff_filters_in']))
+    # the output is read line by line while the command is running,
+    # so to display it on the fly, and never keep it whole in memory
+    timeout = target_setting(target, 'timeout')
+    expired = threading.Event()
+    inputs = input_fingerprints(target)
+    remove_other_logs(target, '.out', out_file_name)
+    start = time.perf_counter()
+    with open_log(out_file_name, 'w') as out_content:
+        proc = subprocess.Popen(sh_command, shell=True, executable='bash', cwd=target['workdir'],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True, errors='replace', start_new_session=bool(timeout))
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, expire, (proc, expired))
+            timer.start()
+        nb_lines = 0
+        out_of_memory = False
+        try:
+            with proc.stdout:
+                for line in proc.stdout:
+                    nb_lines += 1
+                    line = line.rstrip('\n')
+                    if max_vm and not out_of_memory and memory_exp.search(line):
+                        out_of_memory = True
+                    if runexps and runexps.search(line):
+                        continue
+                    out_content.write(line + '\n')
+                    if multi:
+                        if diffexps and diffexps.search(line):
+                            logging.info(target['name'] + ": " + line)
+                    else:
+                        logging.info(line)
+        except KeyboardInterrupt:
+            # the process group does not get the interrupt of the terminal
+            if timeout:
+                expire(proc, expired)
+            raise
+        if timer:
+            timer.cancel()
+        trace_count(lines=nb_lines, bytes=written_size(out_content), processes=1)
+        returncode, rusage = wait_child(proc)
+        return end_run(target, multi, expanded, out_content, start, returncode, rusage, expired, inputs,
+                       out_of_memory)
+
+
+def end_run(target, multi, expanded, out_content, start, returncode, rusage, expired, inputs, out_of_memory):
+    'Check the limits and write the stats of a finished run, and return its oval return code'
+    limit = exceeded_limit(expired, returncode, rusage, target_setting(target, 'cpu_time'),
+                           target_setting(target, 'max_vm'), out_of_memory)
+    if limit:
+        message = '{} exceeded ({})'.format(limit, target_setting(target, limit))
+        out_content.write('oval: ' + message + '\n')
+        if multi or expanded:
+            message = target['name'] + ': ' + message
+        logging.error(message)
+    stats = resource_stats(time.perf_counter() - start, rusage, returncode)
+    stats['command_hash'] = command_hash(target)
+    stats['inputs'] = inputs
+    if limit:
+        stats['limit'] = limit
+        report(error='{} exceeded'.format(limit))
+    write_stats(target, '.out', stats)
+    report(out=os.path.relpath(out_file(target), CWD), run=stats)
+    return 0 if returncode == 0 and not limit else 1
+
+
+# ==========================================
+# Asyncio engine. All the runs are supervised by a single event loop,
+# which reads and filters their output. The commands which need no shell
+# are executed directly. The children are spawned with Popen and reaped
+# with wait4, rather than with asyncio.create_subprocess_exec, whose child
+# watcher would reap them first and lose their resource usage.
+
+# the characters and the words which need a shell
+shell_exp = re.compile(r'[|&;<>()$`\\*?\[\]{}~!#=%\n]')
+shell_words = { '.', ':', 'alias', 'builtin', 'case', 'cd', 'command', 'declare', 'eval', 'exec',
+                'export', 'for', 'function', 'if', 'let', 'local', 'popd', 'pushd', 'read', 'set',
+                'shopt', 'source', 'time', 'trap', 'type', 'ulimit', 'umask', 'unset', 'until',
+                'wait', 'while' }
+
+# the longest line which the asyncio engine can read
+async_line_limit = 1<<24
+
+
+@functools.lru_cache(maxsize=None)
+def command_argv(command, workdir):
+    'Return the arguments which execute command, directly if it needs no shell'
+    if not shell_exp.search(command):
+        try:
+            argv = shlex.split(command)
+        except ValueError:
+            argv = []
+        if argv and argv[0] not in shell_words:
+            if '/' in argv[0]:
+                if os.access(os.path.join(workdir, argv[0]), os.X_OK):
+                    return argv
+            elif shutil.which(argv[0]):
+                return argv
+    return [ 'bash', '-c', '({})'.format(command) ]
+
+
+@traced('run')
+async def async_run(target,multi,expanded):
+    loop = asyncio.get_running_loop()
+    out_file_name = out_file(target)
+    runexps = compile_filters(tuple(target['run_filters_out']))
+    diffexps = compile_filters(tuple(target['diff_filters_in']))
+    timeout = target_setting(target, 'timeout')
+    argv = command_argv(target['command'], target['workdir'])
+    max_vm = target_setting(target, 'max_vm')
+    limits = limit_commands(target_setting(target, 'cpu_time'), max_vm)
+    if limits:
+        # the limits are set by a shell, which then becomes the command
+        argv = [ 'bash', '-c', limits + ' && exec "$@"', 'bash' ] + argv
+    expired = threading.Event()
+    inputs = input_fingerprints(target)
+    remove_other_logs(target, '.out', out_file_name)
+    start = time.perf_counter()
+    with open_log(out_file_name, 'w') as out_content:
+        proc = subprocess.Popen(argv, cwd=target['workdir'],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=bool(timeout))
+        reader = asyncio.StreamReader(limit=async_line_limit)
+        transport, protocol = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), proc.stdout)
+        timer = None
+        if timeout:
+            timer = loop.call_later(timeout, expire, proc, expired)
+        nb_lines = 0
+        out_of_memory = False
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                nb_lines += 1
+                line = line.decode(errors='replace').rstrip('\n')
+                if line.endswith('\r'):
+                    line = line[:-1]
+                if max_vm and not out_of_memory and memory_exp.search(line):
+                    out_of_memory = True
+                if runexps and runexps.search(line):
+                    continue
+                out_content.write(line + '\n')
+                if multi:
+                    if diffexps and diffexps.search(line):
+                        logging.info(target['name'] + ": " + line)
+                else:
+                    logging.info(line)
+        finally:
+            transport.close()
+            if timer:
+                timer.cancel()
+        trace_count(lines=nb_lines, bytes=written_size(out_content), processes=1)
+        # the output is closed, so the child is about to exit
+        returncode, rusage = await loop.run_in_executor(None, wait_child, proc)
+        return end_run(target, multi, expanded, out_content, start, returncode, rusage, expired, inputs,
+                       out_of_memory)
+
+
+# ==========================================
+# Sequence diff engines. Each one compares two lists of strings,
+# and yields the lines '- x' and '+ x' of an edit script, as they are
+# found. With max_diffs, the script may be cut after max_diffs + 1 lines,
+# the comparison being stopped there.
+
+def difflib_diff(a, b, max_diffs=None):
+    'The historical engine, with difflib.Differ, quadratic on long lists'
+    for line in difflib.Differ().compare(a, b):
+        if ((line[0]=='+')or(line[0]=='-')):
+            yield line
+
+
+def myers_diff(a, b, max_diffs=None):
+    '''Linear space variant of the Myers algorithm, after the common prefix and
+    suffix have been skipped, and the elements which are not in the other list
+    have been discarded. Within each changed block, the removed lines are given
+    before the added ones, as difflib does. The changed blocks are searched
+    in their order, only when the previous lines have been consumed. With
+    max_diffs, when the lists have more differences, the search stops after
+    max_diffs + 1 of them, which are given instead.'''
+    lo = 0
+    ahi, bhi = len(a), len(b)
+    while lo < ahi and lo < bhi and a[lo] == b[lo]:
+        lo += 1
+    while ahi > lo and bhi > lo and a[ahi-1] == b[bhi-1]:
+        ahi -= 1
+        bhi -= 1
+    if max_diffs:
+        edits = myers_bounded_edits(a, b, lo, ahi, bhi, max_diffs + 1)
+        if edits is not None:
+            yield from edit_lines(a, b, edits)
+            return
+    a_set, b_set = set(a[lo:ahi]), set(b[lo:bhi])
+    a_indexes = [ x for x in range(lo, ahi) if a[x] in b_set ]
+    b_indexes = [ y for y in range(lo, bhi) if b[y] in a_set ]
+    a_kept = [ a[x] for x in a_indexes ]
+    b_kept = [ b[y] for y in b_indexes ]
+    matches = myers_matches(a_kept, b_kept, 0, 0, len(a_kept), len(b_kept))
+    i, j = lo, lo
+    # the end of both lists closes the last changed block
+    for (x, y) in itertools.chain(( (a_indexes[x], b_indexes[y]) for (x, y) in matches ), [ (ahi, bhi) ]):
+        for line in a[i:x]:
+            yield '- ' + line
+        for line in b[j:y]:
+            yield '+ ' + line
+        i, j = x + 1, y + 1
+
+
+def myers_matches(a, b, left, top, right, bottom):
+    '''Yield the pairs of indexes of the equal elements of a[left:right] and
+    b[top:bottom], along a shortest edit script, in their order. The box
+    before a middle snake is searched before the snake is given, and the box
+    after it only once the snake is consumed.'''
+    # a pending item is either a box to search, or the pairs of a snake
+    pending = [ ( (left, top, right, bottom), None ) ]
+    while pending:
+        box, pairs = pending.pop()
+        if box is None:
+            yield from pairs
+            continue
+        snake = myers_middle_snake(a, b, *box)
+        if snake is None:
+            continue
+        (x1, y1), (xd, yd), n, (x2, y2) = snake
+        left, top, right, bottom = box
+        pending.append(( (x2, y2, right, bottom), None ))
+        pending.append(( None, zip(range(xd, xd + n), range(yd, yd + n)) ))
+        pending.append(( (left, top, x1, y1), None ))
+
+
+def myers_bounded_edits(a, b, lo, ahi, bhi, max_edits):
+    '''Search the paths from a[lo:ahi] to b[lo:bhi] with at most max_edits
+    edits, in O((N+M) max_edits). Return None if one of them reaches the end,
+    else the edits of the one which goes the furthest, as the positions in a
+    and b before each edit, with the kind of the edit, '-' or '+'.'''
+    n, m = ahi - lo, bhi - lo
+    trace = []
+    v = {}
+    for d in range(max_edits + 1):
+        for k in range(-d, d + 1, 2):
+            if d == 0:
+                x = 0
+            else:
+                x = myers_bounded_step(trace[-1], k, n, m)[0]
+                if x is None:
+                    continue
+            y = x - k
+            while x < n and y < m and a[lo+x] == b[lo+y]:
+                x += 1
+                y += 1
+            if x >= n and y >= m:
+                return None
+            v[k] = x
+        trace.append(v)
+        v = {}
+    # the furthest end, whose edits are found backwards
+    k = max(trace[-1], key=lambda k: 2 * trace[-1][k] - k)
+    edits = []
+    for d in range(max_edits, 0, -1):
+        x, previous_k = myers_bounded_step(trace[d-1], k, n, m)
+        if previous_k == k + 1:
+            edits.append(( lo + x, lo + x - k - 1, '+' ))
+        else:
+            edits.append(( lo + x - 1, lo + x - k, '-' ))
+        k = previous_k
+    edits.reverse()
+    return edits
+
+
+def myers_bounded_step(v, k, n, m):
+    '''Return the x reached on the diagonal k with one more edit than the
+    furthest points v of the previous diagonals, and the diagonal of the edit,
+    or None, None if no edit reaches k within the lists.'''
+    down, right = v.get(k + 1), v.get(k - 1)
+    x, previous_k = None, None
+    if down is not None and down - k <= m:
+        x, previous_k = down, k + 1
+    if right is not None and right < n and (x is None or right + 1 > x):
+        x, previous_k = right + 1, k - 1
+    return x, previous_k
+
+
+def edit_lines(a, b, edits):
+    '''Yield the lines of the edits given by myers_bounded_edits(), with the
+    removed lines of each changed block before its added ones.'''
+    removed, added = [], []
+    end = None
+    for x, y, kind in edits:
+        if (x, y) != end:
+            yield from removed
+            yield from added
+            removed, added = [], []
+        if kind == '-':
+            removed.append('- ' + a[x])
+            end = (x + 1, y)
+        else:
+            added.append('+ ' + b[y])
+            end = (x, y + 1)
+    yield from removed
+    yield from added
+
+
+def myers_middle_snake(a, b, left, top, right, bottom):
+    '''Find the middle snake of the box, i.e. the path segment crossed by the
+    forward and backward searches, made of at most one move and a diagonal.
+    Return its start, the start of its diagonal, the length of the
+    diagonal, and its end.'''
+    width, height = right - left, bottom - top
+    size = width + height
+    if size == 0 or width == 0 or height == 0:
+        return None
+    delta = width - height
+    dmax = (size + 1) // 2
+    vf = [0] * (2 * dmax + 3)
+    vb = [0] * (2 * dmax + 3)
+    vf[1] = left
+    vb[1] = bottom
+    for d in range(dmax + 1):
+        for k in range(d, -d - 1, -2):
+            c = k - delta
+            if k == -d or (k != d and vf[k-1] < vf[k+1]):
+                px = x = vf[k+1]
+            else:
+                px = vf[k-1]
+                x = px + 1
+            y = top + (x - left) - k
+            py = y if (d == 0 or x != px) else y - 1
+            xs, ys = x, y
+            while x < right and y < bottom and a[x] == b[y]:
+                x += 1
+                y += 1
+            vf[k] = x
+            if (delta & 1) and -(d - 1) <= c <= (d - 1) and y >= vb[c]:
+                return (px, py), (xs, ys), x - xs, (x, y)
+        for c in range(d, -d - 1, -2):
+            k = c + delta
+            if c == -d or (c != d and vb[c-1] > vb[c+1]):
+                py = y = vb[c+1]
             else:
-                logging.info(line)
-    return proc.returncode
+                py = vb[c-1]
+                y = py - 1
+            x = left + (y - top) + k
+            px = x if (d == 0 or y != py) else x + 1
+            xs = x
+            while x > left and y > top and a[x-1] == b[y-1]:
+                x -= 1
+                y -= 1
+            vb[c] = y
+            if not (delta & 1) and -d <= k <= d and x <= vf[k]:
+                return (x, y), (x, y), xs - x, (px, py)
+    return None
+
+
+diff_engines = {
+    'difflib': difflib_diff,
+    'myers': myers_diff,
+}
 
 
 # ==========================================
 # SUBCOMMAND: Diff
 
-time_exp = re.compile('^(\w+)\s+([0-9]+)m([.0-9]+)s$')
-
+@traced('diff')
 def apply_diff(target,multi,expanded):
 
     # if a line has two matching groups, we suppose it a a key/value pair
     # and put it in a dictionary. Else, it is put in a list.
-    # ATTENTION : la partie cryptage n'est pas operationnelle
-    # pour les filtres de diff qui ont plusieurs groupes !!!
-
     time_option = target.get("time","off")
     logging.debug('process target {}'.format(target['name']))
     if not target['out']:
@@ -159,85 +1777,270 @@ def apply_diff(target,multi,expanded):
         logging.warning('lacking file {}.ref or {}.md5'.format(target['name'], target['name']))
         return
     out_file_name = target['out']
+    patterns = tuple(target['diff_filters_in'])
     if target['ref']:
         ref_file_name = target['ref']
-        md5 = False
+        digest = None
+        ref_patterns = patterns
     else:
         ref_file_name = target['md5']
-        md5 = True
-    fexps = [re.compile('^' + f.replace('%', '.*') + '$') for f in target['diff_filters_in']]
+        digest = digest_algorithm(ref_file_name)
+        if digest is None:
+            return 1
+        ref_patterns = digest_patterns
+    # the digests of a reference cannot be compared with tolerances
+    tolerances = None
+    if not digest and any(target['diff_tolerances']):
+        tolerances = target['diff_tolerances']
     if multi or expanded:
         prefix = target['name'] + ': '
     else:
         prefix = ''
+    engine = target.get("diff_engine", args.diff_engine)
+
+    # the durations come from the stats files, or,
+    # for former logs, from their 3 last lines
+    out_stats, ref_stats = None, None
+    out_nb_tail, ref_nb_tail = 0, 0
+    if (time_option!="off"):
+        out_stats = read_stats(target, '.out')
+        ref_stats = read_stats(target, '.ref')
+        out_nb_tail = 3 if out_stats is None else 0
+        ref_nb_tail = 3 if ref_stats is None else 0
+
+    # collect matching groups in output and reference, and compare them,
+    # unless the cache already knows the result for the same files, whose
+    # tails give the durations which the stats do not
+    cache = DiffCache(target)
+    stats_times = [ None if stats is None else stats.get(time_option, 0.) for stats in ( out_stats, ref_stats ) ]
+    key = cache.diff_key(out_file_name, ref_file_name, patterns, time_option, stats_times,
+                         digest, engine, args.max_diffs, prefix, tolerances)
+    verdict = cache.verdict(key)
+    if verdict is None:
+        out_groups, out_tail = extract_matches(out_file_name, patterns, out_nb_tail, indexed=bool(tolerances))
+        ref_groups, ref_tail = extract_matches(ref_file_name, ref_patterns, ref_nb_tail, indexed=bool(tolerances))
+        out_time, ref_time = None, None
+        if (time_option!="off"):
+            out_time = target_time(out_stats, out_tail, time_option)
+            ref_time = target_time(ref_stats, ref_tail, time_option)
+        records = []
+        token = log_capture.set(records)
+        try:
+            returncode, nbdiff, differences, errors = compare_matches(out_groups, ref_groups, time_option,
+                out_time, ref_time, digest, engine, args.max_diffs, prefix, tolerances)
+        finally:
+            log_capture.reset(token)
+        verdict = [ returncode, [ [record.levelno, record.msg] for record in records ], errors,
+                    nbdiff, differences ]
+        if len(records) <= max_cached_messages:
+            cache.set_verdict(key, verdict)
+    cache.save()
+    returncode, messages, errors, nbdiff, differences = verdict
+    for level, message in messages:
+        logging.log(level, message)
+    report(out=os.path.relpath(out_file_name, CWD), ref=os.path.relpath(ref_file_name, CWD), diffs=0)
+    for pattern, error in errors.items():
+        logging.debug(prefix + '{}: max error {:.3g}, mean error {:.3g}'.format(pattern, error['max_error'], error['mean_error']))
+        for k, key_error in error.get('keys', {}).items():
+            if key_error is not None:
+                logging.debug(prefix + '{}: error {:.3g} for {}'.format(pattern, key_error, k))
+    if errors:
+        report(errors=errors)
+    if returncode:
+        report(diffs=nbdiff, differences=differences[:args.report_diffs])
+    return returncode
+
+
+# ==========================================
+# Numeric tolerances
+#
+# A filter of diff_filters_in with an "abs_tol" and/or a "rel_tol" compares
+# its values as numbers: the values of the output and the reference are
+# parsed in bulk into numpy arrays, or into array('d') without numpy, and
+# compared all at once. Two numbers are equal when their difference is at
+# most max(abs_tol, rel_tol*|ref|).
+
+def filter_tolerance(f):
+    'Return the [abs_tol, rel_tol] of a filter, or None if it compares texts'
+    if f.get('abs_tol') is None and f.get('rel_tol') is None:
+        return None
+    return [ float(f.get('abs_tol') or 0.), float(f.get('rel_tol') or 0.) ]
+
+
+def to_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return math.nan
+
+
+def parse_numbers(texts):
+    '''Return the array of the numbers in texts, where the ones which are not
+    numbers become NaN.'''
+    numpy = optional_module('numpy')
+    if numpy is not None:
+        try:
+            return numpy.array(texts, dtype=float)
+        except ValueError:
+            return numpy.array([ to_float(text) for text in texts ], dtype=float)
+    return array.array('d', [ to_float(text) for text in texts ])
+
+
+def numeric_errors(out_values, ref_values, abs_tol, rel_tol):
+    '''Return the absolute differences between out_values and ref_values, and
+    the indexes of the ones which exceed the tolerance, or are not numbers.'''
+    numpy = optional_module('numpy')
+    if numpy is not None:
+        errors = numpy.abs(out_values - ref_values)
+        limits = numpy.maximum(abs_tol, rel_tol * numpy.abs(ref_values))
+        return errors, numpy.flatnonzero(~(errors <= limits)).tolist()
+    errors = array.array('d', [ abs(out - ref) for out, ref in zip(out_values, ref_values) ])
+    bad = [ i for i, (error, ref) in enumerate(zip(errors, ref_values))
+            if not error <= max(abs_tol, rel_tol * abs(ref)) ]
+    return errors, bad
+
+
+def split_numeric_groups(indexed_groups, tolerances, numeric_groups):
+    '''Return the groups of the filters without tolerance, and append the ones
+    of the other filters to numeric_groups, keyed by the index of the filter.'''
+    groups = []
+    for i, grps in indexed_groups:
+        if tolerances[i] is None:
+            groups.append(grps)
+        else:
+            numeric_groups.setdefault(i, []).append(grps)
+    return groups
+
+
+def numeric_dict(groups, origin, prefix):
+    result = {}
+    for k, value in groups:
+        if k in result:
+            logging.error(prefix + 'redefinition of {} in {}'.format(k, origin))
+        else:
+            result[k] = value
+    return result
+
+
+def compare_numbers(out_groups, ref_groups, tolerance, max_diffs, prefix, differences):
+    '''Compare the groups matched by a filter with tolerances, as key/value pairs
+    when they have two groups, else as columns of values compared in order.
+    The logged differences are appended to differences. Return the number
+    of differences, the max and mean errors, and for key/value pairs the
+    error of each key, else None.'''
+    abs_tol, rel_tol = tolerance[:2]
+    nbdiff = 0
+    labels, out_texts, ref_texts = [], [], []
+    keys = None
+    if (out_groups or ref_groups) and len((out_groups or ref_groups)[0]) == 2:
+        out_dict = numeric_dict(out_groups, 'output', prefix)
+        ref_dict = numeric_dict(ref_groups, 'reference', prefix)
+        keys = []
+        for k, value in out_dict.items():
+            if k in ref_dict:
+                keys.append(k)
+                labels.append('for {}, '.format(k))
+                out_texts.append(value)
+                ref_texts.append(ref_dict[k])
+            else:
+                log_difference(differences, prefix, 'unexpected {}'.format(k))
+                nbdiff += 1
+        for k in ref_dict:
+            if k not in out_dict:
+                log_difference(differences, prefix, 'lacking {}'.format(k))
+                nbdiff += 1
+    else:
+        out_texts = [ grp for grps in out_groups for grp in grps ]
+        ref_texts = [ grp for grps in ref_groups for grp in grps ]
+        if len(out_texts) != len(ref_texts):
+            log_difference(differences, prefix, '{} values != {} values'.format(len(out_texts), len(ref_texts)))
+            nbdiff += 1
+            size = min(len(out_texts), len(ref_texts))
+            out_texts, ref_texts = out_texts[:size], ref_texts[:size]
+        labels = [ 'value {}: '.format(i+1) for i in range(len(out_texts)) ]
+    errors, bad = numeric_errors(parse_numbers(out_texts), parse_numbers(ref_texts), abs_tol, rel_tol)
+    nblogged = 0
+    for i in bad:
+        # the texts of the non-numbers must still be the same
+        if out_texts[i] == ref_texts[i]:
+            continue
+        nbdiff += 1
+        if not max_diffs or nblogged < max_diffs:
+            log_difference(differences, prefix,
+                           '{}{} != {} (error {:.3g})'.format(labels[i], out_texts[i], ref_texts[i], errors[i]))
+        elif nblogged == max_diffs:
+            logging.info(prefix + '...')
+        nblogged += 1
+    # the non-numbers have no error
+    key_errors = None
+    if keys is not None:
+        key_errors = { k: float(error) if math.isfinite(error) else None for k, error in zip(keys, errors) }
+    numpy = optional_module('numpy')
+    if numpy is not None:
+        finite = errors[numpy.isfinite(errors)]
+        if len(finite) == 0:
+            return nbdiff, 0., 0., key_errors
+        return nbdiff, float(finite.max()), float(finite.mean()), key_errors
+    finite = [ error for error in errors if math.isfinite(error) ]
+    if len(finite) == 0:
+        return nbdiff, 0., 0., key_errors
+    return nbdiff, max(finite), math.fsum(finite) / len(finite), key_errors
+
+
+def log_difference(differences, prefix, text):
+    'Log a difference found by a comparison, and append it to differences'
+    logging.info(prefix + text)
+    differences.append(text)
+
+
+@traced('compare')
+def compare_matches(out_groups, ref_groups, time_option, out_time, ref_time, digest, engine, max_diffs, prefix,
+                    tolerances=None):
+    '''Compare the groups of the output with the ones of the reference, which
+    are the hexadecimal digests of the expected groups when digest is the
+    name of an algorithm. When tolerances are given, the groups are paired
+    with the index of their filter, and the filters with a tolerance compare
+    their values as numbers. Return the verdict, the number of differences,
+    the logged ones, and the max and mean errors of each of these filters,
+    with the error of each key of the ones with key/value pairs.'''
+
+    # set apart the groups of the filters with tolerances
+    numeric_out_groups, numeric_ref_groups = {}, {}
+    if tolerances:
+        out_groups = split_numeric_groups(out_groups, tolerances, numeric_out_groups)
+        ref_groups = split_numeric_groups(ref_groups, tolerances, numeric_ref_groups)
 
     # collect matching groups in output
-    proc1 = subprocess.run("cat {} 2>&1".format(out_file_name),
-                           shell=True, executable='bash', stdout=subprocess.PIPE, stderr=subprocess.PIPE , universal_newlines=True)
     out_log_matches = []
-    out_md5_matches = []
     out_log_dict = {}
-    out_md5_dict = {}
     out_log_keys = []
-    out_lines = proc1.stdout.rstrip().split('\n')
-    if (time_option!="off"):
-      out_time = 0.
-      for i in range(3):
-        line = out_lines[-1]
-        del out_lines[-1]
-        time_match = time_exp.match(line)
-        if time_match:
-          ( time_name, time_m, time_s ) = time_match.groups()
-          if time_name==time_option:
-            out_time = float(time_m)*60+float(time_s)
-    for line in out_lines:
-        for fmatch in [fexp.match(line) for fexp in fexps]:
-            if fmatch:
-                grps = fmatch.groups()
-                if len(grps)==2:
-                    if grps[0] in out_log_dict:
-                        logging.error(prefix + 'redefinition of {} in output'.format(grps[0]))
-                    else:
-                        out_log_dict[grps[0]] = grps[1]
-                        out_md5_dict[grps[0]] = hashlib.md5(grps[1].encode('utf-8')).hexdigest()
-                        # so to memorize results ordering
-                        out_log_keys.append(grps[0])
-                else:
-                    for grp in grps:
-                        out_log_matches.append(grp)
-                        out_md5_matches.append(hashlib.md5(grp.encode('utf-8')).hexdigest())
+    for grps in out_groups:
+        if len(grps)==2:
+            if grps[0] in out_log_dict:
+                logging.error(prefix + 'redefinition of {} in output'.format(grps[0]))
+            else:
+                out_log_dict[grps[0]] = grps[1]
+                # so to memorize results ordering
+                out_log_keys.append(grps[0])
+        else:
+            for grp in grps:
+                out_log_matches.append(grp)
 
     # collect matching groups in reference
-    proc2 = subprocess.run("cat {} 2>&1".format(ref_file_name),
-                           shell=True, executable='bash', stdout=subprocess.PIPE, stderr=subprocess.PIPE , universal_newlines=True)
     out_ref_matches = []
     out_ref_dict = {}
     out_ref_keys = []
-    ref_lines = proc2.stdout.rstrip().split('\n')
-    if (time_option!="off"):
-      ref_time = 0.
-      for i in range(3):
-        line = ref_lines[-1]
-        del ref_lines[-1]
-        time_match = time_exp.match(line)
-        if time_match:
-          ( time_name, time_m, time_s ) = time_match.groups()
-          if time_name==time_option:
-            ref_time = float(time_m)*60+float(time_s)
-    for line in ref_lines:
-        for fmatch in [fexp.match(line) for fexp in fexps]:
-            if fmatch:
-                grps = fmatch.groups()
-                if len(grps)==2:
-                    if grps[0] in out_ref_dict:
-                        logging.error(prefix + 'redefinition of {} in reference'.format(grps[0]))
-                    else:
-                        out_ref_dict[grps[0]] = grps[1]
-                        # so to memorize results ordering
-                        out_ref_keys.append(grps[0])
-                else:
-                    for grp in grps:
-                        out_ref_matches.append(grp)
+    for grps in ref_groups:
+        if len(grps)==2:
+            if grps[0] in out_ref_dict:
+                logging.error(prefix + 'redefinition of {} in reference'.format(grps[0]))
+            else:
+                out_ref_dict[grps[0]] = grps[1]
+                # so to memorize results ordering
+                out_ref_keys.append(grps[0])
+        else:
+            for grp in grps:
+                out_ref_matches.append(grp)
 
     # complete lacking matches in lists
     #while len(out_log_matches) < len(out_ref_matches):
@@ -248,109 +2051,440 @@ def apply_diff(target,multi,expanded):
 
     # prepare comparisons between output and ref
     nbdiff = 0
+    differences = []
 
     # compare single matches
-    zipped = zip(out_log_matches, out_md5_matches, out_ref_matches)
-    if md5:
-        for tpl in zipped:
-            if tpl[1] != tpl[2]:
-                logging.info(prefix+'md5("{}") != {}'.format(tpl[0], tpl[2]))
+    if digest:
+        hash_text = digests[digest]
+        for out_match, ref_match in zip(out_log_matches, out_ref_matches):
+            if hash_text(out_match) != ref_match:
+                log_difference(differences, prefix, '{}("{}") != {}'.format(digest, out_match, ref_match))
                 nbdiff += 1
     else:
         #for tpl in zipped:
         #    if tpl[0] != tpl[2]:
         #        logging.info(prefix+"{} != {}".format(tpl[0], tpl[2]))
         #        nbdiff += 1
-        for line in list(differ.compare(out_ref_matches, out_log_matches)):
-            if ((line[0]=='+')or(line[0]=='-')):
-                logging.info(prefix+"{}".format(line))
-                nbdiff += 1
+        for line in diff_engines[engine](out_ref_matches, out_log_matches, max_diffs):
+            if max_diffs and nbdiff >= max_diffs:
+                logging.info(prefix+"...")
+                break
+            log_difference(differences, prefix, line)
+            nbdiff += 1
 
-    # compare key/value matches (not implemented for md5)
+    # compare key/value matches, whose keys are also hashed in a digest file
+    out_ref_key = {}
     for k in out_log_keys:
-        if k in out_ref_dict:
-            if out_log_dict[k] != out_ref_dict[k]:
-                logging.info(prefix + "for {}, {} != {}".format(k,out_log_dict[k],out_ref_dict[k]))
+        ref_k = hash_text(k) if digest else k
+        out_ref_key[ref_k] = k
+        if ref_k in out_ref_dict:
+            if digest:
+                if hash_text(out_log_dict[k]) != out_ref_dict[ref_k]:
+                    log_difference(differences, prefix,
+                                   'for {}, {}("{}") != {}'.format(k,digest,out_log_dict[k],out_ref_dict[ref_k]))
+                    nbdiff += 1
+            elif out_log_dict[k] != out_ref_dict[k]:
+                log_difference(differences, prefix, "for {}, {} != {}".format(k,out_log_dict[k],out_ref_dict[k]))
                 nbdiff += 1
         else:
-            logging.info(prefix + 'unexpected {}'.format(k))
+            log_difference(differences, prefix, 'unexpected {}'.format(k))
             nbdiff += 1
     for k in out_ref_keys:
-        if not k in out_log_dict:
-            logging.info(prefix + 'lacking {}'.format(k))
+        if not k in out_ref_key:
+            log_difference(differences, prefix, 'lacking {}'.format(k))
             nbdiff += 1
 
+    # compare numeric matches, filter by filter
+    errors = {}
+    for i, tolerance in enumerate(tolerances or []):
+        if tolerance is None:
+            continue
+        pattern_diffs, max_error, mean_error, key_errors = compare_numbers(numeric_out_groups.get(i, []),
+            numeric_ref_groups.get(i, []), tolerance, max_diffs, prefix, differences)
+        nbdiff += pattern_diffs
+        errors[tolerance[2]] = { 'max_error': max_error, 'mean_error': mean_error }
+        if key_errors is not None:
+            errors[tolerance[2]]['keys'] = key_errors
+
     # optional time comparison
     if (time_option!="off"):
-      if ((abs(out_time-ref_time)/ref_time)>.2):
-        logging.info(prefix + "- {} {}s".format(time_option,ref_time))
-        logging.info(prefix + "+ {} {}s".format(time_option,out_time))
+      if (abs(out_time-ref_time)>.2*ref_time):
+        log_difference(differences, prefix, "- {} {}s".format(time_option,ref_time))
+        log_difference(differences, prefix, "+ {} {}s".format(time_option,out_time))
         nbdiff += 1
 
     # final summary
     if nbdiff == 0:
         logging.info(prefix+'==')
-        return 0 ;
+        return 0, nbdiff, differences, errors
     else:
-        return 1
+        return 1, nbdiff, differences, errors
+
+
+# ==========================================
+# SUBCOMMAND: Perf
+#
+# Each target is run several times, after some warmup runs. The samples
+# are appended to .oval/perf.jsonl, and their median is compared with the
+# one of the reference: the samples in <name>.ref.stats.json if any,
+# else the previous sessions in the history.
+
+perf_history_name = 'perf.jsonl'
+perf_metrics = ( 'real', 'user', 'sys', 'max_rss_kb' )
+
+
+def perf_history_file(target):
+    return os.path.join(target['workdir'], cache_dir, perf_history_name)
+
+
+def read_perf_history(target):
+    'Return the samples of the sessions of the target, from the oldest one'
+    sessions = []
+    try:
+        with open(perf_history_file(target)) as content:
+            for line in content:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('target') == target['name']:
+                    sessions.append(record['samples'])
+    except OSError:
+        pass
+    return sessions
+
+
+def append_perf_history(target, samples):
+    os.makedirs(os.path.dirname(perf_history_file(target)), exist_ok=True)
+    record = { 'target': target['name'], 'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'samples': samples }
+    with open(perf_history_file(target), 'a') as content:
+        content.write(json.dumps(record) + '\n')
+
+
+def perf_reference(target, sessions):
+    '''The reference samples of the target: the ones saved in its reference stats,
+    or else the ones of the args.history last given sessions.'''
+    stats = read_stats(target, '.ref')
+    if stats is not None:
+        if 'samples' in stats:
+            return stats['samples']
+        return { metric: [ stats[metric] ] for metric in perf_metrics if metric in stats }
+    reference = { metric: [] for metric in perf_metrics }
+    # so that --history 0 gives no session, rather than all of them
+    for samples in sessions[len(sessions)-args.history:]:
+        for metric in perf_metrics:
+            reference[metric].extend(samples.get(metric, []))
+    return reference
+
+
+def median(values):
+    # statistics is only imported by perf, so that the other subcommands start faster
+    import statistics
+    return statistics.median(values)
+
+
+def median_absolute_deviation(values):
+    center = median(values)
+    return median([ abs(value - center) for value in values ])
+
+
+def perf_verdict(target, reference, samples):
+    '''Compare the medians of the samples and of the reference, for the metric of the
+    target. The difference is significant if it exceeds the absolute and relative
+    tolerances, and perf_k times the scaled median absolute deviations.
+    Return the two medians and the verdict: 'slower', 'faster' or '=='.'''
+    metric = perf_metric(target)
+    ref_median = median(reference[metric])
+    new_median = median(samples[metric])
+    noise = 1.4826 * math.hypot(median_absolute_deviation(reference[metric]),
+                                median_absolute_deviation(samples[metric]))
+    threshold = max(target.get('perf_abs_tol', args.perf_abs_tol),
+                    target.get('perf_rel_tol', args.perf_rel_tol) * ref_median,
+                    target.get('perf_k', args.perf_k) * noise)
+    if new_median - ref_median > threshold:
+        verdict = 'slower'
+    elif ref_median - new_median > threshold:
+        verdict = 'faster'
+    else:
+        verdict = '=='
+    return ref_median, new_median, verdict
+
+
+def perf_metric(target):
+    time_option = target.get("time","off")
+    return target.get('perf_metric', 'real' if time_option=="off" else time_option)
+
+
+def log_perf(target, reference, samples, prefix):
+    'Log the comparison with the reference, and return 1 for a slowdown'
+    metric = perf_metric(target)
+    if not reference.get(metric):
+        logging.info(prefix + '{} {:.3f}s (no reference)'.format(metric, median(samples[metric])))
+        return 0
+    ref_median, new_median, verdict = perf_verdict(target, reference, samples)
+    change = 100. * (new_median - ref_median) / ref_median if ref_median else 0.
+    message = '{} {:.3f}s -> {:.3f}s ({:+.1f}%)'.format(metric, ref_median, new_median, change)
+    if reference.get('max_rss_kb') and samples.get('max_rss_kb'):
+        message += ', max rss {}kB -> {}kB'.format(int(median(reference['max_rss_kb'])),
+                                                 int(median(samples['max_rss_kb'])))
+    logging.info(prefix + '{} {}'.format(message, verdict))
+    return 1 if verdict == 'slower' else 0
+
+
+def run_quietly(target):
+    'Run the target without displaying its output, and return its return code and stats'
+    token = log_capture.set([])
+    try:
+        returncode = apply_run(target, False, False)
+    finally:
+        log_capture.reset(token)
+    return returncode, read_stats(target, '.out')
+
+
+@traced('perf')
+def apply_perf(target,multi,expanded):
+    if multi or expanded:
+        prefix = target['name'] + ': '
+    else:
+        prefix = ''
+    for i in range(args.warmup):
+        run_quietly(target)
+    samples = { metric: [] for metric in perf_metrics }
+    for i in range(args.repeat):
+        returncode, stats = run_quietly(target)
+        if returncode:
+            logging.error(prefix + 'failed run')
+            return 1
+        for metric in perf_metrics:
+            samples[metric].append(stats[metric])
+    sessions = read_perf_history(target)
+    reference = perf_reference(target, sessions)
+    append_perf_history(target, samples)
+    # the stats of the last run, as written by apply_run, with the medians
+    # of the samples, so that --changed does not select the target again
+    stats.update((metric, median(samples[metric])) for metric in perf_metrics)
+    stats['samples'] = samples
+    write_stats(target, '.out', stats)
+    return log_perf(target, reference, samples, prefix)
+
+
+def apply_perf_report(target,multi,expanded):
+    prefix = target['name'] + ': '
+    sessions = read_perf_history(target)
+    if not sessions:
+        logging.debug(prefix + 'no perf history')
+        return 0
+    return log_perf(target, perf_reference(target, sessions[:-1]), sessions[-1], prefix)
 
 
 # ==========================================
 # SUBCOMMAND: Crypt
 
+# A digest file holds the hexadecimal digests of the groups of a reference,
+# one per line, or a key and a value on the same line for the filters with
+# two groups. A first line '#oval-digest: <algorithm>' tells the algorithm,
+# which is md5 for the files without it.
+
+digest_header = '#oval-digest: '
+
+digests = {
+    'md5': lambda text: hashlib.md5(text.encode('utf-8')).hexdigest(),
+    'blake2b': lambda text: hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest(),
+    'sha256': lambda text: hashlib.sha256(text.encode('utf-8')).hexdigest(),
+}
+
+# the filters which read the lines of a digest file
+digest_patterns = ( r'^([0-9a-f]+) ([0-9a-f]+)$', r'^([0-9a-f]+)$' )
+
+
+def digest_algorithm(file_name):
+    'Return the algorithm of the digest file file_name, or None, once told why, if it is unknown'
+    try:
+        with open(file_name) as content:
+            line = content.readline()
+    except OSError:
+        return 'md5'
+    if not line.startswith(digest_header):
+        return 'md5'
+    digest = line[len(digest_header):].strip()
+    if digest not in digests:
+        logging.error('unknown digest algorithm {} in {}'.format(digest, os.path.relpath(file_name, CWD)))
+        return None
+    return digest
+
+
+def copy_file(source, destination):
+    'Replace destination with a copy of source, atomically'
+    tmp_file_name = '{}.{}'.format(destination, os.getpid())
+    shutil.copyfile(source, tmp_file_name)
+    os.replace(tmp_file_name, destination)
+
+
+@traced('crypt')
 def apply_crypt( target,multi,expanded ):
-    fexps = [re.compile('^'+f.replace('%', '.*')+'$') for f in target['diff_filters_in']]
-    ref_file_name = '{}.ref'.format(target['name'])
-    md5_file_name = '{}.md5'.format(target['name'])
-    with open(ref_file_name) as ref_content:
-        logging.info('crypting {}.ref into {}.md5'.format(target['name'], target['name']))
-        with open(md5_file_name,'w') as md5_content:
-            for ref_line in ref_content:
-                line = ref_line.rstrip()
-                for fmatch in [fexp.match(line) for fexp in fexps]:
-                    if fmatch:
-                        for grp in fmatch.groups():
-                            md5_content.write(hashlib.md5(grp.encode('utf-8')).hexdigest()+'\n')
+    if not target['ref']:
+        logging.warning('lacking file {}.ref'.format(target['name']))
+        return 1
+    fexps = compile_filters(tuple(target['diff_filters_in']))
+    ref_file_name = target['ref']
+    md5_file_name = target_file(target, '.md5')
+    digest = target_setting(target, 'digest')
+    if digest is None:
+        digest = digest_algorithm(md5_file_name)
+        if digest is None:
+            return 1
+    elif digest not in digests:
+        logging.error('unknown digest algorithm {} for {}'.format(digest, target['name']))
+        return 1
+    hash_text = digests[digest]
+    logging.info('crypting {} into {}'.format(os.path.basename(ref_file_name), os.path.basename(md5_file_name)))
+    lines, tail = read_lines(ref_file_name)
+    tmp_file_name = '{}.{}'.format(md5_file_name, os.getpid())
+    with open(tmp_file_name,'w') as md5_content:
+        # the md5 files keep the format of the former versions
+        if digest != 'md5':
+            md5_content.write(digest_header + digest + '\n')
+        for line in lines:
+            for grps in fexps.matches(line):
+                if len(grps)==2:
+                    md5_content.write(hash_text(grps[0]) + ' ' + hash_text(grps[1]) + '\n')
+                else:
+                    for grp in grps:
+                        md5_content.write(hash_text(grp) + '\n')
+    os.replace(tmp_file_name, md5_file_name)
+    return 0
 
 
 # ==========================================
-# main work in a given directory
+# SUBCOMMAND: Val
 
-CWD = os.getcwd()
-differ = difflib.Differ() # https://docs.python.org/3/library/difflib.html
+@traced('val')
+def apply_val( target,multi,expanded ):
+    if not target['out']:
+        logging.warning('lacking file {}.out'.format(target['name']))
+        return 1
+    # the reference keeps the compression of the output
+    compression = target['out'][len(target_file(target, '.out')):]
+    target['ref'] = target_file(target, '.ref' + compression)
+    logging.info('copying {} into {}'.format(os.path.basename(target['out']), os.path.basename(target['ref'])))
+    copy_file(target['out'], target['ref'])
+    remove_other_logs(target, '.ref', target['ref'])
+    if os.path.isfile(stats_file(target, '.out')):
+        copy_file(stats_file(target, '.out'), stats_file(target, '.ref'))
+    if target['md5']:
+        return apply_crypt(target,multi,expanded)
+    return 0
 
-def process_directory(workdir, subcommand, args) :
-    os.chdir(workdir)
-    if (workdir!='.') and (workdir!=CWD) :
-      logging.info('>>>>> '+workdir)  
-    #return 0
 
-    # search for ovalfile in the current working directory
-    syspathbackup = sys.path
-    sys.path = ( os.getcwd() , )
-    import ovalfile as config
-    sys.path = syspathbackup
+# ==========================================
+# main work in a given directory
 
-    returncode = 0
+CWD = os.getcwd()
 
-    # prepare the list of all targets
+def log_workdir(workdir):
+    if (workdir!='.') and (workdir!=CWD) :
+      logging.info('>>>>> '+workdir)
+
+
+# the loaded ovalfiles, with the signature of their source file
+ovalfiles = {}
+
+
+def load_ovalfile(workdir):
+    """Execute the ovalfile of workdir as a standalone module, which is neither
+    added to sys.modules nor found through sys.path. Its bytecode is cached in
+    __pycache__ as for any import, and the module itself is reused as long as
+    the file does not change."""
+    file_name = os.path.join(workdir, 'ovalfile.py')
+    signature = file_signature(file_name)
+    if file_name in ovalfiles and ovalfiles[file_name][0] == signature:
+        return ovalfiles[file_name][1]
+    config = exec_ovalfile(file_name)
+    ovalfiles[file_name] = ( signature, config )
+    return config
+
+
+class OvalfileImporter:
+
+    '''The __import__ of the ovalfile of a directory, and of the modules it
+    imports from there: the modules of the directory are loaded into a
+    namespace of their own, rather than through sys.path and sys.modules,
+    so that another directory may have its own, and the other modules are
+    imported as usual.'''
+
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self.modules = {}
+        self.builtins = dict(builtins.__dict__, __import__=self)
+
+    def __call__(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0 and '.' not in name and (name in self.modules or
+                                               os.path.isfile(os.path.join(self.workdir, name + '.py'))):
+            return self.load(name)
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    def load(self, name):
+        if name not in self.modules:
+            spec = importlib.util.spec_from_file_location(name, os.path.join(self.workdir, name + '.py'))
+            module = importlib.util.module_from_spec(spec)
+            module.__builtins__ = self.builtins
+            # so that the imports of a cycle get the module being executed
+            self.modules[name] = module
+            spec.loader.exec_module(module)
+        return self.modules[name]
+
+
+@traced('config')
+def exec_ovalfile(file_name):
+    '''Execute file_name, whose __file__ is its absolute path, so that the
+    ovalfile can open its files with paths relative to os.path.dirname(__file__),
+    the current directory being left unchanged. The modules next to it are
+    imported by an OvalfileImporter, so that the global state of the
+    interpreter is left unchanged too, and several ovalfiles can be executed
+    at once.'''
+    file_name = os.path.abspath(file_name)
+    spec = importlib.util.spec_from_file_location('ovalfile', file_name)
+    config = importlib.util.module_from_spec(spec)
+    config.__builtins__ = OvalfileImporter(os.path.dirname(file_name)).builtins
+    spec.loader.exec_module(config)
+    return config
+
+
+def target_file(target, suffix):
+    return os.path.join(target['workdir'], target['name'] + suffix)
+
+
+def load_directory(workdir, subcommand, args, local=True) :
+    """Load the ovalfile of workdir, and return the dictionary of its targets,
+    the names of the selected ones, and the multi and expanded flags. Unless
+    local, the selection does not depend on the files of this machine: the
+    existing logs and references, and the changes."""
+    config = load_ovalfile(workdir)
+
+    # prepare the list of all targets, copied so that the cached
+    # ovalfile is not modified
     all_target_names = [t['name'] for t in config.targets]
-    all_targets = {t['name'] : t for t in config.targets}
-    if (subcommand == 'diff' or subcommand == 'run-diff' or subcommand == 'val' or subcommand == 'crypt'):
+    all_targets = {t['name'] : dict(t, workdir=workdir) for t in config.targets}
+    if subcommand in ( 'diff', 'run-diff', 'prod', 'val', 'crypt' ):
         for target_name in all_target_names:
             target = all_targets[target_name]
-            if (subcommand == 'run-diff' or os.path.isfile(target_name+'.out')):
-                target['out'] = target_name+'.out'
-            else:
-                target['out'] = None
-            if os.path.isfile(target_name+'.ref'):
-                target['ref'] = target_name+'.ref'
-            else:
-                target['ref'] = None
-            if os.path.isfile(target_name+'.md5'):
-                target['md5'] = target_name+'.md5'
+            if subcommand in ( 'run-diff', 'prod' ):
+                target['out'] = out_file(target)
             else:
-                target['md5'] = None
+                target['out'] = find_log(target, '.out')
+            target['ref'] = find_log(target, '.ref')
+            md5_file_name = target_file(target, '.md5')
+            target['md5'] = md5_file_name if os.path.isfile(md5_file_name) else None
+
+    # a declared input '<name>.out' designates the log of the target name,
+    # whatever its compression, so that the targets chained on it still
+    # come after it
+    if [ t for t in config.targets if 'inputs' in t ]:
+        logs = { target['name'] + '.out' : os.path.relpath(out_file(target), workdir)
+                 for target in all_targets.values() if log_compression(target) }
+        for target in all_targets.values():
+            if logs and 'inputs' in target:
+                target['inputs'] = [ logs.get(os.path.normpath(pattern), pattern) for pattern in target['inputs'] ]
 
     # select the active targets.
     # when there is a wildcard '%' and the command is 'd',
@@ -358,14 +2492,16 @@ def process_directory(workdir, subcommand, args) :
     # multi says if there are several expanded targets
     # expanded says if there are targets expanded from wildcard
     target_names = []
+    explicit = set()
     expanded = False
     for p in args.target:
         if '%' in p:
-            exp = re.compile('^'+p.replace('%', '.*')+'$')
+            exp = wildcard_exp(p)
             for target_name in all_target_names:
                 target = all_targets[target_name]
                 if exp.match(target_name):
-                    if ((subcommand == 'diff' and target['out'] and (target['ref'] or target['md5'])) or
+                    if ((not local) or
+                        (subcommand == 'diff' and target['out'] and (target['ref'] or target['md5'])) or
                         (subcommand == 'crypt' and target['ref']) or
                         (subcommand == 'val' and target['out']) or
                         (subcommand != 'diff' and args.subcommand != 'val' and args.subcommand != 'crypt')):
@@ -375,6 +2511,7 @@ def process_directory(workdir, subcommand, args) :
         else:
             if p in all_target_names:
                 target_names.append(p)
+                explicit.add(p)
             else:
                 logging.warning('unknown target '+p)
     multi = len(target_names) > 1
@@ -385,105 +2522,77 @@ def process_directory(workdir, subcommand, args) :
         target = all_targets[target_name]
         target['run_filters_out'] = []
         for f in config.run_filters_out:
-            exp = re.compile('^'+f['apply'].replace('%', '.*')+'$')
+            exp = wildcard_exp(f['apply'])
             if exp.match(target_name):
                 target['run_filters_out'].append(f['re'])
         target['diff_filters_in'] = []
+        target['diff_tolerances'] = []
         for f in config.diff_filters_in:
-            exp = re.compile('^'+f['apply'].replace('%', '.*')+'$')
+            exp = wildcard_exp(f['apply'])
             if exp.match(target_name):
                 target['diff_filters_in'].append(f['re'])
-                
+                tolerance = filter_tolerance(f)
+                target['diff_tolerances'].append(tolerance and tolerance + [ f['re'] ])
+
+    # keep only the expanded targets which changed, or depend on changed ones
+    if local and (args.changed or args.since):
+        target_names = changed_targets(all_targets, target_names, explicit)
+        multi = len(target_names) > 1
+
+    # keep only the targets of the current shard
+    if sharded_targets is not None:
+        path = os.path.relpath(workdir, CWD)
+        target_names = [ target_name for target_name in target_names if ( path, target_name ) in sharded_targets ]
+        multi = len(target_names) > 1
+
+    # run the targets after their dependencies
+    if subcommand in ( 'run', 'run-diff', 'prod' ):
+        targets = [ all_targets[target_name] for target_name in target_names ]
+        deps = target_dependencies(targets)
+        for target, target_deps in zip(targets, deps):
+            target['dependency_files'] = [ path for j in sorted(target_deps) for path in target_products(targets[j]) ]
+        target_names = [ target_names[i] for i in dependency_order(targets) ]
+
+    return all_targets, target_names, multi, expanded
+
+
+def process_directory(workdir, subcommand, args) :
+    log_workdir(workdir)
+    all_targets, target_names, multi, expanded = load_directory(workdir, subcommand, args)
+    returncode = 0
+
     # execute the subcommand
     if subcommand == 'list':
         for target_name in target_names:
             target = all_targets[target_name]
             logging.info("{}: {}".format(target_name, target["command"]))
-    elif subcommand == 'build':
-        for target_name in target_names:
-            res = apply_build(all_targets[target_name],multi,expanded)
+    elif subcommand in target_steps:
+        if subcommand in build_subcommands:
+            res, failed = apply_builds(workdir, [ all_targets[target_name] for target_name in target_names ],
+                                       multi, expanded)
             returncode = returncode or res
-    elif subcommand == 'run':
+            target_names = [ target_name for target_name in target_names if target_name not in failed ]
         for target_name in target_names:
-            res = apply_run(all_targets[target_name],multi,expanded)
+            if (returncode and args.fail_fast) or not target_steps[subcommand]:
+                break
+            res = apply_steps(subcommand, all_targets[target_name], multi, expanded)
             returncode = returncode or res
-    elif subcommand == 'diff':
-        for target_name in target_names:
-            res = apply_diff(all_targets[target_name],multi,expanded)
-            returncode = returncode or res
-    elif subcommand == 'run-diff':
-        for target_name in target_names:
-            res = apply_run(all_targets[target_name],multi,expanded)
-            returncode = returncode or res
-            res  =apply_diff(all_targets[target_name],multi,expanded)
-            returncode = returncode or res
-    elif subcommand == 'prod':
-        for target_name in target_names:
-            res = apply_build(all_targets[target_name],multi,expanded)
-            returncode = returncode or res
-            res = apply_run(all_targets[target_name],multi,expanded)
-            returncode = returncode or res
-            res = apply_diff(all_targets[target_name],multi,expanded)
-            returncode = returncode or res
-    elif subcommand == 'val':
-        for target_name in target_names:
-            command = 'cp -f {}.out {}.ref'.format(target_name, target_name)
-            logging.info(command)
-            subprocess.check_call(command, shell=True)
-            target = all_targets[target_name]
-            if target['md5']:
-                apply_crypt(target,multi,expanded)
-    elif subcommand == 'crypt':
-        for target_name in target_names:
-            apply_crypt(all_targets[target_name],multi,expanded)
-    elif subcommand == 'filter-out':
+    elif subcommand in ( 'filter-out', 'filter-ref' ):
+        suffix = '.out' if subcommand == 'filter-out' else '.ref'
         for target_name in target_names:
             logging.debug('process target {}'.format(target_name))
-            if not os.path.isfile(target_name+'.out'):
-                logging.warning('lacking file '+target_name+'.out')
-                continue
             target = all_targets[target_name]
-            fexps = [re.compile('^'+f.replace('%', '.*')+'$') for f in target['diff_filters_in']]
-            proc1 = subprocess.Popen("cat {}.out 2>&1".format(target_name),
-                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True, executable='bash', universal_newlines=True)
-            out_value, err_value = proc1.communicate()
-            out_log_matches = []
-            for line in out_value.split('\n'):
-                for fmatch in [fexp.match(line) for fexp in fexps]:
-                    if fmatch:
-                        out_log_matches.extend(fmatch.groups())
-            nbdiff = 0
-            if multi or expanded:
-                prefix = target_name+': '
-            else:
-                prefix = ''
-            for group in out_log_matches:
-                logging.info(prefix+"{}".format(group))
-                nbdiff += 1
-            if nbdiff == 0:
-                logging.info(prefix+'no match')
-    elif subcommand == 'filter-ref':
-        for target_name in target_names:
-            logging.debug('process target {}'.format(target_name))
-            if not os.path.isfile(target_name+'.ref'):
-                logging.warning('lacking file '+target_name+'.ref')
+            file_name = find_log(target, suffix)
+            if not file_name:
+                logging.warning('lacking file '+target_name+suffix)
                 continue
-            target = all_targets[target_name]
-            fexps = [re.compile('^'+f.replace('%', '.*')+'$') for f in target['diff_filters_in']]
-            proc1 = subprocess.Popen("cat {}.ref 2>&1".format(target_name),
-                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True, executable='bash', universal_newlines=True)
-            out_value, err_value = proc1.communicate()
-            out_ref_matches = []
-            for line in out_value.split('\n'):
-                for fmatch in [fexp.match(line) for fexp in fexps]:
-                    if fmatch:
-                        out_ref_matches.extend(fmatch.groups())
+            groups = filtered_groups(target, file_name, subcommand)
             nbdiff = 0
             if multi or expanded:
                 prefix = target_name+': '
             else:
                 prefix = ''
-            for group in out_ref_matches:
+            for group in groups:
                 logging.info(prefix+"{}".format(group))
                 nbdiff += 1
             if nbdiff == 0:
@@ -491,42 +2600,1119 @@ def process_directory(workdir, subcommand, args) :
     else:
         logging.error('UNKNOWN SUBCOMMAND: '+subcommand)
 
-    del sys.modules['ovalfile']
     return returncode
 
 
+# ==========================================
+# parallel processing of the targets of all directories
+
+# the per-target steps of the subcommands which can be scheduled target by target
+target_steps = {
+    'build': (),
+    'run': (apply_run_if_needed,),
+    'diff': (apply_diff,),
+    'run-diff': (apply_run_if_needed, apply_diff),
+    'prod': (apply_run_if_needed, apply_diff),
+    'perf': (apply_perf,),
+    'perf-report': (apply_perf_report,),
+    'val': (apply_val,),
+    'crypt': (apply_crypt,),
+}
+
+# the subcommands whose targets may be processed concurrently
+parallel_subcommands = ( 'build', 'run', 'diff', 'run-diff', 'prod', 'val', 'crypt' )
+
+# the subcommands which the asyncio engine can process
+async_subcommands = ( 'run', 'run-diff' )
+
+# the subcommands which first build all the targets of a directory
+build_subcommands = ( 'build', 'prod' )
+
+
+def capture(function, *fargs):
+    """Call function, and return its result together with the spool file of
+    the log records, and the trace events, emitted meanwhile."""
+    spool = LogSpool()
+    events = None if trace_events.get() is None else []
+    token = log_capture.set(spool)
+    trace_token = trace_events.set(events)
+    try:
+        result = function(*fargs)
+    finally:
+        trace_events.reset(trace_token)
+        log_capture.reset(token)
+        spool.close()
+    return result, spool.file_name, events
+
+
+def apply_steps(subcommand, target, multi, expanded):
+    current, token = begin_report(target, subcommand)
+    returncode = 0
+    for step in target_steps[subcommand]:
+        res = step(target,multi,expanded)
+        returncode = returncode or res
+    end_report(current, token, returncode)
+    return returncode
+
+
+def process_target(workdir, subcommand, target, multi, expanded):
+    """Apply the steps of subcommand to a single target, and return the
+    return code together with the spool file of the log records, and the
+    trace events, emitted meanwhile."""
+    returncode, spool, events = capture(apply_steps, subcommand, target, multi, expanded)
+    return returncode, spool, None, events
+
+
+def process_build(workdir, targets, multi, expanded, jobs):
+    """Build the executables of targets, with jobs parallel processes, and
+    return the return code, the spool file of the log records emitted
+    meanwhile, the names of the failed targets, and the trace events."""
+    (returncode, failed), spool, events = capture(apply_builds, workdir, targets, multi, expanded, jobs)
+    return returncode, spool, failed, events
+
+
+def process_targets(workdirs, subcommand, args, jobs):
+    """Apply subcommand to the selected targets of all the workdirs, with
+    a single pool of jobs workers. A target is submitted once the targets
+    it depends on, and the build of its directory, are done. The output of
+    each target is spooled into a temporary file, and displayed as a whole,
+    in the order of the targets. With a single target, or a single build,
+    there is nothing to interleave, and the directories are processed one
+    after the other."""
+    tasks = []    # the function and arguments of each task, and the tasks it depends on
+    outputs = []  # in display order, a workdir header, the records of its loading, or the index of a task
+    for workdir in workdirs:
+        loading = []
+        token = log_capture.set(loading)
+        try:
+            all_targets, target_names, multi, expanded = load_directory(workdir, subcommand, args)
+        finally:
+            log_capture.reset(token)
+        targets = [ all_targets[target_name] for target_name in target_names ]
+        outputs.append(workdir)
+        outputs.append(loading)
+        builds = [ [] for target in targets ]
+        if subcommand in build_subcommands and targets:
+            builds = [ [ len(tasks) ] for target in targets ]
+            outputs.append(len(tasks))
+            tasks.append((process_build, [ workdir, targets, multi, expanded, jobs ], []))
+            if args.overlap:
+                # the targets whose executable is already built, as told by
+                # its own check, do not wait for the build of the others
+                command, check = build_settings(workdir)
+                if check:
+                    builds = [ [] if is_built(workdir, [ target ], check) else build
+                               for target, build in zip(targets, builds) ]
+        if not target_steps[subcommand]:
+            continue
+        first = len(tasks)
+        for i, deps in enumerate(target_dependencies(targets)):
+            outputs.append(len(tasks))
+            # targets are already ordered, so later ones come from a cycle
+            tasks.append((process_target, (workdir, subcommand, targets[i], multi, expanded),
+                          builds[i] + [ first + j for j in deps if j < i ]))
+    functions = [ task[0] for task in tasks ]
+    if functions.count(process_target) <= 1 and functions.count(process_build) <= 1:
+        return process_directories(workdirs, subcommand, args)
+    # the builds which may run at once share the -j budget, so that
+    # they do not start up to jobs * jobs processes together
+    nb_builds = functions.count(process_build)
+    for function, function_args, deps in tasks:
+        if function == process_build:
+            function_args[-1] = max(1, jobs // nb_builds)
+    dependents = [ [] for task in tasks ]
+    remaining = [ len(task[2]) for task in tasks ]
+    for i, task in enumerate(tasks):
+        for j in task[2]:
+            dependents[j].append(i)
+    returncode = 0
+    results = {}
+    running = {}
+    # imported here rather than at the start, which they would slow down
+    import multiprocessing
+    import concurrent.futures
+    mp_context = multiprocessing.get_context('fork')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, mp_context=mp_context) as pool:
+
+        ready = [ i for i in range(len(tasks)) if remaining[i] == 0 ]
+        finished = []  # the tasks which are done, with their result
+        stopped = False
+        displayed = 0
+        while True:
+            while ready or finished:
+                if finished:
+                    i, result = finished.pop(0)
+                    results[i] = result
+                    if result[0] and args.fail_fast and not stopped:
+                        # the pending tasks are cancelled, the running ones go on
+                        stopped = True
+                        for future in list(running):
+                            if future.cancel():
+                                finished.append(( running.pop(future), ( 0, None, None, None ) ))
+                    for j in dependents[i]:
+                        remaining[j] -= 1
+                        if remaining[j] == 0:
+                            ready.append(j)
+                    continue
+                i = ready.pop(0)
+                function, function_args, deps = tasks[i]
+                if stopped:
+                    finished.append(( i, ( 0, None, None, None ) ))
+                # the targets whose build failed are skipped
+                elif any(results[j][2] and function_args[2]['name'] in results[j][2] for j in deps):
+                    finished.append(( i, ( 1, None, None, None ) ))
+                else:
+                    running[pool.submit(function, *function_args)] = i
+            while displayed < len(outputs):
+                item = outputs[displayed]
+                if isinstance(item, str):
+                    log_workdir(item)
+                elif isinstance(item, list):
+                    for record in item:
+                        logger.handle(record)
+                elif item in results:
+                    res, spool, failed, events = results[item]
+                    if spool:
+                        replay_spool(spool)
+                    if events:
+                        trace_events.get().extend(events)
+                    results[item] = ( res, None, failed, None )
+                    returncode = returncode or res
+                else:
+                    break
+                displayed += 1
+            if displayed == len(outputs):
+                break
+            done, pending = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                finished.append(( running.pop(future), future.result() ))
+    return returncode
+
+
+def process_directories(workdirs, subcommand, args):
+    """Apply subcommand to the workdirs one after the other, with the
+    output written as it comes."""
+    returncode = 0
+    for workdir in workdirs:
+        tmpreturncode = process_directory(workdir, subcommand, args)
+        returncode = returncode or tmpreturncode
+        if returncode and args.fail_fast:
+            break
+    return returncode
+
+
+async def async_process_target(subcommand, target, multi, expanded, deps, semaphore, failures):
+    """Apply subcommand to target, with the asyncio engine, once the targets
+    it depends on are done, and return the return code together with the
+    spool file of the log records emitted meanwhile."""
+    await asyncio.gather(*deps)
+    async with semaphore:
+        if failures and args.fail_fast:
+            return 0, None
+        # each task has its own copy of the context
+        spool = LogSpool()
+        log_capture.set(spool)
+        current, token = begin_report(target, subcommand)
+        returncode = 0
+        for step in target_steps[subcommand]:
+            if step is apply_run_if_needed:
+                res = 0 if skip_up_to_date(target,multi,expanded) else await async_run(target,multi,expanded)
+            else:
+                res = step(target,multi,expanded)
+            returncode = returncode or res
+        end_report(current, token, returncode)
+        log_capture.set(None)
+        spool.close()
+    if returncode:
+        failures.append(target['name'])
+    return returncode, spool.file_name
+
+
+async def async_process_targets(workdirs, subcommand, args, jobs):
+    """Apply subcommand to the selected targets of all the workdirs, with
+    at most jobs targets running at once, and display the output of each
+    target as a whole, in the order of the targets."""
+    semaphore = asyncio.Semaphore(jobs)
+    failures = []
+    outputs = []
+    for workdir in workdirs:
+        all_targets, target_names, multi, expanded = load_directory(workdir, subcommand, args)
+        targets = [ all_targets[target_name] for target_name in target_names ]
+        outputs.append(workdir)
+        tasks = []
+        for i, deps in enumerate(target_dependencies(targets)):
+            tasks.append(asyncio.create_task(async_process_target(
+                subcommand, targets[i], multi, expanded, [ tasks[j] for j in deps if j < i ], semaphore, failures)))
+        outputs.extend(tasks)
+    returncode = 0
+    for item in outputs:
+        if isinstance(item, str):
+            log_workdir(item)
+        else:
+            res, spool = await item
+            if spool:
+                replay_spool(spool)
+            returncode = returncode or res
+    return returncode
+
+
+# ==========================================
+# Sharding. With '--shard i/N', the selected targets of all the workdirs
+# are split into N shards, whose durations are balanced according to the
+# reference stats, which are the same on every machine. The targets which
+# depend on each other stay in the same shard.
+
+# the (workdir, target) pairs of the current shard, if any
+sharded_targets = None
+
+# the duration of the targets which have no reference stats
+default_shard_duration = 1.
+
+
+def parse_shard(text):
+    'Return the index, from 0, and the number of shards of "i/N"'
+    try:
+        index, count = ( int(x) for x in text.split('/') )
+    except ValueError:
+        index, count = 0, 0
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError('invalid shard {}, expecting i/N with 1 <= i <= N'.format(text))
+    return index - 1, count
+
+
+def shard_duration(target):
+    stats = read_stats(target, '.ref')
+    if stats and stats.get('real'):
+        return stats['real']
+    return default_shard_duration
+
+
+def shard_units(workdir, subcommand):
+    '''Return the groups of the selected targets of workdir which depend on
+    each other, with their duration and the relative path of workdir.'''
+    # the warnings are given when the shard is processed, and the shards
+    # split the targets of the ovalfiles, whatever the files of each machine
+    token = log_capture.set([])
+    try:
+        all_targets, target_names, multi, expanded = load_directory(workdir, subcommand, args, local=False)
+    finally:
+        log_capture.reset(token)
+    targets = [ all_targets[target_name] for target_name in target_names ]
+    parents = list(range(len(targets)))
+    def root(i):
+        while parents[i] != i:
+            i = parents[i]
+        return i
+    for i, deps in enumerate(target_dependencies(targets)):
+        for j in deps:
+            parents[root(i)] = root(j)
+    groups = {}
+    for i in range(len(targets)):
+        groups.setdefault(root(i), []).append(i)
+    path = os.path.relpath(workdir, CWD)
+    return [ ( sum(shard_duration(targets[i]) for i in members), path, [ targets[i]['name'] for i in members ] )
+             for members in groups.values() ]
+
+
+def shard_selection(workdirs, subcommand, index, count):
+    'Return the set of the (workdir, target) pairs of the shard index among count'
+    units = []
+    for workdir in workdirs:
+        units.extend(shard_units(workdir, subcommand))
+    # the longest units first, each one into the least loaded shard
+    units.sort(key=lambda unit: ( -unit[0], unit[1], unit[2] ))
+    loads = [ ( 0., shard ) for shard in range(count) ]
+    selection = set()
+    for duration, path, target_names in units:
+        load, shard = heapq.heappop(loads)
+        if shard == index:
+            selection.update(( path, target_name ) for target_name in target_names)
+        heapq.heappush(loads, ( load + duration, shard ))
+    return selection
+
+
+# ==========================================
+# SUBCOMMAND: Merge
+
+def merge_reports(file_names):
+    '''Combine the reports written by several shards with '--report', tell the
+    targets which failed, and return the global return code.'''
+    if file_names == [ '%' ]:
+        logging.error('no report to merge')
+        return 1
+    returncode = 0
+    reports = {}
+    for file_name in file_names:
+        try:
+            with open(file_name) as content:
+                for line in content:
+                    if not line.strip():
+                        continue
+                    current = json.loads(line)
+                    key = ( current['workdir'], current['target'] )
+                    if key in reports:
+                        logging.warning('{} reported twice'.format(os.path.join(*key)))
+                    reports[key] = current
+        except (OSError, ValueError, KeyError) as err:
+            logging.error('cannot read {}: {}'.format(file_name, err))
+            returncode = 1
+    failed = 0
+    for key, current in reports.items():
+        if current['status'] != 'passed':
+            failed += 1
+            message = current.get('error') or '{} differences'.format(current.get('diffs', 0))
+            logging.info('{}: {}'.format(os.path.join(*key), message))
+        # so that the merged reports can be written with --report and --junit
+        logging.debug('report of {}'.format(current['target']), extra={ 'report': current })
+    logging.info('{} targets, {} passed, {} failed'.format(len(reports), len(reports) - failed, failed))
+    return 1 if failed else returncode
+
+
+# ==========================================
+# SUBCOMMAND: Watch
+#
+# The workdirs are found, and the ovalfiles loaded, only once. Then the
+# workdirs, and the directories of the inputs of their targets, are watched
+# with inotify when the libc provides it, else by polling their content.
+# After a burst of changes, only the affected targets are processed again:
+# the ones whose reference changed are compared again, the ones whose
+# executable, inputs or ovalfile changed are run and compared again, as the
+# targets which depend on them. A change of another file, such as a source,
+# builds again the existing executables of its workdir, and the rebuilt
+# ones are run and compared again.
+
+# the files whose changes are ignored, on top of the hidden ones
+default_watch_ignore = [ '*~', '*.swp', '*.tmp', '*.o', '*.a', '*.so', '*.mod', '*.d', '*.pyc', '*.stats.json' ]
+
+# the delay of the polling of the directories, when there is no inotify
+poll_period = .5
+
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+inotify_mask = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+inotify_event = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+
+    'The changes of the files of some directories, told by inotify'
+
+    def __init__(self, libc, get_errno):
+        self.libc = libc
+        self.get_errno = get_errno
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(get_errno(), os.strerror(get_errno()))
+        self.directories = {}
+
+    def add(self, directories):
+        for directory in directories:
+            if directory in self.directories.values():
+                continue
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), inotify_mask)
+            if wd < 0:
+                logging.warning('cannot watch {}: {}'.format(directory, os.strerror(self.get_errno())))
+            else:
+                self.directories[wd] = directory
+
+    def wait(self, timeout):
+        '''Return the paths of the files changed within timeout seconds, or
+        forever if it is None. When events were lost, all the directories
+        are returned.'''
+        readable, writable, errors = select.select([ self.fd ], [], [], timeout)
+        changes = set()
+        while readable:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, size = inotify_event.unpack_from(data, pos)
+                pos += inotify_event.size
+                name = os.fsdecode(data[pos:pos+size].rstrip(b'\0'))
+                pos += size
+                if mask & IN_Q_OVERFLOW:
+                    changes.update(self.directories.values())
+                elif name and wd in self.directories:
+                    changes.add(os.path.join(self.directories[wd], name))
+        return changes
+
+
+class PollingWatcher:
+
+    'The changes of the files of some directories, found by comparing their content periodically'
+
+    def __init__(self):
+        self.snapshots = {}
+
+    def add(self, directories):
+        for directory in directories:
+            if directory not in self.snapshots:
+                self.snapshots[directory] = self.scan(directory)
+
+    def scan(self, directory):
+        'Return the modification time and size of each file of directory'
+        result = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            stat = entry.stat()
+                            result[entry.name] = ( stat.st_mtime_ns, stat.st_size )
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        return result
+
+    def wait(self, timeout):
+        'Return the paths of the files changed within timeout seconds, or forever if it is None'
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changes = set()
+            for directory, snapshot in self.snapshots.items():
+                current = self.scan(directory)
+                for name in snapshot.keys() | current.keys():
+                    if snapshot.get(name) != current.get(name):
+                        changes.add(os.path.join(directory, name))
+                self.snapshots[directory] = current
+            if changes or (deadline is not None and time.monotonic() >= deadline):
+                return changes
+            delay = poll_period if deadline is None else min(poll_period, max(deadline - time.monotonic(), 0))
+            time.sleep(delay)
+
+
+def make_watcher():
+    'Return an inotify watcher when possible, else a polling one'
+    if not args.poll:
+        # ctypes is only imported by watch, so that the other subcommands start faster
+        import ctypes.util
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            if hasattr(libc, 'inotify_init1'):
+                return InotifyWatcher(libc, ctypes.get_errno)
+        except OSError as err:
+            logging.debug('no inotify: {}'.format(err))
+    logging.debug('polling every {}s'.format(poll_period))
+    return PollingWatcher()
+
+
+def watched_directories(workdirs):
+    '''Return the workdirs concerned by the changes of each watched directory,
+    and the products of their targets, whose changes are ignored.'''
+    directories = {}
+    products = set()
+    for workdir in workdirs:
+        directories.setdefault(workdir, set()).add(workdir)
+        token = log_capture.set([])
+        try:
+            all_targets, target_names, multi, expanded = load_directory(workdir, 'prod', args)
+        finally:
+            log_capture.reset(token)
+        for target_name in target_names:
+            target = all_targets[target_name]
+            for pattern in target.get('inputs', []):
+                directory = os.path.dirname(os.path.normpath(os.path.join(workdir, pattern)))
+                directories.setdefault(directory, set()).add(workdir)
+            products.update(target_file(target, '.out' + compression) for compression in ( '', ) + tuple(compressions))
+            products.update(os.path.normpath(path) for path in target_products(target))
+    return directories, products
+
+
+def is_ignored_change(path, products, seen):
+    '''Tell if the change of path is irrelevant: a hidden or temporary file, a
+    product of a target, or a file unchanged since it was last processed.'''
+    name = os.path.basename(path)
+    if name.startswith('.') or path in products:
+        return True
+    if [ p for p in default_watch_ignore + args.ignore if fnmatch.fnmatch(name, p) ]:
+        return True
+    return path in seen and seen[path] == file_signature(path)
+
+
+def wait_changes(watcher, products, seen):
+    '''Wait for relevant changes, then until no other one happens during
+    args.debounce seconds, and return their paths.'''
+    changes = set()
+    while not changes:
+        changes = { path for path in watcher.wait(None) if not is_ignored_change(path, products, seen) }
+    while True:
+        more = watcher.wait(args.debounce)
+        if not more:
+            return changes
+        changes.update(path for path in more if not is_ignored_change(path, products, seen))
+
+
+def watch_workdir(workdir, changes):
+    '''Process again the targets of workdir affected by the changed files, and
+    return the return code, the number of processed targets, and the rebuilt
+    executables.'''
+    log_workdir(workdir)
+    all_targets, target_names, multi, expanded = load_directory(workdir, 'prod', args)
+    targets = [ all_targets[target_name] for target_name in target_names ]
+    returncode = 0
+    everything = (workdir in changes) or (os.path.join(workdir, 'ovalfile.py') in changes)
+
+    # the files of the workdir which belong to no target are sources, whose
+    # changes build again the existing executables, and so do the changes of
+    # the declared inputs of a target for its own executable, as with prod
+    known = { os.path.join(workdir, 'ovalfile.py') }
+    for target in targets:
+        known.update(target_file(target, suffix) for suffix in ( '.exe', '.md5' ))
+        known.update(target_file(target, '.ref' + compression) for compression in ( '', ) + tuple(compressions))
+        known.update(os.path.normpath(path) for path in target_inputs(target))
+    sources = [ path for path in changes if os.path.dirname(path) == workdir and path not in known ]
+    built = [ target for target in targets if os.path.isfile(target_file(target, '.exe')) ]
+    if not (sources or everything):
+        built = [ target for target in built
+                  if changes.intersection(os.path.normpath(path) for path in target_inputs(target)
+                                          if path != target_file(target, '.exe')) ]
+    rebuilt = []
+    failed = []
+    if built:
+        before = { target['name']: file_signature(target_file(target, '.exe')) for target in built }
+        res, failed = apply_builds(workdir, built, multi, expanded)
+        returncode = returncode or res
+        rebuilt = [ target_file(target, '.exe') for target in built
+                    if file_signature(target_file(target, '.exe')) != before[target['name']] ]
+
+    # the targets are in dependency order, so that the ones which depend
+    # on a target run again are run again too
+    changed = changes.union(rebuilt)
+    run_products = set()
+    nb_targets = 0
+    for target in targets:
+        if target['name'] in failed:
+            continue
+        inputs = { os.path.normpath(path) for path in target_inputs(target) }
+        refs = { target_file(target, '.ref' + compression) for compression in ( '', ) + tuple(compressions) }
+        refs.add(target_file(target, '.md5'))
+        if everything or (inputs & changed) or (inputs & run_products):
+            step = 'run-diff'
+            run_products.update(os.path.normpath(path) for path in target_products(target))
+        elif refs & changes:
+            step = 'diff'
+        else:
+            continue
+        res = apply_steps(step, target, multi, expanded)
+        returncode = returncode or res
+        nb_targets += 1
+    return returncode, nb_targets, rebuilt
+
+
+def watch_targets(workdirs):
+    '''Watch the workdirs, and process again the targets affected by each burst
+    of changes, until interrupted. Return the return code of the last burst.'''
+    watcher = make_watcher()
+    directories, products = watched_directories(workdirs)
+    watcher.add(directories)
+    logging.info('watching {} directories, type Ctrl-C to stop'.format(len(directories)))
+    # the signature of the files after their last processing, so that the
+    # late events of their changes are ignored
+    seen = {}
+    returncode = 0
+    try:
+        while True:
+            changes = wait_changes(watcher, products, seen)
+            start = time.perf_counter()
+            logging.info('changed: {}'.format(' '.join(sorted(os.path.relpath(path, CWD) for path in changes))))
+            concerned = set()
+            for path in changes:
+                concerned.update(directories.get(path, ()))
+                concerned.update(directories.get(os.path.dirname(path), ()))
+            returncode = 0
+            nb_targets = 0
+            for workdir in [ workdir for workdir in workdirs if workdir in concerned ]:
+                res, nb, rebuilt = watch_workdir(workdir, changes)
+                returncode = returncode or res
+                nb_targets += nb
+                changes.update(rebuilt)
+            for path in changes:
+                seen[path] = file_signature(path)
+            # a modified ovalfile may declare other targets and inputs
+            if [ path for path in changes if os.path.basename(path) == 'ovalfile.py' ]:
+                directories, products = watched_directories(workdirs)
+                watcher.add(directories)
+            logging.info('{} targets processed, {} in {:.3f}s'.format(
+                nb_targets, 'failed' if returncode else 'ok', time.perf_counter() - start))
+    except KeyboardInterrupt:
+        logging.info('')
+    return returncode
+
+
+# ==========================================
+# SUBCOMMAND: Serve
+#
+# 'oval serve' listens on the socket of the user, and forks a child for
+# each command of a client. The child takes the arguments, directory,
+# environment, umask, resource limits and standard streams of the client,
+# and goes on as a standalone oval, while the server sends its exit status
+# to the client. When the child cannot take on the limits of the client,
+# for instance a hard limit above the one of the server, or runs in another
+# batch job, it tells the client to execute the command by itself.
+# The children inherit the workdirs found below the directory of the
+# server, the loaded ovalfiles, the compiled filters and the contents of
+# the diff caches, which the server refreshes when it is idle.
+
+def exit_status(status):
+    'The exit status of a child, from its wait status'
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def receive_request(connection):
+    '''Return the request of a client, and the descriptors of its standard
+    streams, or None for a connection which only checks that the server runs.'''
+    fds = array.array('i')
+    data, ancdata, flags, address = connection.recvmsg(1, socket.CMSG_LEN(3 * fds.itemsize))
+    if not data:
+        return None, []
+    for level, kind, cdata in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cdata[:len(cdata) - len(cdata) % fds.itemsize])
+    if len(fds) != 3:
+        for fd in fds:
+            os.close(fd)
+        raise ValueError('the standard streams are lacking')
+    request = json.loads(connection.makefile('rb').readline())
+    return request, list(fds)
+
+
+def warm_up(root, index):
+    '''Find the workdirs below root, and load their ovalfiles, the filters of
+    their targets, and their diff caches, so that the children inherit them.'''
+    workdirs = find_workdirs(root, default_prune_patterns + args.prune, args.max_depth, index)
+    for workdir in workdirs:
+        token = log_capture.set([])
+        try:
+            all_targets, target_names, multi, expanded = load_directory(workdir, 'list', args)
+        except Exception as err:
+            # an ovalfile being edited is loaded again by the children
+            logging.debug('cannot load {}: {}'.format(workdir, err))
+            continue
+        finally:
+            log_capture.reset(token)
+        for target_name in target_names:
+            target = all_targets[target_name]
+            compile_filters(tuple(target['run_filters_out']))
+            compile_filters(tuple(target['diff_filters_in']))
+            load_served_cache(os.path.join(workdir, cache_dir, target_name + '.cache.json'))
+    logging.debug('warmed up {} workdirs'.format(len(workdirs)))
+
+
+def serve(socket_name):
+    '''Serve the clients on socket_name until interrupted. Only the children
+    return, with the index of the workdirs of the server.'''
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        listener.connect(socket_name)
+        logging.error('a server already listens on {}'.format(socket_name))
+        sys.exit(1)
+    except OSError:
+        listener.close()
+    directory = os.path.dirname(os.path.abspath(socket_name))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not is_private(directory, stat.S_ISDIR):
+        logging.error('the directory {} of the socket must be owned by the user, with mode 0700'.format(directory))
+        sys.exit(1)
+    if os.path.exists(socket_name):
+        os.remove(socket_name)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # the socket is never open to the others, even before its chmod
+    umask = os.umask(0o177)
+    try:
+        listener.bind(socket_name)
+    finally:
+        os.umask(umask)
+    os.chmod(socket_name, 0o600)
+    listener.listen(64)
+    index = MemoryWorkdirIndex()
+    warm_up(os.getcwd(), index)
+
+    # the end of a child wakes up the loop
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logging.info('serving on {}, type Ctrl-C to stop'.format(socket_name))
+    clients = {}
+    stale = False
+    try:
+        while True:
+            readable, writable, errors = select.select([ listener, wakeup_r ], [], [], 0 if stale else None)
+            if not readable:
+                warm_up(os.getcwd(), index)
+                stale = False
+                continue
+            if wakeup_r in readable:
+                try:
+                    while os.read(wakeup_r, 1 << 10):
+                        pass
+                except BlockingIOError:
+                    pass
+                while clients:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                    if pid == 0:
+                        break
+                    connection = clients.pop(pid, None)
+                    if connection:
+                        try:
+                            connection.sendall(json.dumps({ 'status': exit_status(status) }).encode('utf-8') + b'\n')
+                        except OSError:
+                            pass
+                        connection.close()
+                    stale = True
+            if listener not in readable:
+                continue
+            connection, address = listener.accept()
+            if peer_uid(connection) not in ( None, os.getuid() ):
+                logging.warning('refused a client of another user')
+                connection.close()
+                continue
+            connection.settimeout(5)
+            try:
+                request, fds = receive_request(connection)
+            except (OSError, ValueError) as err:
+                logging.warning('bad request: {}'.format(err))
+                request = None
+            if request is None:
+                connection.close()
+                continue
+            connection.settimeout(None)
+            logging.debug('{} in {}'.format(' '.join(request['argv']), request['cwd']))
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                listener.close()
+                signal.set_wakeup_fd(-1)
+                os.close(wakeup_r)
+                os.close(wakeup_w)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                for other in clients.values():
+                    other.close()
+                if not apply_context(request.get('context')):
+                    # the runs would differ from the ones of a standalone oval
+                    try:
+                        connection.sendall(json.dumps({ 'fallback': True }).encode('utf-8') + b'\n')
+                    finally:
+                        os._exit(0)
+                connection.close()
+                for i, fd in enumerate(fds):
+                    os.dup2(fd, i)
+                    os.close(fd)
+                if sys.stdout.isatty():
+                    sys.stdout.reconfigure(line_buffering=True)
+                os.chdir(request['cwd'])
+                # the environment of the client replaces the one of the server,
+                # so that the runs do not depend on whether a server is up
+                os.environ.clear()
+                os.environ.update(request['env'])
+                os.environ['PWD'] = request['cwd']
+                sys.argv[1:] = request['argv']
+                # the caches which depend on the environment or on git
+                command_argv.cache_clear()
+                git_changed_files.cache_clear()
+                return index
+            for fd in fds:
+                os.close(fd)
+            try:
+                connection.sendall(json.dumps({ 'pid': pid }).encode('utf-8') + b'\n')
+            except OSError:
+                pass
+            clients[pid] = connection
+    except (KeyboardInterrupt, SystemExit):
+        listener.close()
+        if os.path.exists(socket_name):
+            os.remove(socket_name)
+        logging.info('server stopped')
+        sys.exit(0)
+
+
 # ==========================================
 # find workdirs
 
-def try_workdir( element, workdirs ):
-  if element[0] == '.' :
-    return
-  if not os.path.isdir(element) :
-    return
-  ovalcfg = os.path.join(element,'ovalfile.py')
-  if os.path.isfile(ovalcfg) :
-    workdirs.append(element)
-  else :
-    for subelement in os.listdir(element) :
-      subelementpath = os.path.join(element,subelement)
-      try_workdir(subelementpath,workdirs)
+# the directories which are never searched, on top of the hidden ones
+default_prune_patterns = [ '__pycache__' ]
+
+
+def scan_directory(path):
+    'Tell if path contains an ovalfile, and return the sorted names of its subdirectories'
+    has_ovalfile = False
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.name == 'ovalfile.py' and entry.is_file():
+                        has_ovalfile = True
+                    elif entry.is_dir():
+                        subdirs.append(entry.name)
+                except OSError:
+                    pass
+    except OSError as err:
+        logging.debug('cannot scan {}: {}'.format(path, err.strerror))
+    subdirs.sort()
+    return has_ovalfile, subdirs
+
+
+class WorkdirIndex:
+
+    '''Persistent record of the scanned directories, in .oval/workdirs.json,
+    so that a directory whose modification time did not change is not scanned again.'''
+
+    def __init__(self, root):
+        self.file_name = os.path.join(root, cache_dir, 'workdirs.json')
+        self.modified = False
+        try:
+            with open(self.file_name) as content:
+                self.entries = json.load(content)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def scan(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return False, []
+        entry = self.entries.get(path)
+        if entry and entry[0] == mtime:
+            return entry[1], entry[2]
+        has_ovalfile, subdirs = scan_directory(path)
+        self.entries[path] = [ mtime, has_ovalfile, subdirs ]
+        self.modified = True
+        return has_ovalfile, subdirs
+
+    def save(self):
+        if not self.modified:
+            return
+        tmp_file_name = '{}.{}'.format(self.file_name, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+            with open(tmp_file_name, 'w') as content:
+                json.dump(self.entries, content)
+            os.replace(tmp_file_name, self.file_name)
+        except OSError as err:
+            # a read-only tree goes on without index
+            logging.debug('cannot write the workdir index {}: {}'.format(self.file_name, err))
+            if os.path.exists(tmp_file_name):
+                os.remove(tmp_file_name)
+        self.modified = False
+
+
+class MemoryWorkdirIndex(WorkdirIndex):
+
+    'Record of the scanned directories, only kept in memory by the server'
+
+    def __init__(self):
+        self.entries = {}
+        self.modified = False
+
+    def save(self):
+        pass
+
+
+# the index of the server, which its children inherit
+served_index = None
+
+
+@traced('discovery')
+def find_workdirs(root, prune_patterns=(), max_depth=None, index=None):
+    '''Search root and its subdirectories for ovalfiles, depth first and in
+    alphabetical order. The search does not go below a directory which has an
+    ovalfile, below max_depth, or into hidden directories and the ones whose name
+    or relative path matches one of the prune_patterns.'''
+    scan = index.scan if index else scan_directory
+    workdirs = []
+    stack = [ (root, 0) ]
+    while stack:
+        path, depth = stack.pop()
+        has_ovalfile, subdirs = scan(path)
+        if has_ovalfile:
+            workdirs.append(path)
+            continue
+        if (max_depth is not None) and (depth >= max_depth):
+            continue
+        for name in reversed(subdirs):
+            subpath = os.path.join(path, name)
+            relpath = os.path.relpath(subpath, root)
+            if name[0] == '.':
+                continue
+            if [ p for p in prune_patterns if fnmatch.fnmatch(name, p) or fnmatch.fnmatch(relpath, p) ]:
+                continue
+            stack.append((subpath, depth + 1))
+    if index:
+        index.save()
+    return workdirs
 
 
 # ==========================================
 # process command-line options
 
+def positive_int(text):
+    'Return the integer of text, if at least 1'
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise argparse.ArgumentTypeError('invalid number {}, expecting an integer >= 1'.format(text))
+    return value
+
+
+def non_negative_int(text):
+    'Return the integer of text, if at least 0'
+    try:
+        value = int(text)
+    except ValueError:
+        value = -1
+    if value < 0:
+        raise argparse.ArgumentTypeError('invalid number {}, expecting an integer >= 0'.format(text))
+    return value
+
+
+def non_negative_float(text):
+    'Return the number of text, if at least 0'
+    try:
+        value = float(text)
+    except ValueError:
+        value = -1.
+    if not value >= 0:
+        raise argparse.ArgumentTypeError('invalid number {}, expecting a number >= 0'.format(text))
+    return value
+
+
 parser = argparse.ArgumentParser(description='Automatic running and diffing of executables')
 #parser.add_argument('-c', action="store_true", default=False, \
 #                    help='crypt the reference output')
+parser.add_argument('-j', '--jobs', type=positive_int, default=None,
+                    help='number of targets processed in parallel by run, diff, run-diff and prod'
+                         ' (default: 10 for run, else 1)')
+parser.add_argument('--build-command', default=None, metavar='TEMPLATE',
+                    help='command building the executables of a directory, where {exes}, {targets}'
+                         ' and {jobs} are replaced (default: "make -k -j{jobs} {exes}")')
+parser.add_argument('--build-check', default=None, metavar='TEMPLATE',
+                    help='command telling if the executable {exe} of the target {name} is built,'
+                         ' after the build command failed (default: "make -q {exe}")')
+parser.add_argument('--overlap', action="store_true", default=False,
+                    help='with prod and -j, run the targets of a directory whose executable is'
+                         ' already built while building the others')
+parser.add_argument('--timeout', type=float, default=None, metavar='SECONDS',
+                    help='kill the runs which last longer, unless the ovalfile sets another timeout')
+parser.add_argument('--cpu-time', type=float, default=None, metavar='SECONDS',
+                    help='limit the cpu time of each process of the runs')
+parser.add_argument('--max-vm', type=float, default=None, metavar='MB',
+                    help='limit the virtual memory of each process of the runs')
+parser.add_argument('--fail-fast', action="store_true", default=False,
+                    help='do not start any other target after the first failure')
+parser.add_argument('--changed', action="store_true", default=False,
+                    help='expand the wildcards only to the targets whose command or inputs changed since their last run')
+parser.add_argument('--since', default=None, metavar='REV',
+                    help='expand the wildcards only to the targets whose inputs changed since the git revision REV')
+parser.add_argument('--shard', type=parse_shard, default=None, metavar='I/N',
+                    help='process only the I-th of N shards of the selected targets, balanced'
+                         ' with the durations of their references')
+parser.add_argument('-B', '--force', action="store_true", default=False,
+                    help='run the targets even if they are up to date')
+parser.add_argument('--no-cache', action="store_true", default=False,
+                    help='ignore and do not update the cache of the diff results')
+parser.add_argument('--engine', choices=('pool', 'asyncio'), default='pool',
+                    help='run the targets in a pool of processes, or within a single event loop')
+parser.add_argument('--digest', choices=sorted(digests), default=None,
+                    help='algorithm of the digest files written by crypt and val'
+                         ' (default: the one of the former file, else md5)')
+parser.add_argument('--compress', choices=[ suffix[1:] for suffix in compressions ], default=None,
+                    help='compress the outputs of the runs into <name>.out.<compress>')
+parser.add_argument('--diff-engine', choices=sorted(diff_engines), default='myers',
+                    help='the algorithm comparing the single matches (default: myers)')
+parser.add_argument('--max-diffs', type=non_negative_int, default=None, metavar='N',
+                    help='stop comparing the single matches of a target after N differences'
+                         ' (0: never stop)')
+parser.add_argument('--prune', action='append', default=[], metavar='PATTERN',
+                    help='do not search ovalfiles in the directories whose name or relative path'
+                         ' matches PATTERN (shell-style wildcards, can be repeated)')
+parser.add_argument('--debounce', type=non_negative_float, default=.2, metavar='SECONDS',
+                    help='with watch, wait for SECONDS without change before processing the changes (default: .2)')
+parser.add_argument('--poll', action="store_true", default=False,
+                    help='with watch, poll the directories rather than using inotify, as for network filesystems')
+parser.add_argument('--ignore', action='append', default=[], metavar='PATTERN',
+                    help='with watch, ignore the changes of the files whose name matches PATTERN'
+                         ' (shell-style wildcards, can be repeated)')
+parser.add_argument('--max-depth', type=non_negative_int, default=None, metavar='N',
+                    help='do not search ovalfiles deeper than N levels of subdirectories')
+parser.add_argument('--index', action="store_true", default=False,
+                    help='keep an index of the searched directories in .oval/workdirs.json,'
+                         ' and only rescan the modified ones')
+parser.add_argument('--repeat', type=positive_int, default=5, metavar='N',
+                    help='number of measured runs of each target for perf (default: 5)')
+parser.add_argument('--warmup', type=non_negative_int, default=1, metavar='N',
+                    help='number of unmeasured runs of each target before perf measures (default: 1)')
+parser.add_argument('--history', type=non_negative_int, default=5, metavar='N',
+                    help='number of previous perf sessions used as reference, when there is no'
+                         ' reference stats (default: 5)')
+parser.add_argument('--perf-rel-tol', type=float, default=0.05, metavar='X',
+                    help='default relative tolerance of perf (default: 0.05)')
+parser.add_argument('--perf-abs-tol', type=float, default=0.01, metavar='SECONDS',
+                    help='default absolute tolerance of perf (default: 0.01)')
+parser.add_argument('--perf-k', type=float, default=3., metavar='K',
+                    help='default number of median absolute deviations tolerated by perf (default: 3)')
+parser.add_argument('--report', default=None, metavar='FILE',
+                    help='write a JSON line for each target into FILE')
+parser.add_argument('--junit', default=None, metavar='FILE',
+                    help='write the results of the targets into FILE, as JUnit XML')
+parser.add_argument('--report-diffs', type=non_negative_int, default=10, metavar='N',
+                    help='number of differences given by the reports (default: 10)')
+parser.add_argument('--trace', default=None, metavar='FILE',
+                    help='write the duration and counters of each phase of each target'
+                         ' into FILE, as a Chrome trace, and log a summary')
+parser.add_argument('--profile', default=None, metavar='FILE',
+                    help='profile the main process with cProfile, and dump the stats into FILE')
 parser.add_argument('subcommand',
                     help='the oval subcommand to apply')
 parser.add_argument('target', nargs='*', default=['%'],
                     help='the list of targets to be processed')
-args = parser.parse_args()
-
-# find ovalfiles and establish workdirs
-workdirs = []
-try_workdir(os.getcwd(),workdirs)
+args = parser.parse_intermixed_args()
+if args.subcommand == 'serve':
+    # the modules which the subcommands import on demand are imported
+    # once by the server, rather than by each of its children
+    import asyncio
+    import statistics
+    import ctypes.util
+    import xml.etree.ElementTree
+    import multiprocessing
+    import concurrent.futures
+    optional_module('numpy')
+    optional_module('zstandard')
+    # only the children of the server go on, each one with the arguments,
+    # directory, environment variables and standard streams of a client, and its own log file
+    served_index = serve(server_socket_name())
+    CWD = os.getcwd()
+    logger.removeHandler(log_file_handler)
+    log_file_handler.close()
+    log_file_handler = BlockFileHandler(log_file_name)
+    logger.addHandler(log_file_handler)
+    args = parser.parse_intermixed_args()
+
+if args.trace:
+    trace_events.set([])
+if args.report or args.junit:
+    report_handler = ReportHandler(args.report)
+    logger.addHandler(report_handler)
+if args.profile:
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
 
 # ==========================================
 # Prepare subcommand
@@ -543,12 +3729,26 @@ abbrevs = {
     'filter-ref': 'filter-ref', 'fr': 'filter-ref',
     'run-diff': 'run-diff', 'rd': 'run-diff',
     'prod': 'prod', 'pro': 'prod', 'pr': 'prod', 'p': 'prod',
+    'perf': 'perf', 'pf': 'perf',
+    'perf-report': 'perf-report', 'pfr': 'perf-report',
+    'merge': 'merge', 'merg': 'merge', 'mer': 'merge', 'm': 'merge',
+    'watch': 'watch', 'watc': 'watch', 'wat': 'watch', 'wa': 'watch', 'w': 'watch',
 }
 abbrev = args.subcommand
 if abbrev in abbrevs.keys():
     subcommand = abbrevs[abbrev]
 else:
     subcommand = abbrev
+if (args.engine == 'asyncio') and (subcommand not in async_subcommands):
+    parser.error('the asyncio engine only applies to {}'.format(' and '.join(async_subcommands)))
+
+# find ovalfiles and establish workdirs, then the targets of the shard
+workdirs = []
+if subcommand != 'merge':
+    workdirs = find_workdirs(os.getcwd(), default_prune_patterns + args.prune, args.max_depth,
+                             served_index or (WorkdirIndex(os.getcwd()) if args.index else None))
+    if args.shard:
+        sharded_targets = shard_selection(workdirs, subcommand, *args.shard)
 
 # ==========================================
 # Additional Help
@@ -568,14 +3768,29 @@ abbreviated subcommands:
 
 configuration files:
   Files called 'ovalfile.py' are recursively searched for in the current
-  directory and all its subdirectories.
+  directory and all its subdirectories, except the hidden ones and '__pycache__'.
+  The search stops at the first ovalfile of each branch. Other directories can
+  be skipped with '--prune <pattern>', and the depth limited with '--max-depth <n>'.
+  With '--index', the result of the search is kept in '.oval/workdirs.json'
+  and only the modified directories are scanned again.
 
 list of available targets:
   Each file 'ovalfile.py' is expected to define the targets of its
   corresponding directory, within a python list called 'targets´,
   each target being a dictionary with a 'name' and an associated
   shell 'command'. A way to get the list of local targets of a
-  directory is to move there and type 'oval list'.
+  directory is to move there and type 'oval list'. An ovalfile can
+  import the modules of its directory (single .py files), which are not
+  shared with the other directories, but is not executed from there:
+  it opens its files with paths joined to os.path.dirname(__file__).
+
+parallel execution:
+  'oval r -j <n> ...' runs the targets with n parallel workers, shared by
+  all the directories. The output of each target is displayed as a whole,
+  in the order of the targets. This also applies to 'diff', 'run-diff' and 'prod'.
+  By default, 'run' has 10 workers, and the other subcommands process the
+  targets one after the other ; 'oval r -j 1' streams the output of each
+  target as it comes.
 
 wildcards in target names:
   When running an oval subcommand, one can use wildcards:
@@ -583,31 +3798,231 @@ wildcards in target names:
   The only wildcard character is '%'.
   One can check how a given pattern expands : 'oval l <pattern>'.
 
+digest files:
+  'oval c' writes the md5 digests of the filtered groups of '<name>.ref'
+  into '<name>.md5', which 'oval d' uses when there is no '<name>.ref', and
+  'oval v' updates. With '--digest blake2b' (or sha256), or a 'digest'
+  variable in the target or the ovalfile, another algorithm is used, and
+  recorded in a first line '#oval-digest: <algorithm>' ; a file without it
+  is md5. The filters with two groups write the digests of the key and the
+  value on the same line. Both 'oval v' and 'oval c' accept '-j'.
+
+compressed logs:
+  The outputs and references can be compressed with gzip, xz, or zstd when
+  the module zstandard is installed: '<name>.out.gz', '<name>.ref.xz'... They
+  are found whatever their compression. With '--compress gz' (or xz, zst),
+  or a 'compress' variable in the target or the ovalfile, the runs compress
+  their output on the fly. 'oval v' copies the output with its compression,
+  and removes the references with another one. A declared input '<name>.out'
+  stands for the log of the target <name>, whatever its compression.
+
+reports:
+  With '--report <file>', a JSON line is written into '<file>' for each
+  target, with its status, return code, duration, number of differences and
+  first ones ('--report-diffs'), the paths of its output and reference, and
+  the stats of its run. With '--junit <file>', the same results are written
+  as JUnit XML, with a test suite per directory.
+
+tracing and profiling:
+  With '--trace <file>', the main phases of each target (run, filter,
+  compare, diff, crypt, val...) and of the whole command (discovery, config)
+  are written into '<file>' as a Chrome trace, which chrome://tracing or
+  https://ui.perfetto.dev can display, then summarized. The phases nest: a
+  diff includes the filtering and the comparison of the output and the
+  reference. They come with counters such as the lines read, the matches,
+  the bytes written and the processes spawned. With '--profile <file>', the
+  main process runs under cProfile, whose stats are dumped into '<file>'.
+
+asyncio engine:
+  With '--engine asyncio', 'oval r' and 'oval rd' supervise all the runs
+  from a single event loop, with at most '-j' of them at once (by default
+  10 for 'run', else one), rather than from a pool of processes. The commands without any shell
+  syntax are then executed without bash. This suits the many short targets.
+  The other subcommands reject this engine.
+
+server:
+  'oval serve' starts a server, which finds the workdirs below the current
+  directory, loads their ovalfiles, filters and diff caches, and keeps them
+  in memory. While it runs, each 'oval' command of the same user is sent to
+  the server through the socket '$XDG_RUNTIME_DIR/oval-<uid>/server.sock'
+  (or '/tmp/oval-<uid>/server.sock', or '$OVAL_SOCKET'), and executed by a
+  forked copy of the server, with the directory and terminal of the command.
+  The socket must be owned by the user, in a directory of mode 0700, which
+  the server creates, and the server must run as the user. The commands get
+  the whole environment, the umask and the resource limits ('ulimit') of the
+  client, rather than the ones of the server ; when the server cannot take
+  on these limits, or runs in another batch job than the client, the
+  command is executed by itself, as without server, or when OVAL_NO_SERVER
+  is set. The server refreshes its state between the commands, and stops
+  with Ctrl-C.
+
+watch:
+  'oval watch <patterns>' finds the workdirs and loads the ovalfiles once,
+  then watches the workdirs and the directories of the inputs of the targets,
+  with inotify, or by polling them with '--poll' or when inotify is not
+  available. After a burst of changes ended by '--debounce' seconds without
+  change, it only processes the affected targets : a changed reference is
+  compared again, a changed executable, input or ovalfile runs the target
+  again and compares it, as the targets which depend on it. A changed source
+  builds again the existing executables of its workdir, whose rebuilt ones
+  are run and compared. The hidden and temporary files, the object files and
+  the outputs are ignored, as the ones matching '--ignore <pattern>'. New
+  workdirs are not found before oval is started again.
+
+sharding:
+  With '--shard <i>/<n>', where 1 <= i <= n, oval only processes the i-th
+  of n shards of the selected targets of all the directories, so that n
+  machines or processes share a command such as 'oval prod %'. The shards
+  are balanced with the durations of the reference stats, and the targets
+  which depend on each other stay together. As the split must be the same
+  everywhere, it is made among the targets of the ovalfiles which match the
+  patterns ; each machine then leaves out of its shard the targets which lack
+  their logs, or, with '--changed' or '--since', did not change. Each shard
+  can write its results with
+  '--report <file>' ; then 'oval merge <file>...' tells the targets which
+  failed, returns the global verdict, and can write the merged results with
+  '--report' or '--junit'.
+
+changed targets:
+  Each run records the size, modification time and digest of the inputs of
+  its target (see below) and of its executable. With '--changed', the
+  wildcards only expand to the targets which did not run successfully with
+  their current command and inputs. With '--since <rev>', they only expand to
+  the targets whose inputs, executable or ovalfile changed since the git
+  revision '<rev>', such as 'HEAD' or 'main'. The targets which depend on a
+  selected one are also selected, and the targets given by name are kept.
+  A target without inputs is only selected again when its command changes,
+  or when its last run failed.
+  So that '--since' sees the changes of the sources, declare them as inputs.
+
+building:
+  'oval b' and 'oval prod' build the executables of all the selected targets
+  of a directory with a single command, by default 'make -k -j<n> <name>.exe...',
+  where <n> is given by '-j', and shared by the directories built at once
+  by the pool of '-j'. If it fails, 'make -q <name>.exe' tells which
+  targets failed ; 'prod' does not run them. A directory can change these
+  commands with the variables 'build_command' and 'build_check' of its
+  ovalfile, where '{exes}', '{targets}' and '{jobs}', or '{exe}' and '{name}',
+  are replaced. The options '--build-command' and '--build-check' override
+  them. A build command without check fails the whole directory. With '-j'
+  and '--overlap', 'prod' checks the executable of each target before the
+  build, and runs the targets whose executable is already built while
+  building the others.
+
+limits:
+  A target, or the whole ovalfile, can set a 'timeout' and a 'cpu_time' in
+  seconds, and a 'max_vm' in megabytes ; else the options '--timeout',
+  '--cpu-time' and '--max-vm' apply. The command runs in its own process
+  group, which is killed when the timeout expires. The cpu time and the
+  virtual memory (not the resident one, which Linux does not limit) are
+  limited with 'ulimit' for each process. A run which exceeds a limit is an
+  error ; a line 'oval: <limit> exceeded' ends its log, and its stats get a
+  'limit' field. A run which fails under a 'max_vm' is only reported as
+  exceeding it when its output tells a failed allocation (MemoryError,
+  std::bad_alloc, ENOMEM...), or its resident memory came within 10% of the
+  limit ; else it is an ordinary failure. With '--fail-fast', no other
+  target is started after the first failure.
+
+dependencies between targets:
+  A target can declare the files it reads in a list "inputs" (with shell
+  wildcards), the files it writes besides its log in a list "outputs", and
+  the names of the targets it must come after in a list "depends". A target
+  also comes after the targets whose outputs or log are among its inputs.
+  'run', 'run-diff' and 'prod' process the targets in this order, and with
+  '-j', start a target as soon as the ones it depends on are done.
+  A target with "inputs" is not run again if its log and outputs are newer
+  than its inputs, its executable '<name>.exe' and the outputs of the targets
+  it depends on, and if its command did not change. Use '-B' to force it.
+
+diff engines:
+  The single matches are compared with the Myers algorithm, after skipping the
+  common prefix and suffix. '--diff-engine difflib' selects the historical
+  comparison with difflib.Differ, as does a '"diff_engine": "difflib"' entry
+  in a target. '--max-diffs N' stops the comparison after N differences.
+
+diff cache:
+  The result of the comparison of '<name>.out' and '<name>.ref', and the
+  last ones of 'filter-out' and 'filter-ref', are kept in
+  '.oval/<name>.cache.json', within the directory of the target, with the
+  digests of the files. They are reused as long as the files, the filters and
+  the options are unchanged. Use '--no-cache' to bypass this cache, which is
+  also skipped when the directory is read-only.
+
+performance regressions:
+  'oval perf <targets>' runs each target '--warmup' times, then '--repeat'
+  times while measuring it. The samples are appended to '.oval/perf.jsonl',
+  and their median is saved into '<name>.stats.json', which 'oval v' copies
+  into '<name>.ref.stats.json'. The median is compared with the one of the
+  reference stats if any, else with the '--history' previous sessions.
+  A difference is reported as 'slower' or 'faster' if it exceeds the absolute
+  tolerance, the relative tolerance, and k times the median absolute deviation
+  of the samples. The target entries "perf_metric" (default: the "time" entry,
+  or "real"), "perf_abs_tol", "perf_rel_tol" and "perf_k" override the options.
+  'oval perf-report' compares the last session of each target with its
+  reference, without running anything. 'oval perf' returns an error code
+  in case of a slowdown.
+
+resources and time:
+  When running a target, oval measures the elapsed, user and system times,
+  the maximum resident memory and the blocks read and written by the command,
+  and saves them into '<name>.stats.json'. 'oval v' copies them into
+  '<name>.ref.stats.json'. If a target has an entry '"time": "real"' (or
+  "user", or "sys"), 'oval d' reports a difference when the duration
+  differs from the reference by more than 20%. References produced by former
+  versions, which end with the output of bash 'time', are still understood.
+
 ovalfile.py filters:
   run_filters_out: regular expression for the lines to be erased from the output.
   diff_filters_in: regular expression for the lines to be compared.
     If the regular expression has two groups, it is considered as a pair name-value.
     A dictionary will be built, the comparison will be between the current output
     and the ref dictionaries.
+    A filter with an entry "abs_tol" and/or "rel_tol" compares its values as
+    numbers, which are equal when their difference is at most
+    max(abs_tol, rel_tol*|ref|). The values of a filter with two groups are
+    compared key by key, the other ones in order. They are parsed and compared
+    with numpy when it is installed. 'oval d --report FILE' gives the max and
+    mean error of each of these filters, and the error of each key of the
+    filters with two groups. The tolerances do not apply to the digests of
+    '<name>.md5'.
 ''')
 
 # ==========================================
-# Start to process directories, in parallel if subcommand is "run"
+# Start to process directories, with parallel targets
+# if subcommand is "run", "diff", "run-diff" or "prod"
+
+# run keeps the 10 workers with which it formerly processed the directories
+jobs = args.jobs or (10 if subcommand == 'run' else 1)
 
 globalreturncode = 0
 if subcommand=='help':
   parser.print_help()
   additional_help()
-elif subcommand=='run':
-  pools = concurrent.futures.ProcessPoolExecutor(max_workers=10)
-  results = {}
-  for workdir in workdirs :
-    results[workdir] = pools.submit(process_directory,workdir,subcommand,args)
-  for workdir in workdirs :
-    tmpreturncode = results[workdir].result()
-    globalreturncode = globalreturncode or tmpreturncode
+elif subcommand=='merge':
+  globalreturncode = merge_reports(args.target)
+elif subcommand=='watch':
+  globalreturncode = watch_targets(workdirs)
+elif (subcommand in async_subcommands) and (args.engine=='asyncio'):
+  # asyncio is only imported by this engine, so that the others start faster
+  import asyncio
+  globalreturncode = asyncio.run(async_process_targets(workdirs,subcommand,args,jobs))
+elif (subcommand in parallel_subcommands) and (jobs>1):
+  globalreturncode = process_targets(workdirs,subcommand,args,jobs)
 else:
-  for workdir in workdirs :
-    tmpreturncode = process_directory(workdir,subcommand,args)
-    globalreturncode = globalreturncode or tmpreturncode
+  globalreturncode = process_directories(workdirs,subcommand,args)
+if args.profile:
+  profiler.disable()
+  profiler.dump_stats(args.profile)
+if args.trace:
+  write_trace(args.trace, trace_events.get())
+if report_handler:
+  report_handler.close()
+  if args.junit:
+    write_junit(args.junit, report_handler.reports)
+if served_index is not None:
+  # a child of the server skips the slow finalization of the interpreter
+  logging.shutdown()
+  sys.stdout.flush()
+  sys.stderr.flush()
+  os._exit(globalreturncode)
 sys.exit(globalreturncode)
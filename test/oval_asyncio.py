@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+"""
+Check of the asyncio engine of oval.
+
+Typing 'oval_asyncio.py' writes targets into a temporary workdir, whose
+command tells the name of its parent process, and checks that 'oval r'
+executes them without bash with '--engine asyncio', with or without '-j',
+and through bash with the default engine, that the outputs are given in
+the order of the targets, and that the other subcommands reject this
+engine. The exit code is 1 for any mismatch.
+"""
+
+import sys
+import os
+import stat
+import tempfile
+
+from oval_helpers import ovalfile, write, oval, report
+
+
+def main():
+    names = [ 't{}'.format(i) for i in range(6) ]
+    checks = []
+    with tempfile.TemporaryDirectory() as workdir:
+        write(workdir, 'ovalfile.py', ovalfile('[ {} ]'.format(', '.join(
+            '{{ "name" : "{}", "command" : "./parent.sh {}" }}'.format(name, name) for name in names))))
+        write(workdir, 'parent.sh', '#!/bin/bash\nsleep 0.$((RANDOM % 3))\necho $1 $(cat /proc/$PPID/comm)\n')
+        script_name = os.path.join(workdir, 'parent.sh')
+        os.chmod(script_name, os.stat(script_name).st_mode | stat.S_IXUSR)
+        expected = [ '{}: {} {}'.format(name, name, os.path.basename(sys.executable)[:15]) for name in names ]
+
+        returncode, output = oval(workdir, 'r', '--engine', 'asyncio')
+        checks.append(( 'asyncio without -j', output.splitlines() == expected ))
+        returncode, output = oval(workdir, 'r', '--engine', 'asyncio', '-j', '3')
+        checks.append(( 'asyncio with -j', output.splitlines() == expected ))
+        returncode, output = oval(workdir, 'r')
+        checks.append(( 'pool', output.splitlines() == [ '{}: {} bash'.format(name, name) for name in names ] ))
+        returncode, output = oval(workdir, 'd', '--engine', 'asyncio')
+        checks.append(( 'asyncio diff', returncode == 2 and 'the asyncio engine only applies' in output ))
+
+    return report('asyncio', checks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
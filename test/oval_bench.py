@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of oval itself.
+
+Typing 'oval_bench.py' generates a synthetic tree of workdirs, whose targets
+print large logs, then times the subcommands 'l', 'r', 'd', 'fo', 'c' and 'v'
+of oval on this tree, from end to end, and per phase (discovery, config load,
+run, filter, diff, crypt, val) with the python profiler. The results are
+written as JSON on the standard output, or into the file given with '-o',
+and summarized on the standard error.
+
+Typing 'oval_bench.py -h' lists the sizes of the tree and logs which can be
+configured. The same seed generates the same tree, so that the results of
+different versions of oval can be compared.
+"""
+
+import sys
+import argparse
+import os
+import random
+import time
+import json
+import shutil
+import statistics
+import subprocess
+import tempfile
+import pstats
+import platform
+
+
+# ==========================================
+# Generation of the synthetic tree
+
+def target_name(t):
+    return 't{:03d}'.format(t)
+
+
+def write_ovalfile(workdir, args):
+    'Write the ovalfile of a workdir, whose targets print their log with cat'
+    with open(os.path.join(workdir, 'ovalfile.py'), 'w') as content:
+        content.write('targets = [\n')
+        for t in range(args.targets):
+            content.write('    {{ "name": "{0}", "command": "cat {0}.log" }},\n'.format(target_name(t)))
+        content.write(']\n\n')
+        content.write('run_filters_out = [\n')
+        content.write('    { "re": "^DEBUG ", "apply": "%" },\n')
+        content.write(']\n\n')
+        content.write('diff_filters_in = [\n')
+        for f in range(args.filters):
+            if f % 2:
+                # a filter with two groups, compared as a key/value pair
+                content.write('    {{ "re": "^key{0}_(\\\\d+) = (\\\\S+)$", "apply": "%" }},\n'.format(f))
+            else:
+                content.write('    {{ "re": "^result{0}: (.*)$", "apply": "%" }},\n'.format(f))
+        content.write(']\n')
+
+
+def generate_log(rand, args):
+    'Return the lines printed by a target, with one matching line in args.match'
+    lines = []
+    for i in range(args.lines):
+        draw = rand.random()
+        if draw < args.match:
+            f = rand.randrange(args.filters)
+            if f % 2:
+                lines.append('key{}_{} = {}'.format(f, i, rand.randrange(1000)))
+            else:
+                lines.append('result{}: {:.6f}'.format(f, rand.random()))
+        elif draw < args.match + args.debug:
+            lines.append('DEBUG step {} {:x}'.format(i, rand.getrandbits(32)))
+        else:
+            lines.append('iteration {} of the computation, residual {:.3e}'.format(i, rand.random()))
+    return lines
+
+
+def alter_log(rand, lines, args):
+    'Return a copy of lines, where args.density of the matching ones are changed'
+    result = []
+    for line in lines:
+        if not line.startswith(('result', 'key')) or rand.random() >= args.density:
+            result.append(line)
+        elif line.startswith('key'):
+            result.append(line + '0')
+        else:
+            result.append(line + '1')
+    return result
+
+
+def generate_tree(root, args):
+    '''Generate args.dirs workdirs within root, each one with args.targets
+    targets, whose log is '<name>.log' and reference '<name>.ref'.'''
+    rand = random.Random(args.seed)
+    for d in range(args.dirs):
+        workdir = os.path.join(root, 'group{:02d}'.format(d % args.groups), 'dir{:03d}'.format(d))
+        os.makedirs(workdir)
+        write_ovalfile(workdir, args)
+        for t in range(args.targets):
+            lines = generate_log(rand, args)
+            with open(os.path.join(workdir, target_name(t) + '.log'), 'w') as content:
+                content.write('\n'.join(lines) + '\n')
+            ref_lines = [ line for line in alter_log(rand, lines, args) if not line.startswith('DEBUG ') ]
+            with open(os.path.join(workdir, target_name(t) + '.ref'), 'w') as content:
+                content.write('\n'.join(ref_lines) + '\n')
+
+
+# ==========================================
+# Timing of oval
+
+# the functions of oval whose cumulated time makes each phase
+phases = {
+    'discovery': ( 'find_workdirs', ),
+    'config': ( 'load_ovalfile', ),
+    'run': ( 'apply_run', 'async_run' ),
+    'filter': ( 'extract_matches', ),
+    'diff': ( 'compare_matches', ),
+    'crypt': ( 'apply_crypt', ),
+    'val': ( 'apply_val', ),
+}
+
+# the benchmarked commands, in the order where they make sense:
+# the logs must be run before being diffed, and val comes last
+scenarios = [
+    ( 'l', [ 'l', '%' ] ),
+    ( 'r', [ 'r', '%' ] ),
+    ( 'd', [ 'd', '--no-cache', '%' ] ),
+    ( 'd-cached', [ 'd', '%' ] ),
+    ( 'fo', [ 'fo', '--no-cache', '%' ] ),
+    ( 'c', [ 'c', '%' ] ),
+    ( 'v', [ 'v', '%' ] ),
+]
+
+
+def oval_command(args, oval_args):
+    return [ sys.executable, args.oval ] + oval_args + args.oval_args
+
+
+# so that a running oval server does not execute the measured commands
+oval_env = dict(os.environ, OVAL_NO_SERVER='1')
+
+
+def time_command(command, root):
+    'Run command in root, and return its duration and return code'
+    start = time.perf_counter()
+    proc = subprocess.run(command, cwd=root, env=oval_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start, proc.returncode
+
+
+def profile_phases(command, root):
+    '''Run command in root under the python profiler, which only sees the
+    main process, and return the cumulated time of each phase.'''
+    profile_file = os.path.join(root, '.oval_bench.prof')
+    subprocess.run([ command[0], '-m', 'cProfile', '-o', profile_file ] + command[1:], cwd=root, env=oval_env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not os.path.isfile(profile_file):
+        return {}
+    stats = pstats.Stats(profile_file).stats
+    os.remove(profile_file)
+    result = {}
+    for phase, functions in phases.items():
+        total = 0.
+        for (file_name, line, function), (cc, nc, tt, ct, callers) in stats.items():
+            if function in functions and file_name.endswith('oval.py'):
+                total += ct
+        if total:
+            result[phase] = round(total, 4)
+    return result
+
+
+def run_scenarios(root, args):
+    results = []
+    for name, oval_args in scenarios:
+        if name not in args.scenarios:
+            continue
+        command = oval_command(args, oval_args)
+        times = []
+        returncode = 0
+        for i in range(args.repeat):
+            duration, returncode = time_command(command, root)
+            times.append(duration)
+        result = {
+            'name': name,
+            'command': 'oval ' + ' '.join(oval_args + args.oval_args),
+            'returncode': returncode,
+            'times': [ round(t, 4) for t in times ],
+            'min': round(min(times), 4),
+            'median': round(statistics.median(times), 4),
+        }
+        if args.phases:
+            # the subprocesses of the pool would escape the profiler
+            result['phases'] = profile_phases(oval_command(args, oval_args + [ '-j', '1' ]), root)
+        results.append(result)
+        print_result(result)
+    return results
+
+
+def print_result(result):
+    phases_text = ' '.join('{}={:.3f}s'.format(k, v) for k, v in result.get('phases', {}).items())
+    print('{:10} median {:8.3f}s  min {:8.3f}s  {}'.format(
+        result['name'], result['median'], result['min'], phases_text), file=sys.stderr)
+
+
+# ==========================================
+# Command line
+
+default_oval = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin', 'oval.py')
+
+parser = argparse.ArgumentParser(description='Benchmark of oval on a synthetic tree of workdirs.')
+parser.add_argument('--dirs', type=int, default=20, help='number of workdirs (default: 20)')
+parser.add_argument('--groups', type=int, default=4, help='number of parent directories of the workdirs (default: 4)')
+parser.add_argument('--targets', type=int, default=10, help='number of targets per workdir (default: 10)')
+parser.add_argument('--lines', type=int, default=10000, help='number of lines per log (default: 10000)')
+parser.add_argument('--filters', type=int, default=4, help='number of diff filters (default: 4)')
+parser.add_argument('--match', type=float, default=.3, help='fraction of the lines which match a diff filter (default: .3)')
+parser.add_argument('--debug', type=float, default=.1, help='fraction of the lines erased by the run filter (default: .1)')
+parser.add_argument('--density', type=float, default=.01, help='fraction of the matching lines which differ in the reference (default: .01)')
+parser.add_argument('--seed', type=int, default=0, help='seed of the generation (default: 0)')
+parser.add_argument('--repeat', type=int, default=3, help='number of timings of each command (default: 3)')
+parser.add_argument('--no-phases', dest='phases', action='store_false', help='do not profile the phases')
+parser.add_argument('--scenarios', nargs='+', default=[ name for name, oval_args in scenarios ],
+                    choices=[ name for name, oval_args in scenarios ], help='the benchmarked commands')
+parser.add_argument('--oval', default=default_oval, help='the oval script to benchmark (default: {})'.format(default_oval))
+parser.add_argument('--oval-args', nargs=argparse.REMAINDER, default=[], help='options added to each oval command')
+parser.add_argument('--dir', default=None, help='generate the tree in this new directory, and keep it')
+parser.add_argument('-o', '--output', default=None, help='write the JSON results into this file')
+args = parser.parse_args()
+args.filters = max(args.filters, 1)
+
+
+# ==========================================
+# Main
+
+if args.dir:
+    root = os.path.abspath(args.dir)
+    os.makedirs(root)
+else:
+    root = tempfile.mkdtemp(prefix='oval_bench_')
+try:
+    start = time.perf_counter()
+    generate_tree(root, args)
+    print('generated {} workdirs of {} targets in {:.3f}s'.format(
+        args.dirs, args.targets, time.perf_counter() - start), file=sys.stderr)
+    results = run_scenarios(root, args)
+finally:
+    if not args.dir:
+        shutil.rmtree(root)
+
+report = {
+    'oval': os.path.abspath(args.oval),
+    'python': platform.python_version(),
+    'machine': platform.machine(),
+    'cpus': os.cpu_count(),
+    'parameters': { k: getattr(args, k) for k in ( 'dirs', 'groups', 'targets', 'lines', 'filters',
+                                                   'match', 'debug', 'density', 'seed', 'repeat', 'oval_args' ) },
+    'results': results,
+}
+if args.output:
+    with open(args.output, 'w') as content:
+        json.dump(report, content, indent=2)
+else:
+    json.dump(report, sys.stdout, indent=2)
+    print()
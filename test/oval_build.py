@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""
+Check of the builds of oval.
+
+Typing 'oval_build.py' writes into a temporary workdir a Makefile, where
+the executable of one target cannot be built, and checks that 'oval b' and
+'oval prod' tell the target whose build failed, from the check of each
+executable, also with '--overlap', and that the other target still runs.
+With a build command and no build check, the failure must be the one of
+the whole directory, told once. With '--overlap', a target whose executable
+is already built must run while the other one is building. The exit code
+is 1 for any mismatch.
+"""
+
+import sys
+import os
+import time
+import json
+import tempfile
+
+from oval_helpers import ovalfile, write, read, oval, report
+
+
+targets = '[ { "name" : "a", "command" : "echo a" }, { "name" : "b", "command" : "echo b" } ]'
+
+makefile = 'a.exe: a.c\n\tcp a.c a.exe\nb.exe: b.c\n\tfalse\n'
+
+# the build of b.exe is slow, and tells when it ends
+overlap_targets = '[ { "name" : "a", "command" : "echo a >> order.txt" }, { "name" : "b", "command" : "echo b" } ]'
+overlap_makefile = 'a.exe: a.c\n\tcp a.c a.exe\nb.exe: b.c\n\tsleep 1; echo built >> order.txt; cp b.c b.exe\n'
+
+
+def build_errors(workdir, report_name):
+    'Return the error of each target in the report'
+    lines = read(workdir, report_name).splitlines()
+    return { record['target']: record.get('error') for record in map(json.loads, lines) }
+
+
+def clean(workdir):
+    for file_name in [ 'a.exe', 'a.out', 'b.out' ]:
+        if os.path.exists(os.path.join(workdir, file_name)):
+            os.remove(os.path.join(workdir, file_name))
+
+
+def main():
+    checks = []
+    with tempfile.TemporaryDirectory() as workdir:
+        write(workdir, 'ovalfile.py', ovalfile(targets))
+        write(workdir, 'Makefile', makefile)
+        write(workdir, 'a.c', 'a\n')
+        write(workdir, 'b.c', 'b\n')
+
+        returncode, output = oval(workdir, 'b', '--report', 'build.jsonl')
+        checks.append(( 'failed target', returncode == 1 and 'ERROR: b: build failed' in output and
+                        'a: build failed' not in output ))
+        checks.append(( 'reported target', build_errors(workdir, 'build.jsonl') == { 'a': None, 'b': 'build failed' } ))
+
+        for options in ( [], [ '--overlap', '-j', '2' ] ):
+            clean(workdir)
+            returncode, output = oval(workdir, 'prod', *options)
+            checks.append(( 'skipped target' + (' with --overlap' if options else ''), returncode == 1 and
+                            os.path.exists(os.path.join(workdir, 'a.out')) and
+                            not os.path.exists(os.path.join(workdir, 'b.out')) ))
+
+        clean(workdir)
+        returncode, output = oval(workdir, 'b', '--build-command', 'make -k {exes}', '--build-check', 'test -f {exe}',
+                                  '--report', 'check.jsonl')
+        checks.append(( 'build check', returncode == 1 and
+                        build_errors(workdir, 'check.jsonl') == { 'a': None, 'b': 'build failed' } ))
+
+        clean(workdir)
+        returncode, output = oval(workdir, 'prod', '--build-command', 'make -k {exes}', '--report', 'dir.jsonl')
+        checks.append(( 'failed directory', returncode == 1 and
+                        output.count('no build check tells for which targets') == 1 and
+                        build_errors(workdir, 'dir.jsonl') == { 'a': 'build of the directory failed',
+                                                                'b': 'build of the directory failed' } and
+                        not os.path.exists(os.path.join(workdir, 'a.out')) ))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        write(workdir, 'ovalfile.py', ovalfile(overlap_targets))
+        write(workdir, 'Makefile', overlap_makefile)
+        write(workdir, 'a.c', 'a\n')
+        write(workdir, 'b.c', 'b\n')
+        write(workdir, 'a.exe', 'a\n')
+        os.utime(os.path.join(workdir, 'a.c'), ( time.time() - 10, time.time() - 10 ))
+
+        for options, order in ( ( [], [ 'built', 'a' ] ), ( [ '--overlap' ], [ 'a', 'built' ] ) ):
+            for file_name in [ 'b.exe', 'order.txt' ]:
+                if os.path.exists(os.path.join(workdir, file_name)):
+                    os.remove(os.path.join(workdir, file_name))
+            returncode, output = oval(workdir, 'prod', '-j', '2', *options)
+            checks.append(( 'built target' + (' with --overlap' if options else ''), returncode == 0 and
+                            read(workdir, 'order.txt').split() == order ))
+
+    return report('build', checks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
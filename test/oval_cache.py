@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""
+Check of the cache of the results of oval.
+
+Typing 'oval_cache.py' writes a target into a temporary workdir, and checks
+that the results of 'oval d', 'oval fo' and 'oval fr' are taken from the cache
+when the logs, the filters and the options are unchanged, even if the logs
+are touched, and computed again when any of them changes. The exit code is 1
+for any mismatch.
+"""
+
+import sys
+import os
+import tempfile
+
+import oval_helpers
+from oval_helpers import write, read, report
+
+
+targets = '[ { "name" : "t", "command" : "true" } ]'
+
+
+def oval(workdir, *arguments):
+    '''Return the output of the oval command, and whether its result was
+    taken from the cache, as told by the log file of the workdir.'''
+    returncode, output = oval_helpers.oval(workdir, *arguments)
+    return output, ' :: cached ' in read(workdir, '.oval.log')
+
+
+def main():
+    checks = []
+    with tempfile.TemporaryDirectory() as workdir:
+        write(workdir, 'ovalfile.py', oval_helpers.ovalfile(targets))
+        write(workdir, 't.ref', 'a\nb\nc\n')
+        write(workdir, 't.out', 'a\nx\nc\n')
+
+        first, cached = oval(workdir, 'd')
+        checks.append(( 'first diff', not cached and ('+ x' in first) ))
+        again, cached = oval(workdir, 'd')
+        checks.append(( 'same diff', cached and again == first ))
+        os.utime(os.path.join(workdir, 't.out'))
+        again, cached = oval(workdir, 'd')
+        checks.append(( 'touched output', cached and again == first ))
+        write(workdir, 't.out', 'a\ny\nc\n')
+        changed, cached = oval(workdir, 'd')
+        checks.append(( 'changed output', not cached and ('+ y' in changed) ))
+        write(workdir, 't.ref', 'a\ny\nc\n')
+        changed, cached = oval(workdir, 'd')
+        checks.append(( 'changed reference', not cached and ('==' in changed) ))
+        write(workdir, 't.out', 'a\ny\nc\nd\n')
+        oval(workdir, 'd')
+        changed, cached = oval(workdir, 'd', '--max-diffs', '1')
+        checks.append(( 'changed option', not cached and ('+ d' in changed) ))
+        changed, cached = oval(workdir, 'd', '--no-cache')
+        checks.append(( 'no cache', not cached and ('+ d' in changed) ))
+        write(workdir, 'ovalfile.py', oval_helpers.ovalfile(targets, '^([a-c])$'))
+        changed, cached = oval(workdir, 'd')
+        checks.append(( 'changed filters', not cached and ('==' in changed) ))
+
+        first, cached = oval(workdir, 'fo', 't')
+        checks.append(( 'first filter-out', not cached and first.split() == [ 'a', 'c' ] ))
+        again, cached = oval(workdir, 'fo', 't')
+        checks.append(( 'same filter-out', cached and again == first ))
+        write(workdir, 't.out', 'b\n')
+        changed, cached = oval(workdir, 'fo', 't')
+        checks.append(( 'changed filter-out', not cached and changed.split() == [ 'b' ] ))
+        first, cached = oval(workdir, 'fr', 't')
+        again, cached = oval(workdir, 'fr', 't')
+        checks.append(( 'same filter-ref', cached and again == first == 'a\nc\n' ))
+
+    return report('cache', checks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
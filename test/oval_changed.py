@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""
+Check of the selection of the changed targets by oval.
+
+Typing 'oval_changed.py' writes targets with inputs into a temporary workdir,
+which is also a git repository, and checks that 'oval r --changed' runs only
+the targets whose command or inputs changed since their last run, with the
+targets which depend on them, or which are given explicitly, and that
+'oval r --since <rev>' runs the ones whose inputs changed since a git
+revision. The exit code is 1 for any mismatch.
+"""
+
+import sys
+import os
+import subprocess
+import tempfile
+
+import oval_helpers
+from oval_helpers import ovalfile, write, read, report
+
+
+targets = '''[ { "name" : "a", "command" : "echo a >> ran.txt; cat a.txt", "inputs": [ "a.txt" ] },
+            { "name" : "b", "command" : "echo b >> ran.txt; cat b.txt%s", "inputs": [ "b.txt" ] },
+            { "name" : "c", "command" : "echo c >> ran.txt; cat a.out", "inputs": [ "a.out" ] } ]'''
+
+
+def git(workdir, *arguments):
+    subprocess.run([ 'git', '-c', 'user.name=oval', '-c', 'user.email=oval@localhost' ] + list(arguments),
+                   cwd=workdir, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def oval(workdir, *arguments):
+    'Return the sorted names of the targets which the oval command ran'
+    oval_helpers.oval(workdir, *arguments)
+    if not os.path.exists(os.path.join(workdir, 'ran.txt')):
+        return []
+    names = sorted(read(workdir, 'ran.txt').split())
+    os.remove(os.path.join(workdir, 'ran.txt'))
+    return names
+
+
+def main():
+    checks = []
+    with tempfile.TemporaryDirectory() as workdir:
+        write(workdir, 'ovalfile.py', ovalfile(targets % ''))
+        write(workdir, 'a.txt', 'A\n')
+        write(workdir, 'b.txt', 'B\n')
+
+        checks.append(( 'first run', oval(workdir, 'r', '--changed') == [ 'a', 'b', 'c' ] ))
+        checks.append(( 'unchanged targets', oval(workdir, 'r', '--changed') == [] ))
+        write(workdir, 'a.txt', 'A2\n')
+        checks.append(( 'changed input', oval(workdir, 'r', '--changed') == [ 'a', 'c' ] ))
+        os.utime(os.path.join(workdir, 'a.txt'))
+        os.utime(os.path.join(workdir, 'b.txt'))
+        checks.append(( 'touched inputs', oval(workdir, 'r', '--changed') == [] ))
+        write(workdir, 'ovalfile.py', ovalfile(targets % '; true'))
+        checks.append(( 'changed command', oval(workdir, 'r', '--changed') == [ 'b' ] ))
+        checks.append(( 'explicit target', oval(workdir, 'r', '--changed', 'a') == [ 'a' ] ))
+
+        # the logs and the stats are not part of the sources
+        write(workdir, '.gitignore', '*.out\n*.json\n.oval*\nran.txt\n')
+        git(workdir, 'init', '.')
+        git(workdir, 'add', '.gitignore', 'ovalfile.py', 'a.txt', 'b.txt')
+        git(workdir, 'commit', '-m', 'inputs')
+        checks.append(( 'unchanged since', oval(workdir, 'r', '--since', 'HEAD') == [] ))
+        write(workdir, 'b.txt', 'B2\n')
+        checks.append(( 'changed since', oval(workdir, 'r', '--since', 'HEAD') == [ 'b' ] ))
+
+    return report('changed', checks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
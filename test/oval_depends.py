@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""
+Check of the dependencies between the targets of oval.
+
+Typing 'oval_depends.py' writes targets into a temporary workdir, which are
+listed before the targets whose outputs they read, or which they depend on,
+and checks that 'oval r' runs them after the latter, that it skips the
+targets whose log is newer than their inputs, unless their command changed,
+their last run failed, or '-B' is given, and that it runs all the targets
+of a dependency cycle, with an error. The exit code is 1 for any mismatch.
+"""
+
+import sys
+import os
+import time
+import tempfile
+
+from oval_helpers import ovalfile, write, read, oval, report
+
+
+targets = '''[ { "name" : "report", "command" : "echo report >> ran.txt; cat sum.txt%s", "inputs": [ "sum.txt" ] },
+            { "name" : "last", "command" : "echo last >> ran.txt", "depends": [ "report" ] },
+            { "name" : "bad", "command" : "echo bad >> ran.txt; false", "inputs": [ "data.txt" ] },
+            { "name" : "sum", "command" : "echo sum >> ran.txt; cat data.txt > sum.txt", "inputs": [ "data.txt" ],
+              "outputs": [ "sum.txt" ] } ]'''
+
+cycle = '''[ { "name" : "c1", "command" : "echo c1 >> ran.txt", "depends": [ "c2" ] },
+            { "name" : "c2", "command" : "echo c2 >> ran.txt", "depends": [ "c1" ] } ]'''
+
+
+def ran(workdir, *arguments):
+    'Return the names of the targets which the oval command ran, in their order, and its output'
+    returncode, output = oval(workdir, 'r', *arguments)
+    names = read(workdir, 'ran.txt').split() if os.path.exists(os.path.join(workdir, 'ran.txt')) else []
+    if names:
+        os.remove(os.path.join(workdir, 'ran.txt'))
+    return names, output
+
+
+def main():
+    checks = []
+    with tempfile.TemporaryDirectory() as workdir:
+        write(workdir, 'ovalfile.py', ovalfile(targets % ''))
+        write(workdir, 'data.txt', '1\n')
+
+        names, output = ran(workdir, '-j', '1')
+        checks.append(( 'dependency order', names == [ 'bad', 'sum', 'report', 'last' ] ))
+        # the independent targets run concurrently, the others after their dependencies
+        names, output = ran(workdir, '-B')
+        checks.append(( 'concurrent order', sorted(names) == [ 'bad', 'last', 'report', 'sum' ] and
+                        names.index('sum') < names.index('report') < names.index('last') ))
+        names, output = ran(workdir)
+        checks.append(( 'up to date', sorted(names) == [ 'bad', 'last' ] and 'sum: up to date' in output and
+                        'report: up to date' in output ))
+
+        # the logs are aged, so that the data is newer whatever the resolution of the clock
+        for file_name in [ 'report.out', 'last.out', 'bad.out', 'sum.out', 'sum.txt' ]:
+            os.utime(os.path.join(workdir, file_name), ( time.time() - 10, time.time() - 10 ))
+        write(workdir, 'data.txt', '2\n')
+        names, output = ran(workdir, '-j', '1')
+        checks.append(( 'changed input', names == [ 'bad', 'sum', 'report', 'last' ] and
+                        read(workdir, 'report.out') == '2\n' ))
+        write(workdir, 'ovalfile.py', ovalfile(targets % '; true'))
+        names, output = ran(workdir, '-j', '1')
+        checks.append(( 'changed command', names == [ 'bad', 'report', 'last' ] ))
+        names, output = ran(workdir, '-j', '1', '-B')
+        checks.append(( 'forced run', names == [ 'bad', 'sum', 'report', 'last' ] ))
+
+        write(workdir, 'ovalfile.py', ovalfile(cycle))
+        names, output = ran(workdir, '-j', '1')
+        checks.append(( 'dependency cycle', names == [ 'c1', 'c2' ] and 'dependency cycle between c1, c2' in output ))
+
+    return report('depends', checks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
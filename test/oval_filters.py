@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""
+Check of the filters of oval, merged into a single regular expression.
+
+Typing 'oval_filters.py' writes random lines into a temporary workdir, with
+filters which overlap, have no group, nested or optional groups, and checks
+that 'oval fo' gives the groups of every matching filter, in the order of the
+filters, as when each filter is applied alone, also with a back reference
+which prevents the merge, and that 'oval r' drops the lines matching any of
+the run filters. The same seed gives the same lines. The exit code is 1 for
+any mismatch.
+"""
+
+import sys
+import re
+import random
+import tempfile
+
+from oval_helpers import write, read, oval, report
+
+
+words = [ 'a', 'b', 'ab', 'x', 'LINE', '=', '1', '42', '' ]
+
+# the following filters overlap, and the last ones have no group or nested ones
+diff_patterns = [ r'^(\w+) = (\d+)$', r'^(\w+) = (.*)$', r'%(ab)%', r'^((a)|(b))+ .*$', r'^LINE (\d+)?(x)?$',
+                  r'^\w+$' ]
+run_patterns = [ r'^x%', r'% x$' ]
+
+
+def random_lines(seed, nb_lines):
+    generator = random.Random(seed)
+    return [ ' '.join(generator.choice(words) for i in range(generator.randint(1, 3))) for j in range(nb_lines) ]
+
+
+def ovalfile(diff_patterns):
+    filters = lambda patterns: [ { 'name': 'f', 're': pattern, 'apply': '%' } for pattern in patterns ]
+    return ('targets = [ {{ "name" : "t", "command" : "cat lines.txt" }} ]\n'
+            'run_filters_out = {!r}\ndiff_filters_in = {!r}\n').format(filters(run_patterns), filters(diff_patterns))
+
+
+def expected_groups(lines, patterns):
+    'The groups of each filter applied alone, as printed by oval fo'
+    exps = [ re.compile('^' + pattern.replace('%', '.*') + '$') for pattern in patterns ]
+    groups = [ '{}'.format(group) for line in lines for exp in exps if exp.match(line)
+               for group in exp.match(line).groups() ]
+    return '\n'.join(groups or [ 'no match' ]) + '\n'
+
+
+def main():
+    seed = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    lines = random_lines(seed, 500)
+    checks = []
+    with tempfile.TemporaryDirectory() as workdir:
+        write(workdir, 'lines.txt', '\n'.join(lines) + '\n')
+        write(workdir, 'ovalfile.py', ovalfile(diff_patterns))
+
+        oval(workdir, 'r')
+        kept = [ line for line in lines if not re.match('^x.*$', line) and not re.match('^.* x$', line) ]
+        checks.append(( 'run filters', read(workdir, 't.out').splitlines() == kept ))
+        checks.append(( 'merged filters', oval(workdir, 'fo', 't') == ( 0, expected_groups(kept, diff_patterns) ) ))
+
+        # a back reference numbers the groups of its own filter
+        patterns = diff_patterns + [ r'^(\w+) = \1$' ]
+        write(workdir, 'ovalfile.py', ovalfile(patterns))
+        checks.append(( 'unmerged filters', oval(workdir, 'fo', 't') == ( 0, expected_groups(kept, patterns) ) ))
+
+        patterns = [ r'^none (\d+)$' ]
+        write(workdir, 'ovalfile.py', ovalfile(patterns))
+        checks.append(( 'no match', oval(workdir, 'fo', 't') == ( 0, expected_groups(kept, patterns) ) ))
+
+    return report('filters', checks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
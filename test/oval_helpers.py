@@ -0,0 +1,65 @@
+"""
+Helpers of the check scripts of oval.
+
+Each script writes an ovalfile and some files into a temporary workdir,
+executes oval there, and gives its checks, as pairs of a name and of a
+boolean telling if it passed, to report(), which prints the result.
+"""
+
+import sys
+import os
+import subprocess
+
+
+# the oval script under test
+oval_file_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin', 'oval.py')
+
+# the longest wait for a background oval, in seconds
+timeout = 20.
+
+
+def ovalfile(targets, pattern='^(.*)$'):
+    '''Return the text of an ovalfile, whose targets are given as the text of
+    a python list, and whose single diff filter is pattern.'''
+    return ('targets = {}\nrun_filters_out = [ ]\n'
+            'diff_filters_in = [ {{ "name" : "all", "re": {!r}, "apply": "%" }} ]\n').format(targets, pattern)
+
+
+def write(workdir, file_name, text):
+    with open(os.path.join(workdir, file_name), 'w') as content:
+        content.write(text)
+
+
+def read(workdir, file_name):
+    with open(os.path.join(workdir, file_name)) as content:
+        return content.read()
+
+
+def oval_command(*arguments):
+    'The command line of oval with arguments, whose output is not buffered'
+    return [ sys.executable, '-u', oval_file_name ] + list(arguments)
+
+
+def oval_env(**variables):
+    'The environment of oval with variables, where no oval server executes the commands'
+    return dict(os.environ, OVAL_NO_SERVER='1', **variables)
+
+
+def oval(workdir, *arguments, env=None, timeout=None):
+    '''Execute the oval command in workdir, with the environment env, by default
+    the one of oval_env(), and return its return code and its output.'''
+    proc = subprocess.run(oval_command(*arguments), cwd=workdir, env=env or oval_env(), timeout=timeout,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    return proc.returncode, proc.stdout
+
+
+def report(name, checks):
+    '''Print the failed checks of the script name, or their number if they all
+    pass, and return the exit code of the script.'''
+    failures = [ check for check, passed in checks if not passed ]
+    for check in failures:
+        print('{}: wrong result for the {}'.format(name, check))
+    if failures:
+        return 1
+    print('{}: {} checks pass'.format(name, len(checks)))
+    return 0
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+"""
+Check of the limits of the runs of oval.
+
+Typing 'oval_limits.py' writes targets which sleep, spin or allocate too much
+into a temporary workdir, and checks that 'oval r' stops them at their
+'timeout', 'cpu_time' or 'max_vm', with an error, a last line 'oval: <limit>
+exceeded' in their log and a 'limit' in their stats, with both engines and
+with the '--timeout' option, that an ordinary failure under '--max-vm' is not
+blamed on this limit, and that '--fail-fast' starts no target after the
+first failure. The exit code is 1 for any mismatch.
+"""
+
+import sys
+import os
+import json
+import time
+import tempfile
+
+import oval_helpers
+from oval_helpers import ovalfile, write, read, report
+
+
+targets = '''[
+    { "name" : "slow", "command" : "echo start; sleep 30 & wait", "timeout": 0.5 },
+    { "name" : "spin", "command" : "python3 -c 'while True: pass'", "cpu_time": 1 },
+    { "name" : "big", "command" : "python3 -c 'x = bytearray(400 << 20)'", "max_vm": 200 },
+    { "name" : "ok", "command" : "echo ok" },
+    { "name" : "fail", "command" : "echo fail; exit 3" },
+    { "name" : "nap", "command" : "sleep 30" } ]'''
+
+
+def oval(workdir, *arguments):
+    'Return the return code and the output of the oval command, and its duration'
+    start = time.monotonic()
+    returncode, output = oval_helpers.oval(workdir, *arguments)
+    return returncode, output, time.monotonic() - start
+
+
+def limit(workdir, name):
+    'Return the last line of the log of the target name, and the limit of its stats'
+    stats = json.loads(read(workdir, name + '.stats.json'))
+    return read(workdir, name + '.out').splitlines()[-1], stats.get('limit')
+
+
+def main():
+    checks = []
+    with tempfile.TemporaryDirectory() as workdir:
+        write(workdir, 'ovalfile.py', ovalfile(targets))
+
+        returncode, output, duration = oval(workdir, 'r', 'slow', 'spin', 'big', 'ok')
+        checks.append(( 'return code', returncode == 1 ))
+        checks.append(( 'timeout', duration < 20 and
+                        limit(workdir, 'slow') == ( 'oval: timeout exceeded (0.5)', 'timeout' ) and
+                        'ERROR: slow: timeout exceeded (0.5)' in output ))
+        checks.append(( 'cpu time', limit(workdir, 'spin') == ( 'oval: cpu_time exceeded (1)', 'cpu_time' ) ))
+        checks.append(( 'memory', limit(workdir, 'big') == ( 'oval: max_vm exceeded (200)', 'max_vm' ) and
+                        'MemoryError' in read(workdir, 'big.out') ))
+        checks.append(( 'unlimited target', read(workdir, 'ok.out') == 'ok\n' ))
+
+        returncode, output, duration = oval(workdir, 'r', '--timeout', '0.5', 'nap')
+        checks.append(( 'timeout option', returncode == 1 and duration < 20 and
+                        limit(workdir, 'nap') == ( 'oval: timeout exceeded (0.5)', 'timeout' ) ))
+        # a failure which tells no failed allocation is not blamed on the memory limit
+        for options in ( [], [ '--engine', 'asyncio' ] ):
+            returncode, output, duration = oval(workdir, 'r', '--max-vm', '1000', *options, 'fail')
+            checks.append(( 'other failure' + (' with asyncio' if options else ''), returncode == 1 and
+                            'exceeded' not in output and read(workdir, 'fail.out') == 'fail\n' and
+                            limit(workdir, 'fail') == ( 'fail', None ) ))
+        returncode, output, duration = oval(workdir, 'r', '--engine', 'asyncio', 'slow', 'spin', 'big')
+        checks.append(( 'asyncio limits', returncode == 1 and duration < 20 and
+                        limit(workdir, 'slow') == ( 'oval: timeout exceeded (0.5)', 'timeout' ) and
+                        limit(workdir, 'spin') == ( 'oval: cpu_time exceeded (1)', 'cpu_time' ) and
+                        limit(workdir, 'big') == ( 'oval: max_vm exceeded (200)', 'max_vm' ) ))
+
+        os.remove(os.path.join(workdir, 'ok.out'))
+        returncode, output, duration = oval(workdir, 'r', '-j', '1', '--fail-fast', 'slow', 'ok')
+        checks.append(( 'fail fast', returncode == 1 and not os.path.exists(os.path.join(workdir, 'ok.out')) ))
+
+    return report('limits', checks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""
+Check of the reading of the logs by oval.
+
+Typing 'oval_lines.py' loads bin/oval.py as a module, within a temporary
+directory, and checks that its line readers give the lines of random logs,
+with '\\n' or '\\r\\n' ends of lines, whatever the size of the chunks which
+they decode at once. The same seed gives the same logs. The exit code is 1
+for any mismatch.
+"""
+
+import sys
+import argparse
+import os
+import io
+import random
+import tempfile
+import contextlib
+import importlib.util
+
+
+def load_oval(directory):
+    '''Execute bin/oval.py as a module, within directory, where its log file
+    is written, with the arguments of 'oval help', and return the module.'''
+    file_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin', 'oval.py')
+    spec = importlib.util.spec_from_file_location('oval', file_name)
+    oval = importlib.util.module_from_spec(spec)
+    cwd = os.getcwd()
+    argv = sys.argv
+    os.environ['OVAL_NO_SERVER'] = '1'
+    os.chdir(directory)
+    sys.argv = [ 'oval.py', 'help' ]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            spec.loader.exec_module(oval)
+    except SystemExit:
+        pass
+    finally:
+        sys.argv = argv
+        os.chdir(cwd)
+    return oval
+
+
+def random_log(rng, nb_lines):
+    'Return the lines of a random log, and its content with random ends of lines'
+    lines = [ 'x = {}'.format(rng.randint(0, 10 ** rng.randint(0, 6))) for i in range(nb_lines) ]
+    end = rng.choice(( b'\n', b'\r\n' ))
+    return lines, b''.join(line.encode('utf-8') + end for line in lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the reading of the logs by oval')
+    parser.add_argument('--logs', type=int, default=200, help='number of random logs (default: 200)')
+    parser.add_argument('--max-lines', type=int, default=50, help='maximum number of lines of a log (default: 50)')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the random logs (default: 1)')
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        oval = load_oval(directory)
+        for i in range(args.logs):
+            lines, data = random_log(rng, rng.randint(1, args.max_lines))
+            for chunk_size in ( 1, 2, 3, 7, 1 << 20 ):
+                # the trailing end of line gives a last empty line, as with 'cat'
+                found = list(oval.iter_lines(data, len(data), chunk_size))
+                if found != lines + [ '' ]:
+                    failures += 1
+                    print('iter_lines with chunks of {}: {!r} instead of {!r}'.format(chunk_size, found, lines))
+    if failures:
+        return 1
+    print('lines: {} random logs are read back'.format(args.logs))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
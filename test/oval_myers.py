@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""
+Check of the diff engine of oval against a longest common subsequence.
+
+Typing 'oval_myers.py' writes random pairs of short logs into a temporary
+workdir, compares them all with 'oval d', and checks that the lines which
+oval reports as removed from the reference, or added to the output, are the
+complement of a common subsequence of both logs, as long as the longest one.
+Compared again with '--max-diffs', the reported lines must still be removed
+from the reference or added to the output, and be cut at the limit. The same
+seed gives the same logs. The exit code is 1 for any mismatch.
+"""
+
+import sys
+import argparse
+import os
+import random
+import subprocess
+import tempfile
+import collections
+
+
+def lcs_length(a, b):
+    'Length of a longest common subsequence of the lists a and b'
+    previous = [ 0 ] * (len(b) + 1)
+    for x in a:
+        current = [ 0 ]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def is_subsequence(a, b):
+    'Tell if the list a is a subsequence of the list b'
+    items = iter(b)
+    return all(x in items for x in a)
+
+
+def check(ref, out, removed, added):
+    '''Return the reason why removed and added are not a minimal diff from
+    ref to out, or None.'''
+    if not is_subsequence(removed, ref):
+        return 'the removed lines are not in the reference'
+    if not is_subsequence(added, out):
+        return 'the added lines are not in the output'
+    if collections.Counter(ref) - collections.Counter(removed) != collections.Counter(out) - collections.Counter(added):
+        return 'the kept lines differ'
+    if len(removed) + len(added) != len(ref) + len(out) - 2 * lcs_length(ref, out):
+        return '{} differences, instead of {}'.format(len(removed) + len(added),
+                                                       len(ref) + len(out) - 2 * lcs_length(ref, out))
+    return None
+
+
+def check_cut(ref, out, removed, added, cut, max_diffs):
+    '''Return the reason why removed and added are not the start of a diff
+    from ref to out, cut after max_diffs lines, or None.'''
+    nbdiff = len(ref) + len(out) - 2 * lcs_length(ref, out)
+    if not is_subsequence(removed, ref):
+        return 'the removed lines are not in the reference'
+    if not is_subsequence(added, out):
+        return 'the added lines are not in the output'
+    if len(removed) + len(added) != min(nbdiff, max_diffs):
+        return '{} differences, instead of {}'.format(len(removed) + len(added), min(nbdiff, max_diffs))
+    if cut != (nbdiff > max_diffs):
+        return 'cut after {} of {} differences'.format(max_diffs, nbdiff)
+    return None
+
+
+def compare(oval, workdir, names, options):
+    '''Compare the logs of workdir with 'oval d', and return the removed and
+    added lines of each target of names, and whether its diff was cut.'''
+    env = dict(os.environ, OVAL_NO_SERVER='1')
+    proc = subprocess.run([ sys.executable, oval, 'd', '--no-cache', '--diff-engine', 'myers' ] + options,
+                          cwd=workdir, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          universal_newlines=True)
+    diffs = { name: ( [], [], [] ) for name in names }
+    for line in proc.stdout.splitlines():
+        name, sep, diff = line.partition(': ')
+        if name in diffs and diff[:2] in ( '- ', '+ ' ):
+            diffs[name][0 if diff[0] == '-' else 1].append(diff[2:])
+        elif name in diffs and diff == '...':
+            diffs[name][2].append(diff)
+    return diffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the diff engine of oval against a longest common subsequence')
+    parser.add_argument('--pairs', type=int, default=200, help='number of random pairs of logs (default: 200)')
+    parser.add_argument('--max-lines', type=int, default=12, help='maximum number of lines of a log (default: 12)')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the random logs (default: 1)')
+    parser.add_argument('--max-diffs', type=int, default=3,
+                        help='limit of the differences of the second comparison (default: 3)')
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    oval = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin', 'oval.py')
+
+    with tempfile.TemporaryDirectory() as workdir:
+        pairs = {}
+        for i in range(args.pairs):
+            name = 'p{:04d}'.format(i)
+            ref = [ rng.choice('abc') for j in range(rng.randint(1, args.max_lines)) ]
+            out = [ rng.choice('abc') for j in range(rng.randint(1, args.max_lines)) ]
+            for suffix, lines in ( ( '.ref', ref ), ( '.out', out ) ):
+                with open(os.path.join(workdir, name + suffix), 'w') as content:
+                    content.write(''.join(line + '\n' for line in lines))
+            pairs[name] = ( ref, out )
+        with open(os.path.join(workdir, 'ovalfile.py'), 'w') as content:
+            content.write('targets = [ {} ]\n'.format(', '.join(
+                '{{ "name" : "{}", "command" : "true" }}'.format(name) for name in pairs)))
+            content.write('run_filters_out = [ ]\n')
+            content.write('diff_filters_in = [ { "name" : "all", "re": "^(.*)$", "apply": "%" } ]\n')
+
+        diffs = compare(oval, workdir, pairs, [])
+        cut_diffs = compare(oval, workdir, pairs, [ '--max-diffs', str(args.max_diffs) ])
+
+    failures = 0
+    for name, ( ref, out ) in pairs.items():
+        removed, added, cut = diffs[name]
+        reason = check(ref, out, removed, added)
+        if not reason:
+            removed, added, cut = cut_diffs[name]
+            reason = check_cut(ref, out, removed, added, bool(cut), args.max_diffs)
+            if reason:
+                reason += ' with --max-diffs {}'.format(args.max_diffs)
+        if reason:
+            failures += 1
+            print('{}: {}, from {} to {}'.format(name, reason, ' '.join(ref), ' '.join(out)))
+    if failures:
+        return 1
+    print('myers: {} random diffs are minimal, and cut by --max-diffs'.format(len(pairs)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+"""
+Check of the performance comparisons of oval.
+
+Typing 'oval_perf.py' writes a target whose duration is read from a file into
+a temporary workdir, and checks that 'oval pf' runs it the given number of
+times, after the warmup runs, records the samples in the history, and tells
+when it becomes slower than the last sessions, or than its reference stats.
+'oval pfr' must give the comparison of the last session, and '--history' must
+bound the sessions of the reference. The exit code is 1 for any mismatch.
+"""
+
+import sys
+import os
+import json
+import tempfile
+
+from oval_helpers import ovalfile, write, read, oval, report
+
+
+targets = '[ { "name" : "t", "command" : "echo run >> runs.txt; sleep $(cat delay.txt)" } ]'
+
+
+def nb_lines(workdir, file_name):
+    return len(read(workdir, file_name).splitlines())
+
+
+def main():
+    checks = []
+    with tempfile.TemporaryDirectory() as workdir:
+        write(workdir, 'ovalfile.py', ovalfile(targets))
+        write(workdir, 'delay.txt', '0\n')
+
+        returncode, output = oval(workdir, 'pf', '--repeat', '3', '--warmup', '1')
+        checks.append(( 'first session', returncode == 0 and output.endswith('(no reference)\n') ))
+        checks.append(( 'number of runs', nb_lines(workdir, 'runs.txt') == 4 ))
+        sessions = [ json.loads(line) for line in read(workdir, os.path.join('.oval', 'perf.jsonl')).splitlines() ]
+        checks.append(( 'history', len(sessions) == 1 and len(sessions[0]['samples']['real']) == 3 ))
+
+        write(workdir, 'delay.txt', '0.3\n')
+        returncode, output = oval(workdir, 'pf', '--repeat', '2', '--warmup', '0')
+        checks.append(( 'slower session', returncode == 1 and output.endswith(' slower\n') ))
+        checks.append(( 'runs without warmup', nb_lines(workdir, 'runs.txt') == 6 ))
+        report_returncode, report_output = oval(workdir, 'pfr')
+        checks.append(( 'perf report', report_returncode == 1 and report_output == output ))
+
+        returncode, output = oval(workdir, 'pf', '--repeat', '1', '--warmup', '0', '--history', '0')
+        checks.append(( 'no history', returncode == 0 and output.endswith('(no reference)\n') ))
+        returncode, output = oval(workdir, 'pf', '--repeat', '1', '--warmup', '0', '--history', '1',
+                                  '--perf-rel-tol', '0.5')
+        checks.append(( 'last session', returncode == 0 and output.endswith(' ==\n') ))
+
+        write(workdir, 't.ref.stats.json', json.dumps({ 'samples': { 'real': [ 5. ] } }))
+        returncode, output = oval(workdir, 'pf', '--repeat', '1', '--warmup', '0')
+        checks.append(( 'reference stats', returncode == 0 and output.startswith('t: real 5.000s -> ')
+                        and output.endswith(' faster\n') ))
+
+    return report('perf', checks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
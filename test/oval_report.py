@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""
+Check of the reports of oval.
+
+Typing 'oval_report.py' writes targets into two temporary workdirs, and
+checks the JSON lines written by 'oval r' and 'oval d' with '--report', with
+the differences cut by '--report-diffs', and that the JUnit file written by
+'--junit' is valid XML, with a test suite per workdir, a test case per target
+and a failure for each failed one. With tolerances, the diff report must give
+the max and mean error of each filter, and the error of each key compared by
+a key/value filter. The exit code is 1 for any mismatch.
+"""
+
+import sys
+import os
+import json
+import tempfile
+import xml.etree.ElementTree
+
+from oval_helpers import ovalfile, write, read, oval, report
+
+
+targets = { 'w1': '''[ { "name" : "ok", "command" : "echo ok" },
+                   { "name" : "ko", "command" : "seq 5" },
+                   { "name" : "bad", "command" : "echo bad; exit 3" } ]''',
+            'w2': '[ { "name" : "t", "command" : "echo t" } ]' }
+
+tolerance_ovalfile = '''targets = [ { "name" : "tol", "command" : "echo x = 1.0004 && echo y = a && echo z = 10" } ]
+run_filters_out = []
+diff_filters_in = [ { "name" : "all", "re": "^(\\w+) = (.*)$", "apply": "tol", "rel_tol": 1e-3 } ]
+'''
+
+
+def records(workdir, file_name):
+    '''Return the records of the report, whose duration must be a number,
+    without this duration.'''
+    result = []
+    for line in read(workdir, file_name).splitlines():
+        record = json.loads(line)
+        if not isinstance(record.pop('duration', None), float):
+            return None
+        result.append(record)
+    return result
+
+
+def diff_record(workdir, name, diffs=0, differences=()):
+    'The expected record of the diff of a target, with its first differences'
+    record = { 'workdir': workdir, 'target': name, 'subcommand': 'diff', 'status': 'failed' if diffs else 'passed',
+               'returncode': 1 if diffs else 0, 'out': os.path.join(workdir, name + '.out'),
+               'ref': os.path.join(workdir, name + '.ref'), 'diffs': diffs }
+    if diffs:
+        record['differences'] = list(differences)
+    return record
+
+
+def junit_cases(root):
+    '''Return the test suites of the JUnit file, with the name and the failure
+    of each test case, or None if the counts of the tests are wrong.'''
+    tree = xml.etree.ElementTree.parse(os.path.join(root, 'report.xml')).getroot()
+    suites = {}
+    for suite in tree.iter('testsuite'):
+        cases = suite.findall('testcase')
+        failures = [ case.find('failure') for case in cases ]
+        if (int(suite.get('tests')) != len(cases) or
+            int(suite.get('failures')) != len([ f for f in failures if f is not None ]) or
+            float(suite.get('time')) < 0):
+            return None
+        suites[suite.get('name')] = [ ( case.get('name'), f is not None and ( f.get('message'), f.text ) )
+                                      for case, f in zip(cases, failures) ]
+    if tree.tag != 'testsuites' or int(tree.get('tests')) != sum(len(cases) for cases in suites.values()):
+        return None
+    return suites
+
+
+def main():
+    checks = []
+    with tempfile.TemporaryDirectory() as root:
+        for workdir in targets:
+            os.mkdir(os.path.join(root, workdir))
+            write(root, os.path.join(workdir, 'ovalfile.py'), ovalfile(targets[workdir]))
+
+        returncode, output = oval(root, 'r', '-j', '1', '--report', 'run.jsonl')
+        run_records = records(root, 'run.jsonl')
+        checks.append(( 'run report', returncode == 1 and run_records is not None and
+                        [ ( r['workdir'], r['target'], r['subcommand'], r['status'], r['returncode'] )
+                          for r in run_records ] ==
+                        [ ( 'w1', 'ok', 'run', 'passed', 0 ), ( 'w1', 'ko', 'run', 'passed', 0 ),
+                          ( 'w1', 'bad', 'run', 'failed', 1 ), ( 'w2', 't', 'run', 'passed', 0 ) ] and
+                        [ r['run']['returncode'] for r in run_records ] == [ 0, 0, 3, 0 ] ))
+
+        write(root, os.path.join('w1', 'ok.ref'), 'ok\n')
+        write(root, os.path.join('w1', 'ko.ref'), '1\n2\nx\n4\n6\n7\n')
+        write(root, os.path.join('w1', 'bad.ref'), 'bad\n')
+        write(root, os.path.join('w2', 't.ref'), 't\n')
+        returncode, output = oval(root, 'd', '--report', 'diff.jsonl', '--junit', 'report.xml', '--report-diffs', '2')
+        checks.append(( 'diff report', returncode == 1 and records(root, 'diff.jsonl') ==
+                        [ diff_record('w1', 'ok'), diff_record('w1', 'ko', 5, [ '- x', '+ 3' ]),
+                          diff_record('w1', 'bad'), diff_record('w2', 't') ] ))
+        checks.append(( 'junit report', junit_cases(root) ==
+                        { 'w1': [ ( 'ok', False ), ( 'ko', ( '5 differences', '- x\n+ 3' ) ), ( 'bad', False ) ],
+                          'w2': [ ( 't', False ) ] } ))
+
+        returncode, output = oval(root, 'd', '--report', 'diff.jsonl', '--report-diffs', '0', 'ko')
+        checks.append(( 'no differences', records(root, 'diff.jsonl') == [ diff_record('w1', 'ko', 5) ] ))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        write(workdir, 'ovalfile.py', tolerance_ovalfile)
+        write(workdir, 'tol.ref', 'x = 1\ny = a\nz = 11\n')
+        oval(workdir, 'r')
+        returncode, output = oval(workdir, 'd', '--report', 'diff.jsonl')
+        errors = records(workdir, 'diff.jsonl')[0].get('errors', {}).get(r'^(\w+) = (.*)$', {})
+        keys = errors.get('keys', {})
+        checks.append(( 'key errors', returncode == 1 and sorted(keys) == [ 'x', 'y', 'z' ] and
+                        abs(keys['x'] - 4e-4) < 1e-9 and keys['y'] is None and keys['z'] == 1 and
+                        errors['max_error'] == 1 and abs(errors['mean_error'] - 0.5002) < 1e-9 ))
+
+    return report('report', checks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
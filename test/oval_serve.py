@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""
+Check of the oval server.
+
+Typing 'oval_serve.py' writes a target into a temporary workdir, starts
+'oval serve' in the background on a temporary socket, and checks that the
+oval commands are executed by the server, with the environment, the umask
+and the resource limits of the client rather than its own, and give back
+their exit status, that a client in another batch job executes its
+command by itself, that
+a modified ovalfile is loaded again, that a socket which is not private is
+ignored, that a second server is refused, and that the server removes its
+socket when interrupted. The exit code is 1 for any mismatch.
+"""
+
+import sys
+import os
+import time
+import signal
+import subprocess
+import tempfile
+
+import oval_helpers
+from oval_helpers import timeout, ovalfile, write, oval_command, report
+
+
+targets = '[ {{ "name" : "t", "command" : "echo {}" }} ]'
+
+
+def oval(workdir, env, *arguments):
+    'Return the return code and the output of the oval command, executed with env'
+    return oval_helpers.oval(workdir, *arguments, env=env, timeout=timeout)
+
+
+def limited_oval(workdir, env, *arguments):
+    'Return the return code and the output of the oval command, with a umask and a stack limit of its own'
+    proc = subprocess.run([ 'bash', '-c', 'umask 027 && ulimit -S -s 4000 && exec "$@"', 'bash' ] +
+                          oval_command(*arguments), cwd=workdir, env=env, timeout=timeout,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    return proc.returncode, proc.stdout
+
+
+def main():
+    checks = []
+    with tempfile.TemporaryDirectory() as root:
+        workdir = os.path.join(root, 'workdir')
+        os.mkdir(workdir)
+        socket_dir = os.path.join(root, 'socket')
+        os.mkdir(socket_dir, 0o700)
+        socket_name = os.path.join(socket_dir, 'oval.sock')
+        write(workdir, 'ovalfile.py', ovalfile(targets.format('$SERVE_CHECK')))
+        env = { name: value for name, value in os.environ.items() if name != 'OVAL_NO_SERVER' }
+        env['OVAL_SOCKET'] = socket_name
+        client_env = dict(env, SERVE_CHECK='client')
+
+        with open(os.path.join(root, 'serve.log'), 'w') as log:
+            server = subprocess.Popen(oval_command('serve'), cwd=workdir, env=dict(env, SERVE_CHECK='server'),
+                                      stdout=log, stderr=subprocess.STDOUT)
+        try:
+            deadline = time.monotonic() + timeout
+            while not os.path.exists(socket_name) and time.monotonic() < deadline:
+                time.sleep(.1)
+            checks.append(( 'start', os.path.exists(socket_name) ))
+
+            # the parent of the shell of the target is a child of the server
+            write(workdir, 'ovalfile.py', ovalfile(targets.format("$(cut -d' ' -f4 /proc/$PPID/stat)")))
+            checks.append(( 'served command', oval(workdir, client_env, 'r') == ( 0, '{}\n'.format(server.pid) ) ))
+            # the command gets the umask and the limits of the client
+            write(workdir, 'ovalfile.py', ovalfile(targets.format(
+                "$(umask) $(ulimit -S -s) $(cut -d' ' -f4 /proc/$PPID/stat)")))
+            checks.append(( 'client limits', limited_oval(workdir, client_env, 'r') ==
+                            ( 0, '0027 4000 {}\n'.format(server.pid) ) ))
+            # the parent of a standalone oval is this script
+            returncode, output = oval(workdir, dict(client_env, SLURM_JOB_ID='1'), 'r')
+            checks.append(( 'other batch job', returncode == 0 and output.split()[-1] == str(os.getpid()) ))
+            write(workdir, 'ovalfile.py', ovalfile(targets.format('$SERVE_CHECK$SERVE_CLIENT')))
+            returncode, output = oval(workdir, env, 'r')
+            checks.append(( 'unset variable', ( returncode, output ) == ( 0, '\n' ) ))
+            returncode, output = oval(workdir, dict(client_env, SERVE_CLIENT='-only'), 'r')
+            checks.append(( 'client variables', ( returncode, output ) == ( 0, 'client-only\n' ) ))
+            write(workdir, 't.ref', 'server\n')
+            checks.append(( 'exit status', oval(workdir, client_env, 'd') == ( 1, 't: - server\nt: + client-only\n' ) ))
+            write(workdir, 'ovalfile.py', ovalfile(targets.format('edited')))
+            checks.append(( 'edited ovalfile', oval(workdir, client_env, 'r') == ( 0, 'edited\n' ) ))
+
+            returncode, output = oval(workdir, client_env, 'serve')
+            checks.append(( 'second server', returncode == 1 and 'a server already listens' in output ))
+            os.chmod(socket_dir, 0o755)
+            returncode, output = oval(workdir, client_env, 'r')
+            os.chmod(socket_dir, 0o700)
+            checks.append(( 'public socket', returncode == 0 and 'not private to the user' in output ))
+        finally:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(timeout)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+        checks.append(( 'stop', server.returncode == 0 and not os.path.exists(socket_name) ))
+
+    return report('serve', checks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
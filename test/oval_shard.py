@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+"""
+Check of the sharding of the targets by oval, and of the merge of the reports.
+
+Typing 'oval_shard.py' writes targets into a temporary workdir, compares them
+with 'oval d --shard i/N' for each shard, and checks that every target is in
+exactly one shard, that the targets which depend on each other stay in the
+same one, and that 'oval merge' of the reports of the shards gives the failed
+target and the global return code. The exit code is 1 for any mismatch.
+"""
+
+import sys
+import tempfile
+
+from oval_helpers import ovalfile, write, oval, report
+
+
+targets = '[ { "name" : "t%d" % i, "command" : "echo %d" % i } for i in range(6) ]'
+
+
+def main():
+    checks = []
+    nb_shards = 3
+    with tempfile.TemporaryDirectory() as workdir:
+        write(workdir, 'ovalfile.py', ovalfile(targets) + 'targets[5]["depends"] = [ "t4" ]\n')
+        oval(workdir, 'r')
+        for i in range(6):
+            write(workdir, 't{}.ref'.format(i), '{}\n'.format(9 if i == 2 else i))
+
+        shards = []
+        returncodes = []
+        for index in range(1, nb_shards + 1):
+            returncode, output = oval(workdir, 'd', '--shard', '{}/{}'.format(index, nb_shards),
+                                      '--report', 'shard{}.jsonl'.format(index))
+            returncodes.append(returncode)
+            shards.append(set(line.partition(':')[0] for line in output.splitlines()))
+        names = sorted(name for shard in shards for name in shard)
+        checks.append(( 'partition of the targets', names == [ 't{}'.format(i) for i in range(6) ] ))
+        checks.append(( 'dependent targets', any({ 't4', 't5' } <= shard for shard in shards) ))
+        checks.append(( 'return codes of the shards',
+                        returncodes == [ 1 if 't2' in shard else 0 for shard in shards ] ))
+
+        returncode, output = oval(workdir, 'merge', *[ 'shard{}.jsonl'.format(index) for index in range(1, nb_shards + 1) ])
+        checks.append(( 'merged reports', returncode == 1 and output.splitlines() ==
+                        [ './t2: 2 differences', '6 targets, 5 passed, 1 failed' ] ))
+        write(workdir, 't2.ref', '2\n')
+        oval(workdir, 'd', '--shard', '1/1', '--report', 'all.jsonl')
+        returncode, output = oval(workdir, 'merge', 'all.jsonl')
+        checks.append(( 'merged passed report', returncode == 0 and output == '6 targets, 6 passed, 0 failed\n' ))
+
+        returncode, output = oval(workdir, 'd', '--shard', '4/3')
+        checks.append(( 'invalid shard', returncode == 2 and 'invalid shard 4/3' in output ))
+
+    return report('shard', checks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,5 +10,72 @@ shopt -s expand_aliases
 oval r &> /dev/null
 oval d &> oval_test.out
 
+# check that a target chained on a compressed log runs after it
+oval r unzip zip &>> oval_test.out
+
+# check the diff engine against a longest common subsequence
+python3 oval_myers.py &>> oval_test.out
+
+# check the filters, merged into a single expression
+python3 oval_filters.py &>> oval_test.out
+
+# check the search of the workdirs, and their index
+python3 oval_workdirs.py &>> oval_test.out
+
+# check the reading of the logs, by chunks
+python3 oval_lines.py &>> oval_test.out
+
+# check the invalidation of the cache of the results
+python3 oval_cache.py &>> oval_test.out
+
+# check the order of the dependent targets, and the skip of the up to date ones
+python3 oval_depends.py &>> oval_test.out
+
+# check the targets told by a failed build
+python3 oval_build.py &>> oval_test.out
+
+# check the asyncio engine, with and without -j
+python3 oval_asyncio.py &>> oval_test.out
+
+# check the JSON lines and JUnit reports
+python3 oval_report.py &>> oval_test.out
+
+# check the sharding of the targets, and the merge of the reports
+python3 oval_shard.py &>> oval_test.out
+
+# check the selection of the changed targets
+python3 oval_changed.py &>> oval_test.out
+
+# check the watcher, with inotify and by polling
+python3 oval_watch.py &>> oval_test.out
+
+# check the server, on a temporary socket
+python3 oval_serve.py &>> oval_test.out
+
+# check the timeouts, and the cpu and memory limits of the runs
+python3 oval_limits.py &>> oval_test.out
+
+# check the perf sessions, and their references
+python3 oval_perf.py &>> oval_test.out
+
+# check that perf rejects the invalid numbers of runs
+oval pf --repeat 0 sleep1 2>&1 | tail -1 >> oval_test.out
+oval pf --warmup -1 sleep1 2>&1 | tail -1 >> oval_test.out
+
+# check that the subcommands reject the invalid numbers of workers
+oval r -j 0 sleep1 2>&1 | tail -1 >> oval_test.out
+
+# check that diff rejects a negative number of differences
+oval d --max-diffs -1 myers 2>&1 | tail -1 >> oval_test.out
+
+# check that watch rejects a negative debounce delay
+oval w --debounce -1 sleep1 2>&1 | tail -1 >> oval_test.out
+
+# check that the reports reject a negative number of differences
+oval d --report-diffs -1 myers 2>&1 | tail -1 >> oval_test.out
+
+# check that the search of the workdirs rejects a negative depth
+oval l --max-depth -3 2>&1 | tail -1 >> oval_test.out
+
 # compare with reference
 diff -s oval_test.out oval_test.ref
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""
+Check of the watch subcommand of oval.
+
+Typing 'oval_watch.py' writes targets into a temporary workdir, starts
+'oval w' in the background, with inotify and then with '--poll', changes the
+files of the workdir, and checks that each burst of changes runs and compares
+again the targets whose inputs changed, with the ones which depend on them,
+compares again the ones whose reference changed, and ignores the temporary
+files. The watcher is interrupted as with Ctrl-C. The exit code is 1 for any
+mismatch.
+"""
+
+import sys
+import os
+import time
+import signal
+import subprocess
+import tempfile
+
+from oval_helpers import timeout, ovalfile, write, read, oval_command, oval_env, oval, report
+
+
+targets = '''[ { "name" : "a", "command" : "cat a.txt", "inputs": [ "a.txt" ] },
+            { "name" : "b", "command" : "cat a.out", "inputs": [ "a.out" ] },
+            { "name" : "c", "command" : "echo c" } ]'''
+
+
+def wait_lines(workdir, pattern, count):
+    '''Wait until the log of the watcher holds count lines starting with
+    pattern, and return the lines since the previous one, or None after the
+    timeout.'''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        lines = read(workdir, '.watch.log').splitlines()
+        found = [ i for i, line in enumerate(lines) if line.startswith(pattern) ]
+        if len(found) >= count:
+            start = found[count - 2] + 1 if count > 1 else 0
+            return lines[start:found[count - 1] + 1]
+        time.sleep(.1)
+    return None
+
+
+def check_watch(workdir, options):
+    'Return the checks of a watcher started with options'
+    oval(workdir, 'r')
+    for name in 'abc':
+        os.replace(os.path.join(workdir, name + '.out'), os.path.join(workdir, name + '.ref'))
+    oval(workdir, 'r')
+
+    checks = []
+    # a hidden file, whose changes are ignored by the watcher
+    with open(os.path.join(workdir, '.watch.log'), 'w') as log:
+        proc = subprocess.Popen(oval_command('w', *options), cwd=workdir, env=oval_env(), stdout=log, stderr=subprocess.STDOUT)
+    try:
+        checks.append(( 'start', wait_lines(workdir, 'watching ', 1) is not None ))
+        write(workdir, 'a.txt', 'A2\n')
+        lines = wait_lines(workdir, '2 targets processed', 1)
+        checks.append(( 'changed input', lines is not None and
+                        [ line for line in lines if line[:2] in ( 'a:', 'b:' ) ] ==
+                        [ 'a: A2', 'a: - A', 'a: + A2', 'b: A2', 'b: - A', 'b: + A2' ] ))
+        write(workdir, 'a.txt~', 'backup\n')
+        write(workdir, 'c.ref', 'x\n')
+        lines = wait_lines(workdir, 'changed: ', 2)
+        checks.append(( 'ignored file', lines is not None and lines[-1] == 'changed: c.ref' ))
+        lines = wait_lines(workdir, '1 targets processed', 1)
+        checks.append(( 'changed reference', lines is not None and 'c: - x' in lines and 'c: + c' in lines and
+                        not [ line for line in lines if line.startswith('c: c') ] ))
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    checks.append(( 'interrupt', proc.returncode != -signal.SIGKILL ))
+    return [ ( '{} with {}'.format(name, ' '.join(options) or 'inotify'), passed ) for name, passed in checks ]
+
+
+def main():
+    checks = []
+    for options in ( [], [ '--poll' ] ):
+        with tempfile.TemporaryDirectory() as workdir:
+            write(workdir, 'ovalfile.py', ovalfile(targets))
+            write(workdir, 'a.txt', 'A\n')
+            checks.extend(check_watch(workdir, options))
+    return report('watch', checks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
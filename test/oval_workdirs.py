@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""
+Check of the search of the workdirs by oval.
+
+Typing 'oval_workdirs.py' writes ovalfiles into a tree of temporary
+directories, and checks that 'oval l' finds them in alphabetical order,
+neither below another ovalfile, nor in the hidden directories and the ones
+matched by '--prune', nor deeper than '--max-depth'. With '--index', the
+directories whose modification time did not change must be taken from
+.oval/workdirs.json rather than scanned again, and an index which cannot
+be written must be silently ignored. The exit code is 1 for any mismatch.
+"""
+
+import sys
+import os
+import json
+import tempfile
+
+from oval_helpers import ovalfile, write, read, oval, report
+
+
+def workdirs(root, *arguments):
+    'Return the relative paths of the workdirs listed by oval, or None if it fails'
+    returncode, output = oval(root, 'l', *arguments)
+    if returncode:
+        return None
+    return [ os.path.relpath(line[6:], os.path.realpath(root)) for line in output.splitlines()
+             if line.startswith('>>>>> ') ]
+
+
+def main():
+    checks = []
+    with tempfile.TemporaryDirectory() as root:
+        for path in [ 'a', os.path.join('a', 'sub'), os.path.join('b', 'c'), '.hidden', '__pycache__',
+                      os.path.join('build', 'x') ]:
+            os.makedirs(os.path.join(root, path))
+            write(root, os.path.join(path, 'ovalfile.py'), ovalfile('[ { "name" : "t", "command" : "echo t" } ]'))
+
+        checks.append(( 'search', workdirs(root) == [ 'a', 'b/c', 'build/x' ] ))
+        checks.append(( 'pruned name', workdirs(root, '--prune', 'bu*') == [ 'a', 'b/c' ] ))
+        checks.append(( 'pruned path', workdirs(root, '--prune', 'b/c') == [ 'a', 'build/x' ] ))
+        checks.append(( 'max depth', workdirs(root, '--max-depth', '1') == [ 'a' ] ))
+
+        index_file_name = os.path.join(root, '.oval', 'workdirs.json')
+        checks.append(( 'new index', workdirs(root, '--index') == [ 'a', 'b/c', 'build/x' ] and
+                        os.path.exists(index_file_name) ))
+        # an unchanged directory is not scanned again, even if the index is wrong
+        entries = json.loads(read(root, index_file_name))
+        path = os.path.join(os.path.realpath(root), 'b', 'c')
+        entries[path][1] = False
+        write(root, index_file_name, json.dumps(entries))
+        checks.append(( 'unchanged directory', workdirs(root, '--index') == [ 'a', 'build/x' ] ))
+        os.utime(path, ( entries[path][0] / 1e9 + 1, entries[path][0] / 1e9 + 1 ))
+        checks.append(( 'modified directory', workdirs(root, '--index') == [ 'a', 'b/c', 'build/x' ] ))
+
+        os.remove(index_file_name)
+        os.rmdir(os.path.dirname(index_file_name))
+        write(root, '.oval', '')
+        checks.append(( 'unwritable index', workdirs(root, '--index') == [ 'a', 'b/c', 'build/x' ] ))
+
+    return report('workdirs', checks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,6 +10,11 @@ targets = [
     { "name" : "keys"  , "command" : "echo A = 1 && echo B = 20 && echo C = 3" },
     { "name" : "sleep1" , "command" : "sleep 1 && echo sleep 1", "time" : "real" },
     { "name" : "sleep2" , "command" : "sleep 2 && echo sleep 2", "time" : "real" },
+    { "name" : "myers" , "command" : "for c in a b c a b b a ; do echo $c ; done" },
+    { "name" : "tol" , "command" : "echo x = 1.0004 && echo y = 2.5 && echo z = 10" },
+    { "name" : "zip" , "command" : "echo LINE 1 && echo LINE 2 && echo LINE 3", "compress" : "gz" },
+    { "name" : "unzip" , "command" : "zcat zip.out.gz", "inputs" : [ "zip.out" ] },
+    { "name" : "digest" , "command" : "echo LINE 1 && echo LINE 2", "digest" : "blake2b" },
 
 ]
 
@@ -20,6 +25,10 @@ diff_filters_in = [
     { "name" : "all", "re": "^(.*)$", "apply": "demo%" },
     { "name" : "all", "re": "^(\w+) = (.*)$", "apply": "keys" },
     { "name" : "all", "re": "^(.*)$", "apply": "sleep%" },
+    { "name" : "all", "re": "^(.*)$", "apply": "myers" },
+    { "name" : "all", "re": "^(\w+) = (.*)$", "apply": "tol", "rel_tol": 1e-3 },
+    { "name" : "all", "re": "^(.*)$", "apply": "%zip" },
+    { "name" : "all", "re": "^(.*)$", "apply": "digest" },
 
 ]
 